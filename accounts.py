@@ -0,0 +1,144 @@
+import glob
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from config import (COOKIE_FILE, INSTAGRAM_COOKIE_DIR, INSTAGRAM_ACCOUNT_LIMITS, INSTAGRAM_ACCOUNT_MAX_WAIT,
+                    ACCOUNT_FAILURE_THRESHOLD, ACCOUNT_COOLDOWN, CIRCUIT_MAX_COOLDOWN)
+from circuit import CLOSED, CircuitBreaker, classify_error
+from ratelimit import TokenBucket
+
+# How much each kind of error lowers an account's health (1.0 = a plain failure)
+ERROR_WEIGHTS = {"auth": 1.0, "rate_limit": 1.0, "network": 0.3, "other": 0.5}
+HEALTH_DECAY = 0.2  # weight of the newest result in the health score
+HEALTH_STEP = 0.2  # accounts within the same step of health count as equally healthy
+
+
+class Account:
+    """One set of Instagram credentials: a cookie file and/or a login."""
+
+    def __init__(self, name: str, cookie_file: str, username: str = "", password: str = ""):
+        self.name = name
+        self.cookie_file = cookie_file
+        self.username = username
+        self.password = password
+        self.bucket = TokenBucket(INSTAGRAM_ACCOUNT_LIMITS["burst"], INSTAGRAM_ACCOUNT_LIMITS["rate"])
+        self.circuit = CircuitBreaker(f"instagram:{name}", ACCOUNT_FAILURE_THRESHOLD, ACCOUNT_COOLDOWN,
+                                      CIRCUIT_MAX_COOLDOWN)
+        self.health = 1.0
+        self.last_used = 0.0
+        self.requests = 0
+        self.errors: Dict[str, int] = {}
+
+
+def load_accounts() -> List[Account]:
+    """Accounts from INSTAGRAM_COOKIE_DIR/<name>.txt and INSTAGRAM_ACCOUNTS="user:password,...".
+
+    A login without a cookie file gets one in the cookie directory. The old
+    cookies.txt with INSTAGRAM_USERNAME/INSTAGRAM_PASSWORD is used when
+    nothing else is configured.
+    """
+    logins = {}
+    for pair in filter(None, os.getenv("INSTAGRAM_ACCOUNTS", "").split(",")):
+        username, _, password = pair.strip().partition(":")
+        logins[username] = password
+
+    accounts = {}
+    for cookie_file in sorted(glob.glob(os.path.join(INSTAGRAM_COOKIE_DIR, "*.txt"))):
+        name = os.path.splitext(os.path.basename(cookie_file))[0]
+        accounts[name] = Account(name, cookie_file, name if name in logins else "", logins.get(name, ""))
+    for username, password in logins.items():
+        if username not in accounts:
+            accounts[username] = Account(username, os.path.join(INSTAGRAM_COOKIE_DIR, f"{username}.txt"),
+                                         username, password)
+    if not accounts:
+        accounts["default"] = Account("default", COOKIE_FILE, os.getenv("INSTAGRAM_USERNAME", ""),
+                                      os.getenv("INSTAGRAM_PASSWORD", ""))
+    return list(accounts.values())
+
+
+class AccountPool:
+    """Hands out Instagram accounts healthiest first, least recently used among equally healthy ones.
+
+    Every account has its own request budget (token bucket), a health score
+    (moving average of its results, lowered according to the error kind) and
+    a circuit breaker: an account that hits a checkpoint or a rate limit is
+    benched at once, one that keeps failing after a few errors, and comes back
+    after a single successful probe. Used from worker threads; every process
+    keeps its own view of the accounts.
+    """
+
+    def __init__(self, accounts: List[Account], max_wait: float):
+        self.accounts = accounts
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Optional[Account]:
+        """Take the healthiest account that is not benched and has budget left.
+
+        Accounts in the same HEALTH_STEP take turns, least recently used
+        first, so a few failures don't pin all traffic on one account; less
+        healthy ones are only used while better ones are out of budget.
+        Waits up to max_wait for budget. Returns None if every account is benched.
+        """
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            with self._lock:
+                now = time.time()
+                wait = None
+                for account in sorted(self.accounts,
+                                      key=lambda account: (-round(account.health / HEALTH_STEP), account.last_used)):
+                    if account.circuit.state != CLOSED and account.circuit.retry_after() > 0:
+                        continue
+                    account_wait = account.bucket.take(now)
+                    if account_wait:
+                        wait = account_wait if wait is None else min(wait, account_wait)
+                        continue
+                    if not account.circuit.allow():
+                        # Another job is probing this account
+                        account.bucket.give_back()
+                        continue
+                    account.last_used = now
+                    account.requests += 1
+                    return account
+            if wait is None or time.monotonic() + wait > deadline:
+                return None
+            time.sleep(wait)
+
+    def report(self, account: Account, error: Optional[str] = None) -> None:
+        """Record the result of a job that used `account`; `error` is its error message."""
+        kind = classify_error(error) if error else None
+        with self._lock:
+            if kind == "content":
+                # The video's fault, not the account's; still ends a probe
+                account.circuit.record_success()
+                return
+            if kind is None:
+                account.health += HEALTH_DECAY * (1 - account.health)
+                account.circuit.record_success()
+                return
+            account.errors[kind] = account.errors.get(kind, 0) + 1
+            account.health -= HEALTH_DECAY * ERROR_WEIGHTS[kind] * account.health
+        if kind in ("auth", "rate_limit"):
+            logging.warning(f"Instagram account {account.name} benched: {kind} ({error[:200]})")
+        account.circuit.record_failure(severe=kind in ("auth", "rate_limit"))
+
+    def available(self) -> int:
+        """Accounts not benched right now."""
+        return sum(1 for account in self.accounts if account.circuit.state == CLOSED)
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        return [{
+            "name": account.name,
+            "state": account.circuit.state,
+            "retry_after": account.circuit.retry_after(),
+            "health": account.health,
+            "requests": account.requests,
+            "errors": dict(account.errors)
+        } for account in self.accounts]
+
+
+# Create global Instagram account pool instance
+instagram_accounts = AccountPool(load_accounts(), max_wait=INSTAGRAM_ACCOUNT_MAX_WAIT)
@@ -0,0 +1,315 @@
+import asyncio
+import gzip
+import io
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.types import FSInputFile
+
+from config import (ADMIN_ID, BACKUP_CHAT_ID, BACKUP_DIR, BACKUP_INTERVAL, BACKUP_FULL_INTERVAL, BACKUP_KEEP,
+                    BACKUP_UPLOAD_MAX, STORAGE_BACKEND, DAILY_STATS_RETENTION)
+from storage import Storage, apply_change, create_storage, default_state
+
+# full-20240101-000000.jsonl.gz, delta-20240101-010000.jsonl.gz: a header line, then one change per line
+TIME_FORMAT = "%Y%m%d-%H%M%S"
+SUFFIX = ".jsonl.gz"
+
+
+def backup_time(name: str) -> datetime:
+    """Creation time of a backup, from its file name."""
+    return datetime.strptime(name[name.index("-") + 1:-len(SUFFIX)], TIME_FORMAT)
+
+
+def read_backup(path: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Header and changes of a backup file."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        return header, [json.loads(line) for line in f]
+
+
+def compare_states(backup: Dict[str, Any], live: Dict[str, Any], since: Optional[str] = None) -> List[str]:
+    """Differences between two database states, one line per part; empty if they match.
+
+    Daily stats older than `since` are left out: the SQLite backend keeps
+    them on disk but doesn't load them.
+    """
+    differences = []
+
+    def compare(what: str, expected: Dict[str, Any], actual: Dict[str, Any]) -> None:
+        missing = len(expected.keys() - actual.keys())
+        extra = len(actual.keys() - expected.keys())
+        changed = sum(1 for key in expected.keys() & actual.keys() if expected[key] != actual[key])
+        if missing or extra or changed:
+            differences.append(f"{what}: {missing} missing, {extra} extra, {changed} different")
+
+    compare("users", backup["user_data"]["users"], live["user_data"]["users"])
+    for kind in ("banned", "premium", "unreachable"):
+        compare(kind, dict.fromkeys(backup["user_data"].get(kind, [])), dict.fromkeys(live["user_data"].get(kind, [])))
+    compare("user stats", backup["stats"]["users"], live["stats"]["users"])
+    compare("daily stats", {day: counts for day, counts in backup["stats"]["daily"].items()
+                            if since is None or day >= since}, live["stats"]["daily"])
+    for key in ("total_downloads", "platforms"):
+        if backup["stats"][key] != live["stats"][key]:
+            differences.append(f"{key}: {backup['stats'][key]} in the backup, {live['stats'][key]} live")
+    return differences
+
+
+class BackupManager:
+    """Scheduled, compressed, full and incremental backups of the database.
+
+    The storage commits its queued changes and streams the committed state,
+    or only the changes since the previous backup, into a gzipped file from a
+    worker thread; the event loop keeps queueing changes meanwhile and they
+    go into the next backup. A full backup is taken every `full_interval`
+    and on the first run after a start, a delta every `interval` otherwise.
+    A full backup and the deltas after it form a chain; the last `keep`
+    chains are kept. The schedule follows the file times, so a restart
+    doesn't postpone it. Each new file is sent once to the backup chat when
+    it is at most `upload_max` bytes.
+    """
+
+    def __init__(self, directory: str, interval: float, full_interval: float, keep: int, upload_max: int):
+        self.directory = directory
+        self.interval = interval
+        self.full_interval = full_interval
+        self.keep = keep
+        self.upload_max = upload_max
+        self._storage: Optional[Storage] = None
+        self._bot = None
+        self._task: Optional[asyncio.Task] = None
+        # Chain the next delta belongs to: its full backup and the sequence number of the last file
+        self._base: Optional[str] = None
+        self._seq = 0
+        self.last: Optional[Dict[str, Any]] = None
+        self.stored = {"files": 0, "bytes": 0}
+        self.counters = {"full": 0, "delta": 0, "failed": 0, "uploaded": 0}
+
+    def list_backups(self) -> List[str]:
+        """Backup file names, oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        names = [name for name in os.listdir(self.directory)
+                 if name.startswith(("full-", "delta-")) and name.endswith(SUFFIX)]
+        return sorted(names, key=backup_time)
+
+    def chain(self, name: Optional[str] = None) -> List[str]:
+        """The full backup and the deltas that restore backup `name` (by default the latest one)."""
+        names = self.list_backups()
+        if name is not None:
+            if name not in names:
+                raise FileNotFoundError(f"No backup {name} in {self.directory}")
+            names = names[:names.index(name) + 1]
+        for i in range(len(names) - 1, -1, -1):
+            if names[i].startswith("full-"):
+                return names[i:]
+        return []
+
+    def restore_state(self, name: Optional[str] = None) -> Dict[str, Any]:
+        """The database state as of backup `name`, rebuilt from its chain."""
+        chain = self.chain(name)
+        if not chain:
+            raise FileNotFoundError(f"No full backup in {self.directory}")
+        state = default_state()
+        for seq, file_name in enumerate(chain):
+            header, changes = read_backup(os.path.join(self.directory, file_name))
+            if seq and (header.get("base") != chain[0] or header.get("seq") != seq):
+                raise ValueError(f"{file_name} doesn't follow {chain[seq - 1]}: a delta is missing")
+            for change in changes:
+                apply_change(state, change)
+        return state
+
+    def _export(self, full: bool) -> Dict[str, Any]:
+        """Write a backup file. Blocking, runs in a worker thread."""
+        os.makedirs(self.directory, exist_ok=True)
+        started = time.monotonic()
+        created = datetime.now()
+        tmp_path = os.path.join(self.directory, ".backup.tmp")
+        records = 0
+
+        try:
+            with open(tmp_path, "wb") as raw:
+                with io.TextIOWrapper(gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6),
+                                      encoding="utf-8") as f:
+                    def begin(is_full: bool) -> None:
+                        f.write(json.dumps({
+                            "backup": "full" if is_full else "delta",
+                            "created": created.isoformat(timespec="seconds"),
+                            "base": None if is_full else self._base,
+                            "seq": 0 if is_full else self._seq + 1
+                        }) + "\n")
+
+                    def write(line: str) -> None:
+                        nonlocal records
+                        f.write(line)
+                        f.write("\n")
+                        records += 1
+
+                    full = self._storage.export(full, begin, write)
+                raw.flush()
+                os.fsync(raw.fileno())
+            name = f"{'full' if full else 'delta'}-{created.strftime(TIME_FORMAT)}{SUFFIX}"
+            path = os.path.join(self.directory, name)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        if full:
+            self._base, self._seq = name, 0
+        else:
+            self._seq += 1
+        return {"name": name, "full": full, "records": records, "bytes": os.path.getsize(path),
+                "seconds": time.monotonic() - started, "created": created}
+
+    def _prune(self) -> None:
+        """Delete the chains older than the last `keep` ones."""
+        names = self.list_backups()
+        fulls = [i for i, name in enumerate(names) if name.startswith("full-")]
+        cutoff = fulls[-self.keep] if len(fulls) > self.keep else (fulls[0] if fulls else 0)
+        for name in names[:cutoff]:
+            os.remove(os.path.join(self.directory, name))
+        kept = names[cutoff:]
+        self.stored = {"files": len(kept),
+                       "bytes": sum(os.path.getsize(os.path.join(self.directory, name)) for name in kept)}
+
+    def _full_due(self) -> bool:
+        chain = self.chain()
+        return not chain or (datetime.now() - backup_time(chain[0])).total_seconds() >= self.full_interval
+
+    async def backup(self, full: bool = False) -> Optional[Dict[str, Any]]:
+        """Take a backup now: a full one if `full` or if one is due, a delta otherwise."""
+        loop = asyncio.get_running_loop()
+        try:
+            full = full or await loop.run_in_executor(None, self._full_due)
+            result = await loop.run_in_executor(None, self._export, full)
+            await loop.run_in_executor(None, self._prune)
+        except Exception as e:
+            self.counters["failed"] += 1
+            logging.error(f"Backup failed: {e}")
+            return None
+        self.counters["full" if result["full"] else "delta"] += 1
+        self.last = result
+        logging.info(f"Backup {result['name']}: {result['records']} records, "
+                     f"{result['bytes'] / 1024:.0f} KB in {result['seconds']:.1f}s")
+        await self._upload(result)
+        return result
+
+    async def _upload(self, result: Dict[str, Any]) -> None:
+        chat_id = BACKUP_CHAT_ID or ADMIN_ID
+        if self._bot is None or not chat_id:
+            return
+        if result["bytes"] > self.upload_max:
+            logging.warning(f"Backup {result['name']} is too large to upload ({result['bytes'] / 1024 / 1024:.0f} MB)")
+            return
+        try:
+            await self._bot.send_document(chat_id, FSInputFile(os.path.join(self.directory, result["name"])),
+                                          caption=f"Backup {result['name']}")
+            self.counters["uploaded"] += 1
+        except Exception as e:
+            logging.error(f"Error sending backup: {e}")
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if self.last is not None:
+                last = self.last["created"]
+            else:
+                # First run: continue the schedule of the files already there
+                names = await loop.run_in_executor(None, self.list_backups)
+                last = backup_time(names[-1]) if names else None
+            delay = self.interval - (datetime.now() - last).total_seconds() if last else 0.0
+            await asyncio.sleep(max(0.0, delay))
+            if await self.backup() is None:
+                # Don't retry in a tight loop; the schedule resumes after the next success
+                await asyncio.sleep(min(self.interval, 300))
+
+    def start(self, bot, storage: Storage) -> None:
+        """Start the backup schedule for `storage`, sending files with `bot`."""
+        self._bot = bot
+        self._storage = storage
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.counters, **self.stored, "last": self.last}
+
+
+# Create global backup manager instance
+backup_manager = BackupManager(
+    directory=BACKUP_DIR,
+    interval=BACKUP_INTERVAL,
+    full_interval=BACKUP_FULL_INTERVAL,
+    keep=BACKUP_KEEP,
+    upload_max=BACKUP_UPLOAD_MAX * 1024 * 1024
+)
+
+
+def main(args: List[str]) -> int:
+    """python backup.py list | verify [name] | restore [name] --force
+
+    verify rebuilds a backup (the latest by default) and compares it with the
+    data the bot would load now. restore replaces that data with the backup
+    and checks the result by loading it back. Stop the bot before restoring.
+    """
+    command = args[0] if args else "list"
+    name = next((arg for arg in args[1:] if not arg.startswith("--")), None)
+    since = None
+    if STORAGE_BACKEND == "sqlite":
+        since = (datetime.now() - timedelta(days=DAILY_STATS_RETENTION)).strftime("%Y-%m-%d")
+
+    if command == "list":
+        for file_name in backup_manager.list_backups():
+            size = os.path.getsize(os.path.join(BACKUP_DIR, file_name))
+            print(f"{file_name}  {size / 1024:.0f} KB")
+        return 0
+    if command not in ("verify", "restore"):
+        print(main.__doc__)
+        return 2
+
+    try:
+        state = backup_manager.restore_state(name)
+    except (OSError, ValueError) as e:
+        print(f"Can't read the backup: {e}")
+        return 1
+    print(f"Backup {' + '.join(backup_manager.chain(name))}: {len(state['user_data']['users'])} users")
+    storage = create_storage(STORAGE_BACKEND)
+    try:
+        differences = compare_states(state, storage.load(), since)
+        if command == "verify":
+            print("\n".join(differences) if differences else "Matches the live data")
+            return 1 if differences else 0
+
+        if not differences:
+            print("The live data already matches the backup")
+            return 0
+        print("The restore will change:\n" + "\n".join(differences))
+        if "--force" not in args:
+            print("Run again with --force to restore (with the bot stopped)")
+            return 1
+        storage.import_state(state)
+    finally:
+        storage.close()
+
+    # Read back through a fresh storage, the way the bot will load it
+    storage = create_storage(STORAGE_BACKEND)
+    try:
+        differences = compare_states(state, storage.load(), since)
+    finally:
+        storage.close()
+    print("\n".join(differences) if differences else "Restored and verified")
+    return 1 if differences else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
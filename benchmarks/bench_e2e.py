@@ -0,0 +1,407 @@
+"""Offline end-to-end load test of the bot.
+
+Usage: python benchmarks/bench_e2e.py [--users N] [--links M] [--videos V] [--size-kb KB]
+                                      [--premium] [--output FILE]
+
+Everything runs locally:
+
+- a fake Telegram Bot API (getUpdates, sendMessage, sendVideo, ...) on aiohttp;
+- a media server that serves synthetic videos;
+- a stub yt-dlp extractor for tiktok.com/@bench/video/<n> URLs that points
+  at the media server.
+
+The real `dp` from bot.py polls the fake API. Each simulated user sends
+/start, picks a language and then sends M links one after another, waiting
+for the video before sending the next, like a person would. Latency is
+measured from the moment getUpdates hands a link to the bot until the
+matching sendVideo arrives.
+
+The bot runs in a scratch directory, so data/, downloads/ and logs/ of the
+checkout are never touched. Results are printed and written as JSON
+(benchmarks/results/e2e_<timestamp>.json by default) so runs can be
+compared over time. Per-user and platform rate limits are lifted, since
+they would otherwise dominate the numbers.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform as platform_info
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+BENCH_TOKEN = "123456:BENCHMARKbenchmarkBENCHMARKbenchmark"
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=20, help="simulated users")
+    parser.add_argument("--links", type=int, default=5, help="links sent by each user")
+    parser.add_argument("--videos", type=int, default=0,
+                        help="distinct videos to pick links from (default: every link is distinct)")
+    parser.add_argument("--size-kb", type=int, default=2048, help="size of each synthetic video")
+    parser.add_argument("--premium", action="store_true", help="simulate premium users (larger size cap)")
+    parser.add_argument("--timeout", type=float, default=600, help="give up after this many seconds")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/e2e_<timestamp>.json)")
+    return parser.parse_args()
+
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+class MediaServer:
+    """Serves /<video id>.mp4 as `size` bytes of synthetic data from a background thread."""
+
+    def __init__(self, size: int):
+        payload = (b"\x00\x00\x00\x18ftypmp42" + bytes(range(256)) * (size // 256 + 1))[:size]
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "video/mp4")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+
+
+def install_bench_extractor(media_url: str, size: int) -> None:
+    """Make every pooled downloader resolve bench URLs through a stub extractor."""
+    from yt_dlp.extractor.common import InfoExtractor
+    from ydlpool import ydl_pool
+
+    class BenchIE(InfoExtractor):
+        IE_NAME = "bench"
+        _VALID_URL = r"https?://(?:www\.)?tiktok\.com/@bench/video/(?P<id>\d+)"
+
+        def _real_extract(self, url):
+            video_id = self._match_id(url)
+            return {
+                "id": video_id,
+                "title": f"bench {video_id}",
+                "duration": 15,
+                "formats": [{
+                    "format_id": "h264",
+                    "url": f"{media_url}/{video_id}.mp4",
+                    "ext": "mp4",
+                    "protocol": "http",
+                    "vcodec": "h264",
+                    "acodec": "aac",
+                    "height": 720,
+                    "filesize": size
+                }]
+            }
+
+    create = ydl_pool._create
+
+    def create_with_bench_extractor(platform: str, account=None):
+        ydl = create(platform, account)
+        ydl._ies, ydl._ies_instances = {}, {}
+        ydl.add_info_extractor(BenchIE())
+        return ydl
+
+    ydl_pool._create = create_with_bench_extractor
+
+
+class FakeTelegram:
+    """Just enough of the Bot API for the bot's polling and reply paths."""
+
+    def __init__(self):
+        self.updates: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        self.update_id = 0
+        self.message_id = 0
+        # chat_id -> replies sent to that chat: ("video", file_id) or ("text", text)
+        self.replies: Dict[int, "asyncio.Queue[tuple]"] = {}
+        self.delivered_at: Dict[int, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.uploaded_bytes = 0
+        self.url = ""
+        self._runner = None
+
+    def push_text(self, chat_id: int, text: str) -> None:
+        self.update_id += 1
+        self.message_id += 1
+        self.updates.put_nowait({
+            "update_id": self.update_id,
+            "message": {
+                "message_id": self.message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": f"User{chat_id}",
+                         "username": f"user{chat_id}"},
+                "text": text
+            }
+        })
+
+    def chat_replies(self, chat_id: int) -> "asyncio.Queue[tuple]":
+        if chat_id not in self.replies:
+            self.replies[chat_id] = asyncio.Queue()
+        return self.replies[chat_id]
+
+    def _message(self, chat_id: int, **fields) -> Dict[str, Any]:
+        self.message_id += 1
+        return {"message_id": self.message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, **fields}
+
+    async def _get_updates(self, params) -> List[Dict[str, Any]]:
+        timeout = float(params.get("timeout") or 0)
+        batch = []
+        try:
+            batch.append(await asyncio.wait_for(self.updates.get(), timeout or 0.1))
+        except asyncio.TimeoutError:
+            return []
+        while not self.updates.empty() and len(batch) < 100:
+            batch.append(self.updates.get_nowait())
+        now = time.perf_counter()
+        for update in batch:
+            self.delivered_at[update["update_id"]] = now
+        return batch
+
+    async def _handle(self, request):
+        from aiohttp import web
+
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = await request.post()
+        chat_id = int(params.get("chat_id", 0) or 0)
+
+        if method == "getMe":
+            result: Any = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif method == "getUpdates":
+            result = await self._get_updates(params)
+        elif method in ("deleteWebhook", "answerCallbackQuery"):
+            result = True
+        elif method == "sendVideo":
+            video = params.get("video")
+            if hasattr(video, "file"):
+                self.uploaded_bytes += len(video.file.read())
+                file_id = f"bench-file-{self.message_id}"
+            else:
+                file_id = str(video)
+            result = self._message(chat_id, video={
+                "file_id": file_id, "file_unique_id": file_id, "width": 720, "height": 1280, "duration": 15
+            })
+            self.chat_replies(chat_id).put_nowait(("video", file_id))
+        else:
+            result = self._message(chat_id, text=params.get("text", ""))
+            self.chat_replies(chat_id).put_nowait(("text", params.get("text", "")))
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self) -> None:
+        from aiohttp import web
+
+        app = web.Application(client_max_size=2 * 1024 ** 3)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+
+
+def dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+async def sample_resources(workdir: str, peaks: Dict[str, int], stop: asyncio.Event) -> None:
+    import psutil
+
+    process = psutil.Process()
+    while not stop.is_set():
+        peaks["rss"] = max(peaks["rss"], process.memory_info().rss)
+        peaks["disk"] = max(peaks["disk"], dir_size(os.path.join(workdir, "downloads")) +
+                            dir_size(os.path.join(workdir, "cache")))
+        try:
+            await asyncio.wait_for(stop.wait(), 0.05)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def simulate_user(api: FakeTelegram, chat_id: int, links: List[str], premium: bool,
+                        latencies: List[float], failures: List[str]) -> None:
+    from database import db
+    from translations import TRANSLATIONS
+
+    replies = api.chat_replies(chat_id)
+    for text in ("/start", "🇬🇧 English"):
+        api.push_text(chat_id, text)
+        await replies.get()
+    if premium:
+        db.toggle_premium(str(chat_id))
+
+    for link in links:
+        api.push_text(chat_id, link)
+        update_id = api.update_id
+        while True:
+            try:
+                kind, text = await asyncio.wait_for(replies.get(), 120)
+            except asyncio.TimeoutError:
+                kind, text = "text", "timeout"
+            if kind == "video":
+                latencies.append(time.perf_counter() - api.delivered_at[update_id])
+                break
+            if text != TRANSLATIONS["en"]["downloading"]:
+                failures.append(f"{link}: {text}")
+                break
+
+
+async def run(args: argparse.Namespace, workdir: str) -> Dict[str, Any]:
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    import bot as bot_module
+    from ratelimit import rate_limiter, TokenBucket
+
+    # bot.py logs every update at INFO
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # Measure the pipeline, not the quotas
+    for tier in rate_limiter.tiers:
+        rate_limiter.tiers[tier] = {"unlimited": True}
+    for name in list(rate_limiter._platforms):
+        rate_limiter._platforms[name] = TokenBucket(1e9, 1e9)
+
+    size = args.size_kb * 1024
+    media = MediaServer(size)
+    media.start()
+    install_bench_extractor(media.url, size)
+
+    api = FakeTelegram()
+    await api.start()
+    bench_bot = Bot(BENCH_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(api.url)))
+    polling = asyncio.create_task(bot_module.dp.start_polling(bench_bot, handle_signals=False))
+
+    videos = args.videos or args.users * args.links
+    latencies: List[float] = []
+    failures: List[str] = []
+    peaks = {"rss": 0, "disk": 0}
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_resources(workdir, peaks, stop))
+
+    started = time.perf_counter()
+    users = [
+        simulate_user(api, 1000 + user, [
+            f"https://www.tiktok.com/@bench/video/{(user * args.links + n) % videos + 1}" for n in range(args.links)
+        ], args.premium, latencies, failures)
+        for user in range(args.users)
+    ]
+    try:
+        await asyncio.wait_for(asyncio.gather(*users), args.timeout)
+    except asyncio.TimeoutError:
+        print(f"Timed out after {args.timeout}s")
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await sampler
+    await bot_module.dp.stop_polling()
+    await polling
+    await bench_bot.session.close()
+    await api.stop()
+    media.stop()
+    bot_module.download_executor.shutdown(wait=True)
+    bot_module.db.close()
+
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform_info.python_version(),
+        "params": {"users": args.users, "links": args.links, "videos": videos, "size_kb": args.size_kb,
+                   "premium": args.premium},
+        "results": {
+            "completed": len(latencies),
+            "failed": len(failures),
+            "failures": failures[:10],
+            "elapsed_s": round(elapsed, 3),
+            "throughput_per_s": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 0.50) * 1000, 1),
+                "p95": round(percentile(latencies, 0.95) * 1000, 1),
+                "p99": round(percentile(latencies, 0.99) * 1000, 1),
+                "mean": round(statistics.mean(latencies) * 1000, 1) if latencies else 0.0,
+                "max": round(max(latencies) * 1000, 1) if latencies else 0.0
+            },
+            "peak_rss_mb": round(peaks["rss"] / 1024 / 1024, 1),
+            "peak_disk_mb": round(peaks["disk"] / 1024 / 1024, 1),
+            "uploaded_mb": round(api.uploaded_bytes / 1024 / 1024, 1),
+            "api_calls": api.calls
+        }
+    }
+
+
+def main() -> None:
+    args = parse_args()
+    output = args.output or os.path.join(
+        REPO_DIR, "benchmarks", "results", f"e2e_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    output = os.path.abspath(output)
+
+    # Configure the bot before it is imported: scratch working directory, no real services
+    workdir = tempfile.mkdtemp(prefix="bench_e2e_")
+    os.environ.update({
+        "TOKEN": BENCH_TOKEN,
+        "ADMIN_ID": "1",
+        "STORAGE_BACKEND": "json",
+        "DOWNLOAD_POOL": "thread",
+        "METRICS_PORT": "0"
+    })
+    os.chdir(workdir)
+    try:
+        report = asyncio.run(run(args, workdir))
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = report["results"]
+    print(f"{results['completed']} videos delivered, {results['failed']} failed in {results['elapsed_s']}s "
+          f"({results['throughput_per_s']}/s)")
+    print("latency ms: " + ", ".join(f"{name} {value}" for name, value in results["latency_ms"].items()))
+    print(f"peak RSS {results['peak_rss_mb']} MB, peak disk {results['peak_disk_mb']} MB")
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
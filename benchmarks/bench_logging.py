@@ -0,0 +1,106 @@
+"""Cost of a log call on the calling thread: direct FileHandler vs the queue pipeline.
+
+Usage: python benchmarks/bench_logging.py [--records N] [--jobs N] [--write-delay MS]
+
+"direct" is the old setup, a FileHandler and a StreamHandler written by the
+thread that logs (the event loop in the bot). "queue" is logpipe's
+setup_logging(): the caller only enqueues, a background thread writes and
+rotates. Reported per setup: microseconds per call on the calling thread
+(mean, p99, max) for warnings, for a hot INFO line and for job records, and
+how many records reached the files. Logs go to a temporary directory,
+console output to /dev/null. --write-delay makes every write to a log file
+take that long, like a busy or network-backed disk. No network access is
+needed.
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logpipe
+from logpipe import JobRecord, JobLog, setup_logging, shutdown_logging
+
+
+def slow_disk(delay: float) -> None:
+    """Make every flush of a log file sleep `delay` seconds."""
+    flush = logging.StreamHandler.flush
+
+    def slow_flush(handler: logging.StreamHandler) -> None:
+        if isinstance(handler, logging.FileHandler):
+            time.sleep(delay)
+        flush(handler)
+
+    logging.StreamHandler.flush = slow_flush
+
+
+def measure(call: Callable[[int], None], count: int) -> Dict[str, float]:
+    durations: List[float] = []
+    for i in range(count):
+        started = time.perf_counter()
+        call(i)
+        durations.append(time.perf_counter() - started)
+    durations.sort()
+    return {"mean": sum(durations) / count * 1e6, "p99": durations[int(count * 0.99)] * 1e6,
+            "max": durations[-1] * 1e6}
+
+
+def run(setup: str, records: int, jobs: int, workdir: str) -> Dict[str, Dict[str, float]]:
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    log_file = os.path.join(workdir, f"{setup}.log")
+    if setup == "direct":
+        logging.basicConfig(level=logging.INFO, format=logpipe.LOG_FORMAT,
+                            handlers=[logging.FileHandler(log_file), logging.StreamHandler()])
+    else:
+        logpipe.LOG_DIR = workdir
+        setup_logging(setup)
+    job_log = JobLog(rate=50, slow=30)
+    job = JobRecord("1", "100000007", "tiktok", "tiktok:7312345678901234567")
+    job.add_stage("extract", 0.8)
+    job.add_stage("download_memory", 1.7)
+    job.add_bytes(4 * 1024 * 1024)
+
+    result = {
+        "warning": measure(lambda i: logging.warning(f"Error delivering https://vm.tiktok.com/x{i} to 100: timeout"),
+                           records),
+        "hot info": measure(lambda i: logging.info(f"Resolved short link {i}"), records),
+        "job record": measure(lambda i: job_log.finish(job, "downloaded", 2.5), jobs),
+    }
+    if setup == "direct":
+        for handler in root.handlers:
+            handler.flush()
+        written = sum(1 for _ in open(log_file, encoding="utf-8"))
+    else:
+        shutdown_logging()
+        written = sum(1 for name in (f"{setup}.log", "jobs.jsonl")
+                      for _ in open(os.path.join(workdir, name), encoding="utf-8"))
+    result["written"] = {"mean": written, "p99": 0, "max": 0}
+    return result
+
+
+def main() -> None:
+    args = sys.argv[1:]
+    records = int(args[args.index("--records") + 1]) if "--records" in args else 20000
+    jobs = int(args[args.index("--jobs") + 1]) if "--jobs" in args else 20000
+    if "--write-delay" in args:
+        slow_disk(float(args[args.index("--write-delay") + 1]) / 1000)
+    sys.stderr = open(os.devnull, "w")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = {setup: run(setup, records, jobs, workdir) for setup in ("direct", "queue")}
+    print(f"{'':<12} {'direct mean / p99 / max us':>30} {'queue mean / p99 / max us':>30}")
+    for kind in ("warning", "hot info", "job record"):
+        direct, queue = results["direct"][kind], results["queue"][kind]
+        print(f"{kind:<12} {direct['mean']:>10.1f} {direct['p99']:>8.1f} {direct['max']:>10.1f} "
+              f"{queue['mean']:>10.1f} {queue['p99']:>8.1f} {queue['max']:>10.1f}")
+    print(f"{'lines written':<12} {results['direct']['written']['mean']:>10.0f} "
+          f"{results['queue']['written']['mean']:>30.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Link parsing throughput and a fuzz pass over the canonicalizer.
+
+Usage: python benchmarks/bench_urls.py [rounds] [--fuzz N] [--seed S]
+
+Every link of benchmarks/data/url_corpus.txt is checked against its
+expected key first. Then parse() and find_urls() (links inside message
+text) are timed against "legacy", the substring and regex checks that
+get_platform() and get_video_key() used before, with parse() timed both
+uncached and through its memo (repeat links). Finally N mutated links
+(cut, case-flipped, padded with junk, given extra query parameters) are
+run through the parser, which must never raise and must return canonical
+URLs that parse back to themselves. No network access is needed.
+"""
+import os
+import random
+import re
+import string
+import sys
+import time
+from typing import Callable, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from urlcanon import find_urls, parse
+
+CORPUS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "url_corpus.txt")
+
+LEGACY_TIKTOK_ID = re.compile(r'tiktok\.com/.*?/(?:video|photo)/(\d+)')
+LEGACY_INSTAGRAM_ID = re.compile(r'instagram\.com/(?:[\w.]+/)?(?:p|reels?|tv)/([\w-]+)')
+
+
+def legacy_key(url: str) -> Optional[str]:
+    """get_platform() + get_video_key() as they were before urlcanon."""
+    if not re.search(r'(tiktok\.com|instagram\.com)', url):
+        return None
+    url = url.strip()
+    platform = "tiktok" if "tiktok.com" in url else "instagram"
+    pattern = LEGACY_TIKTOK_ID if platform == "tiktok" else LEGACY_INSTAGRAM_ID
+    match = pattern.search(url)
+    if match:
+        return f"{platform}:{match.group(1)}"
+    return f"{platform}:{url.split('#')[0].split('?')[0].rstrip('/')}"
+
+
+def load_corpus() -> List[Tuple[str, str]]:
+    corpus = []
+    with open(CORPUS_FILE, encoding="utf-8") as f:
+        for line in f:
+            if line.strip() and not line.startswith("#"):
+                expected, url = line.rstrip("\n").split("\t")
+                corpus.append((expected, url))
+    return corpus
+
+
+def check_corpus(corpus: List[Tuple[str, str]]) -> int:
+    failures = 0
+    for expected, url in corpus:
+        canonical = parse(url)
+        got = canonical.key if canonical else "-"
+        if got != expected:
+            failures += 1
+            print(f"MISMATCH {url!r}: expected {expected}, got {got}")
+    legacy_distinct = len({legacy_key(url) for expected, url in corpus if expected != "-"})
+    distinct = len({expected for expected, url in corpus if expected != "-"})
+    print(f"corpus: {len(corpus)} links, {failures} mismatches; "
+          f"{distinct} distinct keys (legacy parsing: {legacy_distinct})")
+    return failures
+
+
+def measure(name: str, func: Callable[[str], object], inputs: List[str], rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for value in inputs:
+            func(value)
+    elapsed = time.perf_counter() - started
+    rate = rounds * len(inputs) / elapsed
+    print(f"{name:>18} {rate:>12,.0f} /s  {elapsed / (rounds * len(inputs)) * 1e6:7.2f} us each")
+    return rate
+
+
+def mutate(url: str, rng: random.Random) -> str:
+    choice = rng.randrange(7)
+    if choice == 0:
+        return url[:rng.randrange(len(url) + 1)]
+    if choice == 1:
+        return "".join(c.upper() if rng.random() < 0.3 else c for c in url)
+    if choice == 2:
+        junk = "".join(rng.choice(string.printable) for _ in range(rng.randrange(1, 20)))
+        position = rng.randrange(len(url) + 1)
+        return url[:position] + junk + url[position:]
+    if choice == 3:
+        separator = "&" if "?" in url else "?"
+        return f"{url}{separator}utm_source={rng.randrange(10 ** 6)}&_t={rng.random()}#{rng.randrange(99)}"
+    if choice == 4:
+        return f"look at this {url}, and this: {url}!"
+    if choice == 5:
+        return url.replace("/", "//", 1) if rng.random() < 0.5 else url.replace(".", "", 1)
+    return "".join(rng.choice(string.printable) for _ in range(rng.randrange(80)))
+
+
+def fuzz(corpus: List[Tuple[str, str]], count: int, seed: int) -> int:
+    rng = random.Random(seed)
+    urls = [url for _, url in corpus]
+    failures = 0
+    for _ in range(count):
+        value = mutate(rng.choice(urls), rng)
+        try:
+            for canonical in find_urls(value) + [parse(value)]:
+                if canonical is None or canonical.short:
+                    continue
+                again = parse(canonical.url)
+                if again is None or again.key != canonical.key or again.url != canonical.url:
+                    raise AssertionError(f"not idempotent: {canonical} -> {again}")
+        except Exception as e:
+            failures += 1
+            if failures <= 10:
+                print(f"FUZZ FAILURE {value!r}: {e!r}")
+    print(f"fuzz: {count} mutated inputs (seed {seed}), {failures} failures")
+    return failures
+
+
+def main() -> None:
+    args = sys.argv[1:]
+    fuzz_count = int(args[args.index("--fuzz") + 1]) if "--fuzz" in args else 20000
+    seed = int(args[args.index("--seed") + 1]) if "--seed" in args else 1
+    rounds = int(args[0]) if args and not args[0].startswith("--") else 2000
+
+    corpus = load_corpus()
+    failures = check_corpus(corpus)
+    urls = [url for _, url in corpus]
+    messages = [f"смотри {url} это огонь" for url in urls]
+    print()
+    legacy = measure("legacy key", legacy_key, urls, rounds)
+    cold = measure("parse (no memo)", parse.__wrapped__, urls, rounds)
+    memoized = measure("parse", parse, urls, rounds)
+    measure("find_urls in text", find_urls, messages, rounds)
+    print(f"vs legacy: {cold / legacy:.2f}x uncached, {memoized / legacy:.2f}x memoized\n")
+    failures += fuzz(corpus, fuzz_count, seed)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Memory and startup cost of the in-memory user store at 10k-1M users.
+
+Usage: python benchmarks/bench_users.py [--sizes 10000,100000,1000000] [--lookups N]
+
+For each size a synthetic user_data.json (the format JournalStorage
+writes) is generated in a temporary directory and loaded two ways:
+"legacy", a dict per user with banned/premium lists and the full-state copy
+the journal writer used to make, and "compact", User records from
+load_users() with dict-backed membership and only the stats copied.
+Reported: load time, memory held by the Database's user data and by the
+whole loaded state including the writer's copy (tracemalloc), and the rate
+of ban/premium checks as done on every message. No network access is needed.
+"""
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from users import load_users, to_epoch
+
+LANGUAGES = ["ru", "en", "hy", None]
+
+
+def generate(count: int, seed: int = 1) -> Dict[str, Any]:
+    """State shaped like data/user_data.json and data/stats.json."""
+    rng = random.Random(seed)
+    now = int(time.time())
+    users = {}
+    for i in range(count):
+        joined = now - rng.randrange(365 * 86400)
+        users[str(100000000 + i * 7)] = {
+            "language": rng.choice(LANGUAGES),
+            "username": f"user_{i}" if rng.random() < 0.7 else None,
+            "first_name": f"Name{i % 5000}",
+            "last_name": f"Surname{i % 3000}" if rng.random() < 0.4 else None,
+            "join_date": joined,
+            "last_activity": joined + rng.randrange(now - joined + 1)
+        }
+    ids = list(users)
+    stats_users = {uid: {"downloads": rng.randrange(50), "failed": rng.randrange(5), "platforms": {"tiktok": 1}}
+                   for uid in ids[::2]}
+    return {
+        "user_data": {
+            "users": users,
+            "banned": rng.sample(ids, count // 100),
+            "premium": rng.sample(ids, count // 50),
+            "unreachable": rng.sample(ids, count // 20)
+        },
+        "stats": {"total_downloads": 0, "daily": {}, "users": stats_users, "platforms": {"tiktok": 0, "instagram": 0}}
+    }
+
+
+def load_legacy(data_file: str, stats_file: str) -> Tuple[Any, ...]:
+    with open(data_file, encoding="utf-8") as f:
+        user_data = json.load(f)
+    with open(stats_file, encoding="utf-8") as f:
+        stats = json.load(f)
+    for user in user_data["users"].values():
+        for field in ("join_date", "last_activity"):
+            if not isinstance(user.get(field), int):
+                user[field] = to_epoch(user.get(field))
+    shadow = json.loads(json.dumps({"user_data": user_data, "stats": stats}))
+    return user_data, stats, shadow
+
+
+def load_compact(data_file: str, stats_file: str) -> Tuple[Any, ...]:
+    with open(data_file, encoding="utf-8") as f:
+        user_data = json.load(f)
+    with open(stats_file, encoding="utf-8") as f:
+        stats = json.load(f)
+    users, _ = load_users(user_data["users"])
+    banned = dict.fromkeys(user_data["banned"])
+    premium = dict.fromkeys(user_data["premium"])
+    unreachable = dict.fromkeys(user_data["unreachable"])
+    # The loaded dicts become the journal writer's copy
+    shadow = {"user_data": user_data, "stats": json.loads(json.dumps(stats))}
+    return (users, banned, premium, unreachable, stats), shadow
+
+
+def timed(load: Callable[[], Any]) -> float:
+    gc.collect()
+    started = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - started
+    del result
+    gc.collect()
+    return elapsed
+
+
+def held_bytes(load: Callable[[], Any], keep: Callable[[Any], Any]) -> int:
+    """Bytes still allocated by `load` once only what the Database keeps is referenced."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = keep(load())
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    gc.collect()
+    return size
+
+
+def lookups_per_second(members: Any, ids: List[str], lookups: int) -> float:
+    probes = [ids[i % len(ids)] for i in range(lookups)]
+    started = time.perf_counter()
+    for uid in probes:
+        uid in members
+    return lookups / (time.perf_counter() - started)
+
+
+def run(count: int, lookups: int, workdir: str) -> Dict[str, float]:
+    state = generate(count)
+    data_file = os.path.join(workdir, "user_data.json")
+    stats_file = os.path.join(workdir, "stats.json")
+    for path, data in ((data_file, state["user_data"]), (stats_file, state["stats"])):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+    ids = list(state["user_data"]["users"])
+    banned_list = state["user_data"]["banned"]
+    del state
+    gc.collect()
+
+    result = {
+        "legacy_load": timed(lambda: load_legacy(data_file, stats_file)),
+        "compact_load": timed(lambda: load_compact(data_file, stats_file)),
+        # The legacy Database held the user_data dicts; the shadow copy is the writer's in both
+        "legacy_bytes": held_bytes(lambda: load_legacy(data_file, stats_file), lambda r: r[0]),
+        "compact_bytes": held_bytes(lambda: load_compact(data_file, stats_file), lambda r: r[0][:4]),
+        "legacy_total": held_bytes(lambda: load_legacy(data_file, stats_file), lambda r: r),
+        "compact_total": held_bytes(lambda: load_compact(data_file, stats_file), lambda r: r),
+        "legacy_lookups": lookups_per_second(banned_list, ids, lookups),
+        "compact_lookups": lookups_per_second(dict.fromkeys(banned_list), ids, lookups),
+        "file_mb": os.path.getsize(data_file) / 1024 / 1024
+    }
+    os.remove(data_file)
+    os.remove(stats_file)
+    return result
+
+
+def main() -> None:
+    args = sys.argv[1:]
+    sizes = [int(size) for size in args[args.index("--sizes") + 1].split(",")] if "--sizes" in args \
+        else [10000, 100000, 1000000]
+    lookups = int(args[args.index("--lookups") + 1]) if "--lookups" in args else 2000
+
+    print(f"{'users':>9} {'file MB':>8} {'load s legacy/compact':>22} {'users MB legacy/compact':>24} "
+          f"{'total MB legacy/compact':>24} {'ban checks/s legacy/compact':>30}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for count in sizes:
+            r = run(count, lookups, workdir)
+            print(f"{count:>9,} {r['file_mb']:>8.1f} "
+                  f"{r['legacy_load']:>10.2f} / {r['compact_load']:<9.2f} "
+                  f"{r['legacy_bytes'] / 1024 / 1024:>11.1f} / {r['compact_bytes'] / 1024 / 1024:<10.1f} "
+                  f"{r['legacy_total'] / 1024 / 1024:>11.1f} / {r['compact_total'] / 1024 / 1024:<10.1f} "
+                  f"{r['legacy_lookups']:>14,.0f} / {r['compact_lookups']:<14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Per-job downloader setup latency: fresh YoutubeDL per job vs. the pool.
+
+Usage: python benchmarks/bench_ydl_pool.py [jobs]
+
+"fresh" mirrors the old code path: build a YoutubeDL from the full option
+dict and parse cookies.txt for every job. "pooled" borrows a pre-warmed
+instance from ydl_pool. No network access is needed; only setup is measured.
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yt_dlp
+
+from config import COOKIE_FILE
+from ydlpool import build_options, ydl_pool
+
+
+def fresh_job(platform: str) -> None:
+    opts = build_options(platform)
+    if platform == "instagram":
+        opts['cookiefile'] = COOKIE_FILE
+    ydl = yt_dlp.YoutubeDL(opts)
+    ydl.cookiejar  # what the first request of every job used to pay for
+    ydl.params.pop('cookiefile', None)  # don't rewrite cookies.txt on close
+    ydl.close()
+
+
+def pooled_job(platform: str) -> None:
+    with ydl_pool.acquire(platform, "free", "best", "bench.%(ext)s", 15 * 1024 * 1024) as ydl:
+        ydl.cookiejar
+
+
+def measure(name: str, job, platform: str, jobs: int) -> float:
+    samples = []
+    for _ in range(jobs):
+        start = time.perf_counter()
+        job(platform)
+        samples.append((time.perf_counter() - start) * 1000)
+    median = statistics.median(samples)
+    print(f"{name:>7} {platform:<10} median {median:8.3f} ms  "
+          f"p95 {sorted(samples)[int(len(samples) * 0.95) - 1]:8.3f} ms")
+    return median
+
+
+def main() -> None:
+    jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    ydl_pool.prewarm()
+    for platform in ("tiktok", "instagram"):
+        fresh = measure("fresh", fresh_job, platform, jobs)
+        pooled = measure("pooled", pooled_job, platform, jobs)
+        print(f"{'saved':>7} {platform:<10} {fresh - pooled:8.3f} ms per job ({fresh / pooled:.0f}x)\n")
+    print(f"pool counters: {ydl_pool.counters}")
+
+
+if __name__ == "__main__":
+    main()
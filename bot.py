@@ -1,18 +1,44 @@
 import asyncio
+import fcntl
 import logging
-import os
-import json
 import time
 import signal
-from datetime import datetime, timedelta
+import hashlib
+import sys
+import psutil
+from itertools import islice
+from typing import Any, Dict, List, Optional, Set
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
 from aiogram.filters import Command
-from aiogram.types import FSInputFile
+from aiogram.methods import TelegramMethod
+from aiogram.types import BufferedInputFile, FSInputFile
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
-from config import TOKEN, ADMIN_ID, ADMIN_USERNAME, BACKUP_CHAT_ID, LOG_DIR, BACKUP_INTERVAL, FILE_CLEANUP_INTERVAL, TEMP_DIR
+from config import TOKEN, ADMIN_ID, ADMIN_USERNAME, MAINTENANCE_INTERVAL, DOWNLOAD_TIMEOUT, USERS_PAGE_SIZE, PLATFORM_MAX_WAIT, DOWNLOAD_POOL
+from config import INSTANCE_LOCK_FILE, JOB_HEARTBEAT_INTERVAL, SHUTDOWN_DRAIN_TIMEOUT, MAX_LINKS_PER_MESSAGE, MAX_BATCH_ITEMS, MEDIA_GROUP_SIZE, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_MAX_CONNECTIONS
 from database import db
+from users import format_time
 from translations import TRANSLATIONS, LANG_KEYBOARD, LANG_MAP, get_menu_keyboard, get_admin_keyboard
-from downloader import VideoDownloader
+from downloader import VideoDownloader, DownloadError, PlatformBusyError, PlatformDownError, StorageFullError
+from executor import download_executor
+from jobqueue import job_queue
+from ydlpool import ydl_pool
+from cache import media_cache
+from singleflight import SingleFlight
+from ratelimit import rate_limiter
+from broadcast import broadcaster
+from metrics import metrics
+from delivery import delivery_journal
+from transcode import transcoder
+from tempstore import temp_storage
+from backup import backup_manager
+from logpipe import JobRecord, job_log, setup_logging, shutdown_logging
+from rollups import stats_rollups
+from urlcanon import find_urls, url_resolver
+from accounts import instagram_accounts
+from circuit import platform_circuits
 
 # Initialize bot and dispatcher
 bot = Bot(token=TOKEN)
@@ -21,15 +47,27 @@ dp = Dispatcher()
 # Initialize database
 db = db
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(f"{LOG_DIR}/bot_{datetime.now().strftime('%Y%m%d')}.log"),
-        logging.StreamHandler()
-    ]
-)
+BROADCAST_PROMPT = "Ответьте на это сообщение с текстом для рассылки:"
+
+PLATFORM_TITLES = {"tiktok": "TikTok", "instagram": "Instagram"}
+
+# Admin stats periods: (title, seconds)
+STATS_PERIODS = (("24ч", 86400), ("7д", 7 * 86400), ("30д", 30 * 86400))
+
+# Identical videos requested at the same time are downloaded once
+download_flights = SingleFlight(timeout=DOWNLOAD_TIMEOUT)
+
+# Gauges read when /metrics is scraped
+metrics.gauge("bot_download_queue_depth", "Download jobs waiting for a worker.", download_executor.queue_depth)
+metrics.gauge("bot_downloads_active", "Download jobs running.", lambda: download_executor.get_stats()["active"])
+metrics.gauge("bot_downloads_in_flight", "Distinct videos being downloaded.", download_flights.in_flight)
+metrics.gauge("bot_temp_storage_bytes", "Bytes of temp files and reservations in TEMP_DIR.",
+              lambda: temp_storage.get_stats()["used_bytes"])
+metrics.gauge("bot_process_resident_memory_bytes", "Resident memory of the bot process.",
+              lambda: psutil.Process().memory_info().rss)
+
+# Set up logging: disk writes happen in a background thread
+setup_logging("bot")
 
 # Global flag for graceful shutdown
 is_running = True
@@ -48,26 +86,23 @@ signal.signal(signal.SIGINT, handle_sigterm)
 async def start_command(message: types.Message):
     user_id = str(message.from_user.id)
     
-    if user_id in db.user_data["banned"]:
+    if db.is_user_banned(user_id):
         return await message.answer(TRANSLATIONS["ru"]["banned"])
     
-    if user_id not in db.user_data["users"]:
-        db.user_data["users"][user_id] = {
-            "language": None,
-            "username": message.from_user.username,
-            "first_name": message.from_user.first_name,
-            "last_name": message.from_user.last_name,
-            "join_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "last_activity": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
-        db.save_data()
+    if user_id not in db.users:
+        db.add_user(
+            user_id,
+            message.from_user.username,
+            message.from_user.first_name,
+            message.from_user.last_name
+        )
         await message.answer(TRANSLATIONS["ru"]["choose_language"], reply_markup=LANG_KEYBOARD)
     else:
-        db.user_data["users"][user_id]["last_activity"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        db.save_data()
+        db.update_user_activity(user_id, message.from_user.username, message.from_user.first_name,
+                                message.from_user.last_name)
         
-        lang = db.user_data["users"].get(user_id, {}).get("language", "ru")
-        is_premium = user_id in db.user_data.get("premium", [])
+        lang = db.get_user_language(user_id) or "ru"
+        is_premium = db.is_user_premium(user_id)
         await message.answer(
             TRANSLATIONS[lang]["send_link"], 
             reply_markup=get_menu_keyboard(lang, is_premium)
@@ -81,6 +116,53 @@ async def admin_command(message: types.Message):
     
     await message.answer("Панель администратора:", reply_markup=get_admin_keyboard())
 
+@dp.message(Command("find"))
+async def find_command(message: types.Message):
+    user_id = str(message.from_user.id)
+    if user_id != ADMIN_ID:
+        return
+    
+    parts = (message.text or "").split(maxsplit=1)
+    if len(parts) < 2:
+        return await message.answer("Использование: /find <username или имя>")
+    
+    found = await db.find_users(parts[1], limit=USERS_PAGE_SIZE)
+    if not found:
+        return await message.answer("Пользователи не найдены")
+    await message.answer("🔎 Найденные пользователи:\n\n" + format_user_list(found))
+
+@dp.message(F.reply_to_message.text == BROADCAST_PROMPT)
+async def broadcast_reply(message: types.Message):
+    user_id = str(message.from_user.id)
+    if user_id != ADMIN_ID:
+        return
+    
+    if not broadcaster.start(bot, message.chat.id, message.message_id, db.get_broadcast_recipients()):
+        await message.answer("Рассылка уже идет")
+
+def format_period_stats(title: str, summary) -> str:
+    """One line of the admin stats: downloads of a period, overall and by platform."""
+    total = summary["all"]
+    line = (f"{title}: ✅ {total['success']} ❌ {total['failed']}, "
+            f"сред. {total['avg_latency']:.1f}с, макс. {total['max_latency']:.1f}с")
+    platforms = [f"{PLATFORM_TITLES.get(platform, platform)} {values['success']}/{values['failed']}"
+                 for platform, values in summary.items() if platform != "all"]
+    if platforms:
+        line += " (" + ", ".join(platforms) + ")"
+    return line + "\n"
+
+def format_user_list(users) -> str:
+    """Format (user_id, user) pairs for the admin panel."""
+    user_list = ""
+    for uid, udata in users:
+        username = udata.username or "Нет"
+        first_name = udata.first_name or "Неизвестно"
+        last_activity = format_time(udata.last_activity)
+        downloads = db.get_user_stats(uid)["downloads"]
+        premium = "⭐️ " if db.is_user_premium(uid) else ""
+        user_list += f"ID: {uid}\nИмя: {first_name}\nUsername: @{username}\nАктивность: {last_activity}\nЗагрузок: {downloads}\n{premium}\n\n"
+    return user_list
+
 @dp.callback_query()
 async def callback_handler(callback: types.CallbackQuery):
     user_id = str(callback.from_user.id)
@@ -89,6 +171,13 @@ async def callback_handler(callback: types.CallbackQuery):
     
     if callback.data == "stats":
         stats = db.get_global_stats()
+        queue = download_executor.get_stats()
+        cache = media_cache.get_stats()
+        limits = rate_limiter.get_stats()
+        temp = temp_storage.get_stats()
+        backups = backup_manager.get_stats()
+        latency = metrics.summary()
+        periods = "".join(format_period_stats(title, stats_rollups.summary(window)) for title, window in STATS_PERIODS)
         stats_text = (
             f"📊 Статистика:\n\n"
             f"Всего загрузок: {stats['total_downloads']}\n"
@@ -96,38 +185,100 @@ async def callback_handler(callback: types.CallbackQuery):
             f"Instagram загрузок: {stats['platforms']['instagram']}\n"
             f"Всего пользователей: {stats['total_users']}\n"
             f"Premium: {stats['premium_users']}\n"
-            f"Заблокировано: {stats['banned_users']}"
+            f"Заблокировано: {stats['banned_users']}\n"
+            f"Недоступны для рассылки: {stats['unreachable_users']}\n\n"
+            f"📈 Загрузки за период (успешно/ошибки):\n{periods}\n"
+            f"⏳ Очередь загрузок: {queue['queued']} ({queue['queued_users']} польз.)\n"
+            f"Активных загрузок: {queue['active']}/{queue['max_concurrent']}\n"
+            f"Ожидание: сред. {queue['avg_wait']:.1f}с, макс. {queue['max_wait']:.1f}с\n\n"
+            f"🗃 Кэш: file_id {cache['file_id_hits']}, диск {cache['disk_hits']}, промахи {cache['misses']}\n"
+            f"Видео в кэше: {cache['file_ids']}, файлов на диске: {cache['disk_files']} "
+            f"({cache['disk_bytes'] / 1024 / 1024:.1f} MB)\n"
+            f"Объединено одинаковых запросов: {download_flights.counters['coalesced']}\n"
+            f"💾 Временные файлы: {temp['used_bytes'] / 1024 / 1024:.0f}/{temp['quota_bytes'] / 1024 / 1024:.0f} MB, "
+            f"файлов {temp['files']}, ожиданий места {temp['waits']}, отказов {temp['refused']}\n"
+            f"🗄 Бэкапы: полных {backups['full']}, инкрементных {backups['delta']}, ошибок {backups['failed']}, "
+            f"хранится {backups['files']} ({backups['bytes'] / 1024 / 1024:.1f} MB)"
+            f"{', последний ' + backups['last']['name'] if backups['last'] else ''}\n\n"
+            f"🚦 Лимиты: дневной {limits['daily_limited']}, частота {limits['burst_limited']}, "
+            f"ожиданий платформ {limits['platform_waits']}\n\n"
+            f"⏱ Задержки (кол-во, p50, p95):\n"
+        )
+        for stage, (count, p50, p95) in latency.items():
+            stats_text += f"{stage}: {count}, {p50:.2f}с, {p95:.2f}с\n"
+        stats_text += f"Макс. задержка event loop: {metrics.max_loop_lag * 1000:.0f} мс"
+        recovery = delivery_journal.stats
+        if recovery["recovered"]:
+            stats_text += (
+                f"\n\n♻️ После перезапуска: восстановлено {recovery['recovered']} загрузок "
+                f"(журнал {recovery['load_seconds'] * 1000:.0f} мс"
+            )
+            if recovery["recovery_seconds"] is not None:
+                stats_text += f", доставлены через {recovery['recovery_seconds']:.1f}с после старта"
+            stats_text += ")"
+        if DOWNLOAD_POOL == "queue":
+            jobs = job_queue.get_stats(JOB_HEARTBEAT_INTERVAL)
+            stats_text += (
+                f"\n\n🛠 Воркеры: активны {jobs['workers_alive']}, не отвечают {jobs['workers_stale']}\n"
+                f"Задачи: в очереди {jobs['queued']}, выполняются {jobs['running']}, "
+                f"не выполнены {jobs['dead']}"
+            )
+        stats_text += "\n\n🔌 Платформы:"
+        for name, circuit in platform_circuits.items():
+            stats_text += f" {name} {circuit.state}"
+            if circuit.retry_after():
+                stats_text += f" ({circuit.retry_after():.0f}с)"
+        if DOWNLOAD_POOL == "thread":
+            # Other pools keep the accounts in their worker processes
+            stats_text += "\nАккаунты Instagram:"
+            for account in instagram_accounts.get_stats():
+                stats_text += (
+                    f"\n{account['name']}: {account['state']}, здоровье {account['health']:.2f}, "
+                    f"запросов {account['requests']}"
+                )
+                if account["errors"]:
+                    stats_text += " (" + ", ".join(f"{kind} {count}" for kind, count in account["errors"].items()) + ")"
+        resolver = url_resolver.get_stats()
+        stats_text += (
+            f"\n\n🔗 Короткие ссылки: распознано {resolver['resolved']}, из кэша {resolver['hits']}, "
+            f"ошибок {resolver['failed']}"
         )
+        if transcoder.enabled:
+            transcodes = transcoder.get_stats()
+            stats_text += (
+                f"\n\n🎞 Обработка ffmpeg: сжато {transcodes['encode']}, перепаковано {transcodes['remux']}, "
+                f"без изменений {transcodes['skipped']}, из кэша {transcodes['cached']}, "
+                f"ошибок {transcodes['failed']}\n"
+                f"Сэкономлено: {transcodes['saved_bytes'] / 1024 / 1024:.1f} MB"
+            )
         await callback.message.answer(stats_text)
     
-    elif callback.data == "users":
-        sorted_users = sorted(
-            db.user_data["users"].items(),
-            key=lambda x: datetime.strptime(x[1].get("last_activity", "2000-01-01"), "%Y-%m-%d %H:%M:%S"),
-            reverse=True
-        )
+    elif callback.data == "users" or callback.data.startswith("users_page_"):
+        page = int(callback.data.split("_")[2]) if callback.data.startswith("users_page_") else 0
+        recent_users = await db.get_recent_users(limit=USERS_PAGE_SIZE + 1, offset=page * USERS_PAGE_SIZE)
+        
+        user_list = f"👥 Недавно активные пользователи (стр. {page + 1}):\n\n"
+        user_list += format_user_list(recent_users[:USERS_PAGE_SIZE])
         
-        user_list = "👥 Недавно активные пользователи:\n\n"
-        for uid, udata in sorted_users[:10]:
-            username = udata.get("username", "Нет")
-            first_name = udata.get("first_name", "Неизвестно")
-            last_activity = udata.get("last_activity", "Неизвестно")
-            downloads = db.get_user_stats(uid)["downloads"]
-            premium = "⭐️ " if db.is_user_premium(uid) else ""
-            user_list += f"ID: {uid}\nИмя: {first_name}\nUsername: @{username}\nАктивность: {last_activity}\nЗагрузок: {downloads}\n{premium}\n\n"
+        nav_buttons = []
+        if page > 0:
+            nav_buttons.append(types.InlineKeyboardButton(text="⬅️", callback_data=f"users_page_{page - 1}"))
+        if len(recent_users) > USERS_PAGE_SIZE:
+            nav_buttons.append(types.InlineKeyboardButton(text="➡️", callback_data=f"users_page_{page + 1}"))
+        nav_keyboard = types.InlineKeyboardMarkup(inline_keyboard=[nav_buttons]) if nav_buttons else None
         
-        await callback.message.answer(user_list)
+        await callback.message.answer(user_list, reply_markup=nav_keyboard)
     
     elif callback.data == "ban":
         await callback.message.answer("Ответьте на это сообщение с ID пользователя для блокировки:")
     
     elif callback.data == "unban":
-        if not db.user_data["banned"]:
+        if not db.banned:
             return await callback.message.answer("Нет заблокированных пользователей")
         
         unban_keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
             [types.InlineKeyboardButton(text=uid, callback_data=f"unban_{uid}")] 
-            for uid in db.user_data["banned"][:10]
+            for uid in islice(db.banned, 10)
         ])
         
         await callback.message.answer("Выберите пользователя для разблокировки:", reply_markup=unban_keyboard)
@@ -143,38 +294,303 @@ async def callback_handler(callback: types.CallbackQuery):
         await callback.message.answer("Ответьте на это сообщение с ID пользователя для добавления Premium:")
     
     elif callback.data == "broadcast":
-        await callback.message.answer("Ответьте на это сообщение с текстом для рассылки:")
+        if broadcaster.is_running:
+            return await callback.answer("Рассылка уже идет")
+        await callback.message.answer(BROADCAST_PROMPT, reply_markup=types.ForceReply())
+    
+    elif callback.data == "broadcast_stop":
+        await broadcaster.cancel()
     
     await callback.answer()
 
+async def fetch_and_upload(bot: Bot, chat_id: int, job_id: str, key: str, url: str, user_id: str, is_premium: bool,
+                           job: JobRecord):
+    """Download a video and upload it to the requesting chat.
+
+    Returns (file_id, platform) so coalesced requests can reuse the upload.
+    """
+    cached_path = media_cache.get_path(key)
+    if cached_path:
+        success, result, platform = True, cached_path, VideoDownloader.get_platform(url)
+    else:
+        media_cache.record_miss()
+        if not await rate_limiter.wait_platform(VideoDownloader.get_platform(url), PLATFORM_MAX_WAIT):
+            raise PlatformBusyError(url)
+        delivery_journal.update(job_id, "downloading")
+        success, result, platform = await VideoDownloader.download_video(url, user_id, is_premium, job=job)
+    
+    try:
+        if not success:
+            raise DownloadError(result)
+        
+        tier = "premium" if is_premium else "free"
+        if isinstance(result, bytes):
+            media = BufferedInputFile(result, filename=f"{platform}_video.mp4")
+        else:
+            media = FSInputFile(result)
+        delivery_journal.update(job_id, "uploading")
+        with metrics.timer("upload", platform, tier), job.timer("upload"):
+            sent = await bot.send_video(chat_id, media)
+        uploaded = sent.video or sent.animation or sent.document
+        file_id = uploaded.file_id if uploaded else None
+        if file_id:
+            media_cache.put_file_id(key, file_id)
+        if not cached_path:
+            with metrics.timer("disk_cache", platform, tier):
+                await media_cache.store(key, result)
+        return file_id, platform
+    finally:
+        if success and not cached_path:
+            VideoDownloader.cleanup(result)
+
+async def deliver(bot: Bot, job_id: str, chat_id: int, url: str, user_id: str, is_premium: bool, lang: str,
+                  started: float, announce: bool = True):
+    """Get a video to a chat: from the file_id cache, a download in progress or a new download.
+
+    Progress is recorded in the delivery journal under `job_id`.
+    """
+    key = VideoDownloader.get_video_key(url)
+    platform = VideoDownloader.get_platform(url)
+    tier = "premium" if is_premium else "free"
+    outcome = "error"
+    job = JobRecord(job_id, user_id, platform, key)
+    try:
+        file_id = media_cache.get_file_id(key)
+        if file_id:
+            try:
+                delivery_journal.update(job_id, "uploading")
+                with metrics.timer("send_cached", platform, tier), job.timer("send_cached"):
+                    await bot.send_video(chat_id, file_id)
+                db.update_stats(user_id, success=True, platform=platform, latency=time.perf_counter() - started)
+                outcome = "cached"
+                return
+            except TelegramBadRequest as e:
+                logging.warning(f"Cached file_id for {key} rejected: {e}")
+                media_cache.forget(key)
+        
+        if announce:
+            await bot.send_message(chat_id, TRANSLATIONS[lang]["downloading"])
+        
+        # Tiers have different size limits, so they don't share downloads. A Telegram error comes from
+        # the upload to the first requester's chat (it may have blocked the bot): the others try themselves
+        (file_id, platform), shared = await download_flights.do(
+            f"{tier}:{key}", lambda: fetch_and_upload(bot, chat_id, job_id, key, url, user_id, is_premium, job),
+            own_failure=lambda error: isinstance(error, TelegramAPIError)
+        )
+        if shared:
+            if not file_id:
+                raise DownloadError("Shared upload returned no file_id")
+            delivery_journal.update(job_id, "uploading")
+            await bot.send_video(chat_id, file_id)
+        db.update_stats(user_id, success=True, platform=platform, latency=time.perf_counter() - started)
+        outcome = "coalesced" if shared else "downloaded"
+    except (PlatformBusyError, StorageFullError):
+        outcome = "busy"
+        rate_limiter.refund(user_id)
+        await bot.send_message(chat_id, TRANSLATIONS[lang]["service_busy"])
+    except PlatformDownError as e:
+        outcome = "busy"
+        rate_limiter.refund(user_id)
+        await bot.send_message(chat_id, platform_down_text(lang, e))
+    except asyncio.CancelledError:
+        # Shutdown: the journal keeps the request for the next start
+        outcome = "interrupted"
+        raise
+    except Exception as e:
+        logging.error(f"Error delivering {url} to {user_id}: {e!r}")
+        rate_limiter.refund(user_id)
+        await bot.send_message(chat_id, TRANSLATIONS[lang]["download_error"])
+        db.update_stats(user_id, success=False, platform=platform, latency=time.perf_counter() - started)
+    finally:
+        if outcome != "interrupted":
+            delivery_journal.update(job_id, "failed" if outcome in ("error", "busy") else "done")
+        metrics.requests.inc(1, outcome)
+        metrics.stage_seconds.observe(time.perf_counter() - started, "total", platform or "unknown", tier)
+        job.fields["platform"] = platform
+        job_log.finish(job, outcome, time.perf_counter() - started)
+
+def platform_down_text(lang: str, error: PlatformDownError) -> str:
+    return TRANSLATIONS[lang]["platform_down"].format(
+        platform=PLATFORM_TITLES.get(error.platform, error.platform), minutes=max(1, round(error.retry_after / 60))
+    )
+
+async def fetch_item(key: str, url: str, item: Optional[int], user_id: str, is_premium: bool, job: JobRecord):
+    """Get one video of a batch ready to send.
+
+    Returns (media, platform, download): a cached file_id or a file, plus the
+    download result to store and clean up (None when it came from a cache).
+    """
+    platform = VideoDownloader.get_platform(url)
+    file_id = media_cache.get_file_id(key)
+    if file_id:
+        return file_id, platform, None
+    cached_path = media_cache.get_path(key)
+    if cached_path:
+        return FSInputFile(cached_path), platform, None
+    media_cache.record_miss()
+    if not await rate_limiter.wait_platform(platform, PLATFORM_MAX_WAIT):
+        raise PlatformBusyError(url)
+    success, result, platform = await VideoDownloader.download_video(url, user_id, is_premium, item, job)
+    if not success:
+        raise DownloadError(result)
+    if isinstance(result, bytes):
+        return BufferedInputFile(result, filename=f"{platform}_video.mp4"), platform, result
+    return FSInputFile(result), platform, result
+
+async def count_items(url: str, user_id: str, is_premium: bool) -> int:
+    if not VideoDownloader.may_have_items(url):
+        return 1
+    return await download_executor.submit(user_id, is_premium, VideoDownloader.count_items, url, is_premium)
+
+async def deliver_batch(bot: Bot, job_id: str, chat_id: int, urls: List[str], user_id: str, is_premium: bool,
+                        lang: str, started: float, announce: bool = True, limit_tier: Optional[str] = None):
+    """Deliver every video of several links and carousel posts as albums of MEDIA_GROUP_SIZE.
+
+    Items download in parallel through the download executor, which caps the
+    jobs one user runs at once. The request was charged one download; each
+    further item is counted against the daily quota of `limit_tier` (None on
+    resume). Items that failed are listed in a single reply.
+    """
+    platform = VideoDownloader.get_platform(urls[0])
+    tier = "premium" if is_premium else "free"
+    outcome = "error"
+    downloads = []
+    job = JobRecord(job_id, user_id, platform, [VideoDownloader.get_video_key(url) for url in urls])
+    try:
+        counts = await asyncio.gather(*[count_items(url, user_id, is_premium) for url in urls])
+        items = [(url, index if count > 1 else None) for url, count in zip(urls, counts) for index in range(count)]
+        items = items[:MAX_BATCH_ITEMS]
+        allowed = len(items)
+        if limit_tier is not None:
+            allowed = 1 + rate_limiter.acquire_extra(user_id, limit_tier, len(items) - 1)
+        
+        if announce:
+            await bot.send_message(chat_id, TRANSLATIONS[lang]["downloading"])
+        delivery_journal.update(job_id, "downloading")
+        results = await asyncio.gather(*[
+            fetch_item(VideoDownloader.get_video_key(url, item), url, item, user_id, is_premium, job)
+            for url, item in items[:allowed]
+        ], return_exceptions=True)
+        
+        # Positions are 1-based, as the user counts the videos
+        failed, ready = [], []
+        for position, ((url, item), result) in enumerate(zip(items, results), 1):
+            if isinstance(result, BaseException):
+                logging.error(f"Error delivering {url} item {item} to {user_id}: {result!r}")
+                failed.append(position)
+            else:
+                ready.append((position, VideoDownloader.get_video_key(url, item), *result))
+                if result[2] is not None:
+                    downloads.append(result[2])
+        
+        delivery_journal.update(job_id, "uploading")
+        delivered = 0
+        for i in range(0, len(ready), MEDIA_GROUP_SIZE):
+            chunk = ready[i:i + MEDIA_GROUP_SIZE]
+            try:
+                with metrics.timer("upload", platform, tier), job.timer("upload"):
+                    if len(chunk) == 1:
+                        sent = [await bot.send_video(chat_id, chunk[0][2])]
+                    else:
+                        sent = await bot.send_media_group(
+                            chat_id, [types.InputMediaVideo(media=media) for _, _, media, _, _ in chunk]
+                        )
+            except TelegramBadRequest as e:
+                logging.error(f"Error sending album to {user_id}: {e}")
+                for position, key, media, _, _ in chunk:
+                    if isinstance(media, str):
+                        # A stale file_id fails the whole album, don't reuse it
+                        media_cache.forget(key)
+                    failed.append(position)
+                continue
+            for (position, key, media, item_platform, download), sent_message in zip(chunk, sent):
+                uploaded = sent_message.video or sent_message.animation or sent_message.document
+                if uploaded and not isinstance(media, str):
+                    media_cache.put_file_id(key, uploaded.file_id)
+                if download is not None:
+                    await media_cache.store(key, download)
+                db.update_stats(user_id, success=True, platform=item_platform,
+                                latency=time.perf_counter() - started)
+                delivered += 1
+        
+        for _ in failed:
+            db.update_stats(user_id, success=False, platform=platform, latency=time.perf_counter() - started)
+        if not delivered:
+            rate_limiter.refund(user_id)
+            down = next((result for result in results if isinstance(result, PlatformDownError)), None)
+            await bot.send_message(chat_id, platform_down_text(lang, down) if down
+                                   else TRANSLATIONS[lang]["download_error"])
+        elif failed:
+            await bot.send_message(chat_id, TRANSLATIONS[lang]["batch_failed"].format(
+                items=", ".join(str(position) for position in sorted(failed)), total=len(items)
+            ))
+        rate_limiter.refund_extra(user_id, len(failed) - (0 if delivered else 1))
+        if allowed < len(items):
+            await bot.send_message(chat_id, TRANSLATIONS[lang]["rate_limit"])
+        outcome = "batch" if delivered else "error"
+    except asyncio.CancelledError:
+        outcome = "interrupted"
+        raise
+    except Exception as e:
+        logging.error(f"Error delivering {' '.join(urls)} to {user_id}: {e!r}")
+        rate_limiter.refund(user_id)
+        await bot.send_message(chat_id, TRANSLATIONS[lang]["download_error"])
+        db.update_stats(user_id, success=False, platform=platform, latency=time.perf_counter() - started)
+    finally:
+        for download in downloads:
+            VideoDownloader.cleanup(download)
+        if outcome != "interrupted":
+            delivery_journal.update(job_id, "failed" if outcome == "error" else "done")
+        metrics.requests.inc(1, outcome)
+        metrics.stage_seconds.observe(time.perf_counter() - started, "total", platform or "unknown", tier)
+        job_log.finish(job, outcome, time.perf_counter() - started)
+
+def deliver_links(bot: Bot, job_id: str, chat_id: int, urls: List[str], user_id: str, is_premium: bool, lang: str,
+                  started: float, announce: bool = True, limit_tier: Optional[str] = None):
+    """Deliver a single video directly and anything that may hold several videos as a batch."""
+    if len(urls) == 1 and not VideoDownloader.may_have_items(urls[0]):
+        return deliver(bot, job_id, chat_id, urls[0], user_id, is_premium, lang, started, announce)
+    return deliver_batch(bot, job_id, chat_id, urls, user_id, is_premium, lang, started, announce, limit_tier)
+
+async def resume_deliveries(jobs):
+    """Deliver the requests a previous run accepted but didn't finish."""
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        deliver_links(bot, job["id"], job["chat_id"], job["url"].split(), job["user_id"], job["is_premium"],
+                      job["lang"], time.perf_counter(), announce=job["state"] == "queued")
+        for job in jobs
+    ], return_exceptions=True)
+    # From process start, so it includes startup and the journal replay
+    delivery_journal.stats["recovery_seconds"] = time.time() - psutil.Process().create_time()
+    logging.info(f"Resumed {len(jobs)} deliveries in {time.perf_counter() - started:.1f}s, "
+                 f"{delivery_journal.stats['recovery_seconds']:.1f}s after process start")
+
 @dp.message()
 async def handle_message(message: types.Message):
     user_id = str(message.from_user.id)
     
-    if user_id in db.user_data["users"]:
-        db.user_data["users"][user_id]["last_activity"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        db.save_data()
+    db.update_user_activity(user_id, message.from_user.username, message.from_user.first_name,
+                            message.from_user.last_name)
     
-    if user_id in db.user_data["banned"]:
-        lang = db.user_data["users"].get(user_id, {}).get("language", "ru")
+    if db.is_user_banned(user_id):
+        lang = db.get_user_language(user_id) or "ru"
         return await message.answer(TRANSLATIONS[lang]["banned"])
     
     if message.text in LANG_MAP:
-        db.user_data["users"][user_id]["language"] = LANG_MAP[message.text]
-        db.save_data()
-        is_premium = user_id in db.user_data.get("premium", [])
+        db.set_user_language(user_id, LANG_MAP[message.text])
+        is_premium = db.is_user_premium(user_id)
         await message.answer(
             TRANSLATIONS[LANG_MAP[message.text]]["saved_language"], 
             reply_markup=get_menu_keyboard(LANG_MAP[message.text], is_premium)
         )
         return
     
-    if user_id not in db.user_data["users"] or db.user_data["users"][user_id]["language"] is None:
+    lang = db.get_user_language(user_id)
+    if user_id not in db.users or lang is None:
         await message.answer(TRANSLATIONS["ru"]["choose_language"], reply_markup=LANG_KEYBOARD)
         return
     
-    lang = db.user_data["users"].get(user_id, {}).get("language", "ru")
-    is_premium = user_id in db.user_data.get("premium", [])
+    is_premium = db.is_user_premium(user_id)
     
     if message.text == "ℹ️ Help" or message.text == "ℹ️ Помощь" or message.text == "ℹ️ Օգնություն":
         return await message.answer(TRANSLATIONS[lang]["help"])
@@ -191,24 +607,31 @@ async def handle_message(message: types.Message):
         )
         return await message.answer(TRANSLATIONS[lang]["premium_info"], reply_markup=admin_contact)
     
-    if VideoDownloader.is_valid_url(message.text):
-        url = message.text.strip()
-        
-        if not is_premium and db.get_user_stats(user_id)["downloads"] >= 5:
-            return await message.answer(TRANSLATIONS[lang]["rate_limit"])
-        
-        await message.answer(TRANSLATIONS[lang]["downloading"])
+    started = time.perf_counter()
+    # Short links are resolved here, so equal videos share one cache key from the start
+    links, unresolved = await url_resolver.canonicalize(find_urls(message.text)[:MAX_LINKS_PER_MESSAGE])
+    if unresolved:
+        await message.answer(TRANSLATIONS[lang]["link_unresolved"])
+        if not links:
+            return
+    urls = [link.url for link in links]
+    if urls:
+        platform = VideoDownloader.get_platform(urls[0])
+        tier = "premium" if is_premium else "free"
+        metrics.stage_seconds.observe(time.perf_counter() - started, "parse", platform, tier)
         
-        success, result, platform = await VideoDownloader.download_video(url, user_id, is_premium)
+        limit_tier = "admin" if user_id == ADMIN_ID else tier
+        allowed, reason, retry_after = rate_limiter.acquire(user_id, limit_tier)
+        if not allowed:
+            metrics.requests.inc(1, "limited")
+            if reason == "daily":
+                return await message.answer(TRANSLATIONS[lang]["rate_limit"])
+            return await message.answer(TRANSLATIONS[lang]["slow_down"].format(seconds=int(retry_after) + 1))
         
-        if success:
-            await message.answer_video(FSInputFile(result))
-            db.update_stats(user_id, success=True, platform=platform)
-        else:
-            await message.answer(TRANSLATIONS[lang]["download_error"])
-            db.update_stats(user_id, success=False)
-        
-        VideoDownloader.cleanup_file(result)
+        # Several links are journaled as one request, separated by spaces
+        job_id = delivery_journal.start(message.chat.id, user_id, " ".join(urls), is_premium, lang)
+        await deliver_links(message.bot, job_id, message.chat.id, urls, user_id, is_premium, lang, started,
+                            limit_tier=limit_tier)
     else:
         await message.answer(TRANSLATIONS[lang]["unsupported_link"], 
                           reply_markup=get_menu_keyboard(lang, is_premium))
@@ -216,66 +639,162 @@ async def handle_message(message: types.Message):
 async def periodic_tasks():
     while is_running:
         try:
-            # Clean up old files
-            for filename in os.listdir(TEMP_DIR):
-                file_path = os.path.join(TEMP_DIR, filename)
-                if os.path.isfile(file_path) and os.path.getmtime(file_path) < time.time() - FILE_CLEANUP_INTERVAL:
-                    os.remove(file_path)
+            # Expire cached media and persist file_ids
+            media_cache.evict()
+            media_cache.save()
+            rate_limiter.save()
             
-            # Backup data
-            if datetime.now().weekday() == 0 and datetime.now().hour == 0:
-                backup_time = datetime.now().strftime("%Y%m%d")
-                backup_data = {
-                    "user_data": db.user_data,
-                    "stats": db.stats
-                }
-                backup_file = f"backup_{backup_time}.json"
-                
-                with open(backup_file, "w", encoding="utf-8") as f:
-                    json.dump(backup_data, f, indent=4, ensure_ascii=False)
-                
-                if os.path.exists(backup_file):
-                    try:
-                        await bot.send_document(
-                            ADMIN_ID, 
-                            FSInputFile(backup_file),
-                            caption=f"Weekly backup {backup_time}"
-                        )
-                        await bot.send_document(
-                            BACKUP_CHAT_ID, 
-                            FSInputFile(backup_file),
-                            caption=f"Weekly backup {backup_time}"
-                        )
-                        os.remove(backup_file)
-                    except Exception as e:
-                        logging.error(f"Error sending backup: {e}")
-            
-            await asyncio.sleep(BACKUP_INTERVAL)
+            await asyncio.sleep(MAINTENANCE_INTERVAL)
         except Exception as e:
             logging.error(f"Error in periodic tasks: {e}")
             await asyncio.sleep(60)
 
+class BackgroundRequestHandler(SimpleRequestHandler):
+    """Webhook handler that acknowledges an update at once and handles it in a task it keeps track of."""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str):
+        super().__init__(dispatcher=dispatcher, bot=bot, secret_token=secret_token, handle_in_background=False)
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def _feed(self, update: Dict[str, Any]) -> None:
+        result = await self.dispatcher.feed_raw_update(self.bot, update)
+        if isinstance(result, TelegramMethod):
+            await self.dispatcher.silent_call_request(self.bot, result)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), self.bot):
+            return web.Response(body="Unauthorized", status=401)
+        task = asyncio.create_task(self._feed(await request.json()))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return web.json_response({})
+
+async def run_webhook():
+    """Serve updates from a webhook until shutdown.
+
+    Updates are acknowledged as soon as they arrive and handled in background
+    tasks, so a slow download never makes Telegram retry or hold back the
+    following updates. Run a single instance: users, rate limits, caches,
+    downloads in progress and the delivery journal live in this process.
+    """
+    secret = WEBHOOK_SECRET or hashlib.sha256(TOKEN.encode()).hexdigest()
+    handler = BackgroundRequestHandler(dp, bot, secret)
+    
+    async def health(request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+    
+    app = web.Application()
+    app.router.add_get("/healthz", health)
+    handler.register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    
+    # Same URL and secret on every start, so this is idempotent
+    await bot.set_webhook(
+        f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+        secret_token=secret,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=WEBHOOK_MAX_CONNECTIONS
+    )
+    logging.info(f"Webhook server listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    
+    try:
+        while is_running:
+            await asyncio.sleep(1)
+    finally:
+        # Stop accepting updates, then let the ones already accepted finish.
+        # The webhook stays set: Telegram keeps new updates until the next start.
+        await site.stop()
+        pending = list(handler.tasks)
+        if pending:
+            logging.info(f"Waiting for {len(pending)} updates in progress")
+            await asyncio.wait(pending, timeout=SHUTDOWN_DRAIN_TIMEOUT)
+        await runner.cleanup()
+
 async def main():
     try:
         # Start periodic tasks
         periodic_task = asyncio.create_task(periodic_tasks())
         
-        # Delete webhook and start polling
-        await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot)
+        # Build the pooled downloaders before the first request needs them
+        if DOWNLOAD_POOL == "thread":
+            await asyncio.get_running_loop().run_in_executor(None, ydl_pool.prewarm)
+        
+        await metrics.start()
+        
+        # Remove what the last run left in TEMP_DIR before new downloads reserve space
+        await temp_storage.start()
         
-        # Wait for periodic task to complete
-        await periodic_task
+        # Load the stats rollups and save them periodically
+        await stats_rollups.start()
+        
+        # Hourly incremental and weekly full backups, taken off the event loop
+        backup_manager.start(bot, db.storage)
+        
+        # Finish downloads interrupted by the last shutdown
+        unfinished = delivery_journal.load()
+        if unfinished:
+            logging.info(f"Resuming {len(unfinished)} unfinished deliveries")
+            asyncio.create_task(resume_deliveries(unfinished))
+        
+        # Continue a broadcast interrupted by the last shutdown
+        broadcaster.resume(bot)
+        
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            # Delete webhook and start polling
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
+        
+        # Updates have stopped, the periodic tasks would only sleep on
+        periodic_task.cancel()
     except Exception as e:
         logging.error(f"Error in main: {e}")
     finally:
-        # Cleanup
+        # Cleanup: give accepted requests a chance to finish, the rest resume on the next start
+        left = await delivery_journal.drain(SHUTDOWN_DRAIN_TIMEOUT)
+        if left:
+            logging.warning(f"{left} deliveries unfinished at shutdown, they will resume on the next start")
+        await broadcaster.stop()
+        await metrics.stop()
+        await temp_storage.stop()
+        await backup_manager.stop()
+        await stats_rollups.stop()
+        await url_resolver.close()
+        download_executor.shutdown(wait=False)
+        transcoder.shutdown()
+        ydl_pool.close()
+        media_cache.save()
+        rate_limiter.save()
+        delivery_journal.close()
+        db.close()
         await bot.session.close()
 
+def lock_instance():
+    """Take INSTANCE_LOCK_FILE for the life of the process, or exit if another bot holds it.
+
+    Webhook mode is single-instance like polling: rate limits, the delivery
+    journal, downloads in progress and the caches are not shared.
+    """
+    lock = open(INSTANCE_LOCK_FILE, "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        logging.error(f"Another bot instance is running with this data directory ({INSTANCE_LOCK_FILE})")
+        sys.exit(1)
+    return lock
+
 if __name__ == "__main__":
+    instance_lock = lock_instance()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
         logging.info("Bot stopped by user")
     except Exception as e:
-        logging.error(f"Bot stopped due to error: {e}") 
+        logging.error(f"Bot stopped due to error: {e}")
+    finally:
+        shutdown_logging() 
@@ -0,0 +1,277 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from aiogram import Bot, types
+from aiogram.exceptions import (TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError,
+                                TelegramRetryAfter, TelegramServerError)
+
+from config import (BROADCAST_FILE, BROADCAST_PROGRESS_FILE, BROADCAST_CONCURRENCY, BROADCAST_RATE,
+                    BROADCAST_MIN_RATE, BROADCAST_MAX_RETRIES, BROADCAST_REPORT_INTERVAL)
+from database import db
+from ratelimit import TokenBucket
+
+# Bad Request descriptions that mean the chat will never accept our messages
+UNREACHABLE_ERRORS = ("chat not found", "user is deactivated", "peer_id_invalid", "bot was blocked")
+
+
+class Broadcaster:
+    """Copies one admin message to every user, resumably.
+
+    Workers share a token bucket kept below Telegram's global bot limit. Each
+    chat gets a single message, so the per-chat limit only matters for a
+    retry, which always waits out the RetryAfter the API asked for. A
+    RetryAfter pauses all workers and halves the rate; every successful send
+    raises it back a little, up to max_rate.
+
+    The job (message to copy, recipient list) is written once when it starts
+    and every result is appended to a progress log, so after a restart only
+    recipients without a result are sent to again.
+    """
+
+    def __init__(self, state_file: str, progress_file: str, concurrency: int, max_rate: float,
+                 min_rate: float, max_retries: int, report_interval: float):
+        self.state_file = state_file
+        self.progress_file = progress_file
+        self.concurrency = concurrency
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.max_retries = max_retries
+        self.report_interval = report_interval
+        self.job: Optional[Dict[str, Any]] = None
+        self.done: Set[str] = set()
+        self.counters = {"sent": 0, "unreachable": 0, "failed": 0, "retry_after": 0}
+        self._bucket = TokenBucket(max_rate, max_rate)
+        self._paused_until = 0.0
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+        self._progress = None
+        self._status_message_id: Optional[int] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, bot: Bot, from_chat_id: int, message_id: int, recipients: List[str]) -> bool:
+        """Start broadcasting a message. Returns False if a broadcast is already running."""
+        if self.is_running:
+            return False
+        self.job = {
+            "from_chat_id": from_chat_id,
+            "message_id": message_id,
+            "recipients": recipients,
+            "started": time.time()
+        }
+        tmp_path = f"{self.state_file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.job, f)
+        os.replace(tmp_path, self.state_file)
+        open(self.progress_file, "w").close()
+        self.done = set()
+        self.counters = {name: 0 for name in self.counters}
+        self._task = asyncio.create_task(self._run(bot))
+        return True
+
+    def resume(self, bot: Bot) -> bool:
+        """Continue a broadcast interrupted by a restart. Returns False if there is none."""
+        if self.is_running or not os.path.exists(self.state_file):
+            return False
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                self.job = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Error loading broadcast state: {e}")
+            return False
+        self.done = set()
+        self.counters = {name: 0 for name in self.counters}
+        if os.path.exists(self.progress_file):
+            with open(self.progress_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.split()
+                    # A torn last line has no status and is simply sent again
+                    if len(parts) == 2 and parts[1] in self.counters:
+                        self.done.add(parts[0])
+                        self.counters[parts[1]] += 1
+        logging.info(f"Resuming broadcast: {len(self.done)}/{len(self.job['recipients'])} done")
+        self._task = asyncio.create_task(self._run(bot))
+        return True
+
+    async def stop(self) -> None:
+        """Let in-flight messages finish and stop. The broadcast resumes on the next start."""
+        if not self.is_running:
+            return
+        self._stopping = True
+        try:
+            await self._task
+        finally:
+            self._stopping = False
+
+    async def cancel(self) -> None:
+        """Stop the broadcast for good."""
+        await self.stop()
+        self._finish()
+
+    def _finish(self) -> None:
+        for path in (self.state_file, self.progress_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def _run(self, bot: Bot) -> None:
+        queue: "asyncio.Queue[str]" = asyncio.Queue()
+        for user_id in self.job["recipients"]:
+            if user_id not in self.done:
+                queue.put_nowait(user_id)
+
+        self._status_message_id = None
+        self._progress = open(self.progress_file, "a", encoding="utf-8")
+        reporter = asyncio.create_task(self._report_loop(bot))
+        try:
+            workers = [asyncio.create_task(self._worker(bot, queue))
+                       for _ in range(min(self.concurrency, queue.qsize()))]
+            await asyncio.gather(*workers)
+        except Exception as e:
+            logging.error(f"Broadcast error: {e}")
+        finally:
+            reporter.cancel()
+            self._progress.close()
+            self._progress = None
+
+        finished = not self._stopping and len(self.done) >= len(self.job["recipients"])
+        await self._report(bot, final=finished)
+        if finished:
+            self._finish()
+            logging.info(f"Broadcast finished: {self.counters}")
+
+    async def _worker(self, bot: Bot, queue: "asyncio.Queue[str]") -> None:
+        while not self._stopping:
+            try:
+                user_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            status = await self._send(bot, user_id)
+            if status:
+                self._record(user_id, status)
+
+    async def _throttle(self) -> bool:
+        """Wait for a send slot. Returns False if the broadcast is stopping."""
+        while not self._stopping:
+            now = time.time()
+            if self._paused_until > now:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            wait = self._bucket.take(now)
+            if not wait:
+                return True
+            await asyncio.sleep(wait)
+        return False
+
+    def _set_rate(self, rate: float) -> None:
+        self._bucket.rate = rate
+        self._bucket.capacity = max(1.0, rate)
+
+    async def _send(self, bot: Bot, user_id: str) -> Optional[str]:
+        """Copy the message to one user. Returns the result, or None if stopped before sending."""
+        errors = 0
+        while await self._throttle():
+            try:
+                await bot.copy_message(user_id, self.job["from_chat_id"], self.job["message_id"])
+                self._set_rate(min(self.max_rate, self._bucket.rate + 0.1))
+                return "sent"
+            except TelegramRetryAfter as e:
+                self.counters["retry_after"] += 1
+                self._paused_until = max(self._paused_until, time.time() + e.retry_after)
+                self._set_rate(max(self.min_rate, self._bucket.rate / 2))
+                self._bucket.tokens = 0
+            except TelegramForbiddenError:
+                return "unreachable"
+            except TelegramBadRequest as e:
+                if any(error in e.message.lower() for error in UNREACHABLE_ERRORS):
+                    return "unreachable"
+                logging.warning(f"Broadcast to {user_id} failed: {e.message}")
+                return "failed"
+            except (TelegramNetworkError, TelegramServerError) as e:
+                errors += 1
+                if errors > self.max_retries:
+                    logging.warning(f"Broadcast to {user_id} failed: {e}")
+                    return "failed"
+                await asyncio.sleep(2 ** errors)
+        return None
+
+    def _record(self, user_id: str, status: str) -> None:
+        self.done.add(user_id)
+        self.counters[status] += 1
+        self._progress.write(f"{user_id} {status}\n")
+        self._progress.flush()
+        if status == "unreachable":
+            db.set_user_unreachable(user_id)
+
+    async def _report_loop(self, bot: Bot) -> None:
+        last_time, last_done = time.monotonic(), len(self.done)
+        while True:
+            await asyncio.sleep(self.report_interval)
+            now, done = time.monotonic(), len(self.done)
+            await self._report(bot, throughput=(done - last_done) / (now - last_time))
+            last_time, last_done = now, done
+
+    async def _report(self, bot: Bot, throughput: float = 0.0, final: bool = False) -> None:
+        """Send or update the progress message in the admin chat."""
+        total, done = len(self.job["recipients"]), len(self.done)
+        if final:
+            header = "✅ Рассылка завершена"
+        elif self._stopping or not self.is_running:
+            header = "⏸ Рассылка остановлена"
+        else:
+            header = "📢 Рассылка"
+        text = (
+            f"{header}: {done}/{total}\n\n"
+            f"Доставлено: {self.counters['sent']}\n"
+            f"Недоступны: {self.counters['unreachable']}\n"
+            f"Ошибки: {self.counters['failed']}\n"
+            f"Ограничений Telegram: {self.counters['retry_after']}"
+        )
+        if throughput > 0:
+            eta = int((total - done) / throughput)
+            text += f"\n\nСкорость: {throughput:.1f} сообщ./с\nОсталось: ~{eta // 60} мин {eta % 60} с"
+        keyboard = None
+        if not final and not self._stopping:
+            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[[
+                types.InlineKeyboardButton(text="⛔️ Остановить", callback_data="broadcast_stop")
+            ]])
+
+        try:
+            if self._status_message_id is None:
+                sent = await bot.send_message(self.job["from_chat_id"], text, reply_markup=keyboard)
+                self._status_message_id = sent.message_id
+            else:
+                await bot.edit_message_text(text, chat_id=self.job["from_chat_id"],
+                                            message_id=self._status_message_id, reply_markup=keyboard)
+        except TelegramRetryAfter as e:
+            self._paused_until = max(self._paused_until, time.time() + e.retry_after)
+        except Exception as e:
+            # "message is not modified" and the like; progress is reported again shortly
+            logging.debug(f"Broadcast report not updated: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get progress counters."""
+        return {
+            **self.counters,
+            "running": self.is_running,
+            "done": len(self.done),
+            "total": len(self.job["recipients"]) if self.job else 0,
+            "rate": self._bucket.rate
+        }
+
+
+# Create global broadcaster instance
+broadcaster = Broadcaster(
+    state_file=BROADCAST_FILE,
+    progress_file=BROADCAST_PROGRESS_FILE,
+    concurrency=BROADCAST_CONCURRENCY,
+    max_rate=BROADCAST_RATE,
+    min_rate=BROADCAST_MIN_RATE,
+    max_retries=BROADCAST_MAX_RETRIES,
+    report_interval=BROADCAST_REPORT_INTERVAL
+)
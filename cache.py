@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Union
+
+from config import (MEDIA_CACHE_FILE, MEDIA_CACHE_MAX_ENTRIES, MEDIA_CACHE_DIR, MEDIA_DISK_CACHE_ENABLED,
+                    MEDIA_DISK_CACHE_MAX_SIZE, MEDIA_DISK_CACHE_TTL)
+
+
+def _file_size(path: str) -> Optional[int]:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def _put_file(path: str, media: Union[str, bytes], remove: List[str]) -> None:
+    """Move a file or write bytes to `path`, then delete the files in `remove`."""
+    if isinstance(media, bytes):
+        # Written aside first, so a reader never sees a partial file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(media)
+        os.replace(tmp_path, path)
+    else:
+        os.replace(media, path)
+    for victim in remove:
+        try:
+            os.remove(victim)
+        except FileNotFoundError:
+            pass
+
+
+class MediaCache:
+    """Cache of already delivered videos keyed by canonical video ID.
+
+    The first tier maps a video key to the Telegram file_id of the first upload,
+    so repeated requests are answered without downloading or uploading anything.
+    The optional second tier keeps the media bytes on disk under a content
+    address (sha256 of the key) with LRU eviction by total size and age.
+    Writes to the disk tier run in the default executor.
+    """
+
+    def __init__(self, file_path: str, max_entries: int, disk_dir: str, disk_enabled: bool,
+                 disk_max_bytes: int, disk_ttl: int):
+        self.file_path = file_path
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.disk_enabled = disk_enabled
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_ttl = disk_ttl
+        self.counters = {"file_id_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self._dirty = False
+        self._file_ids: "OrderedDict[str, Dict[str, Any]]" = OrderedDict(self._load())
+        # key -> (path, size, last access) in LRU order
+        self._disk: "OrderedDict[str, list]" = OrderedDict()
+        self._disk_bytes = 0
+        if self.disk_enabled:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        """Load the file_id map from disk."""
+        if os.path.exists(self.file_path):
+            try:
+                with open(self.file_path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                logging.error(f"Error loading media cache: {e}")
+        return {}
+
+    def save(self) -> None:
+        """Save the file_id map if it changed."""
+        if not self._dirty:
+            return
+        tmp_path = f"{self.file_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._file_ids, f, ensure_ascii=False)
+        os.replace(tmp_path, self.file_path)
+        self._dirty = False
+
+    def get_file_id(self, key: str) -> Optional[str]:
+        """Get the Telegram file_id for a video, if it was uploaded before."""
+        entry = self._file_ids.get(key)
+        if entry is None:
+            return None
+        self._file_ids.move_to_end(key)
+        self.counters["file_id_hits"] += 1
+        return entry["file_id"]
+
+    def put_file_id(self, key: str, file_id: str) -> None:
+        """Remember the file_id returned by an upload."""
+        self._file_ids[key] = {"file_id": file_id, "time": int(time.time())}
+        self._file_ids.move_to_end(key)
+        while len(self._file_ids) > self.max_entries:
+            self._file_ids.popitem(last=False)
+        self._dirty = True
+
+    def forget(self, key: str) -> None:
+        """Drop a file_id that Telegram no longer accepts."""
+        if self._file_ids.pop(key, None) is not None:
+            self._dirty = True
+
+    def record_miss(self) -> None:
+        self.counters["misses"] += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".mp4")
+
+    def _scan_disk(self) -> None:
+        """Rebuild the disk tier index from the cache directory.
+
+        Keys are not recoverable from the hashed file names, so entries found
+        on disk are indexed by their path and only used for size accounting
+        and eviction until they expire.
+        """
+        entries = []
+        with os.scandir(self.disk_dir) as it:
+            for entry in it:
+                if entry.is_file():
+                    st = entry.stat()
+                    entries.append((st.st_atime, entry.path, st.st_size))
+        for atime, path, size in sorted(entries):
+            self._disk[path] = [path, size, atime]
+            self._disk_bytes += size
+        self.evict()
+
+    def get_path(self, key: str) -> Optional[str]:
+        """Get the cached media file for a video from the disk tier."""
+        if not self.disk_enabled:
+            return None
+        entry = self._disk.get(key)
+        if entry is None:
+            path = self._disk_path(key)
+            entry = self._disk.pop(path, None)
+            if entry is None:
+                return None
+            self._disk[key] = entry
+        path, size, last_access = entry
+        if time.time() - last_access > self.disk_ttl or not os.path.exists(path):
+            self._remove_disk_entry(key)
+            return None
+        entry[2] = time.time()
+        self._disk.move_to_end(key)
+        self.counters["disk_hits"] += 1
+        return path
+
+    async def store(self, key: str, media: Union[str, bytes]) -> Optional[str]:
+        """Put downloaded media (a file path, which is moved, or bytes) into the disk tier.
+
+        Returns the cached file path.
+        """
+        if not self.disk_enabled:
+            return None
+        loop = asyncio.get_running_loop()
+        size = len(media) if isinstance(media, bytes) else await loop.run_in_executor(None, _file_size, media)
+        if size is None or size > self.disk_max_bytes:
+            return None
+        path = self._disk_path(key)
+        if key in self._disk:
+            # Same path: the new file replaces it
+            self._drop_disk_entry(key)
+        victims = self._evict(size)
+        # Indexed once the file is in place; until then lookups miss
+        await loop.run_in_executor(None, _put_file, path, media, victims)
+        self._disk[key] = [path, size, time.time()]
+        self._disk_bytes += size
+        return path
+
+    def _drop_disk_entry(self, key: str) -> str:
+        """Remove an entry from the index and return its path."""
+        path, size, _ = self._disk.pop(key)
+        self._disk_bytes -= size
+        self.counters["evictions"] += 1
+        return path
+
+    def _remove_disk_entry(self, key: str) -> None:
+        try:
+            os.remove(self._drop_disk_entry(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, incoming: int = 0) -> List[str]:
+        """Drop expired entries and least recently used ones until `incoming` more bytes fit; returns their paths."""
+        now = time.time()
+        victims = [self._drop_disk_entry(key)
+                   for key in [k for k, (_, _, last_access) in self._disk.items() if now - last_access > self.disk_ttl]]
+        while self._disk_bytes + incoming > self.disk_max_bytes and self._disk:
+            victims.append(self._drop_disk_entry(next(iter(self._disk))))
+        return victims
+
+    def evict(self) -> None:
+        """Evict expired entries and least recently used ones above the size limit."""
+        for path in self._evict():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache hit/miss counters and sizes."""
+        return {
+            **self.counters,
+            "file_ids": len(self._file_ids),
+            "disk_files": len(self._disk),
+            "disk_bytes": self._disk_bytes
+        }
+
+
+# Create global media cache instance
+media_cache = MediaCache(
+    file_path=MEDIA_CACHE_FILE,
+    max_entries=MEDIA_CACHE_MAX_ENTRIES,
+    disk_dir=MEDIA_CACHE_DIR,
+    disk_enabled=MEDIA_DISK_CACHE_ENABLED,
+    disk_max_bytes=MEDIA_DISK_CACHE_MAX_SIZE * 1024 * 1024,
+    disk_ttl=MEDIA_DISK_CACHE_TTL
+)
@@ -0,0 +1,126 @@
+import logging
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+from config import CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN, CIRCUIT_MAX_COOLDOWN
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Error kinds by the phrases yt-dlp and the platforms use, checked in this order.
+# Instagram answers a rate limit with "...not available, rate-limit reached or
+# login required", so rate limits are recognized before logins.
+ERROR_KINDS = (
+    ("auth", ("checkpoint", "challenge_required", "suspended")),
+    ("rate_limit", ("rate-limit", "rate limit", "too many requests", "please wait a few minutes")),
+    ("auth", ("login required", "login_required", "not logged in", "unauthorized")),
+    ("content", ("not available", "unavailable", "private", "not found", "removed", "larger than",
+                 "unsupported", "carousel item", "no video")),
+    ("network", ("timed out", "timeout", "connection", "temporary failure", "name resolution", "ssl",
+                 "reset by peer", "bad gateway", "service unavailable")),
+)
+# HTTP status codes, only recognized where they are given as such
+HTTP_ERROR_KINDS = {"401": "auth", "404": "content", "429": "rate_limit",
+                    "500": "network", "502": "network", "503": "network", "504": "network"}
+# "[TikTok] 7301401234567890123: " wherever yt-dlp's message is quoted (the downloader wraps it
+# as "Download error: ERROR: [...] <id>: ..."): the video ID must not be read as a code or phrase
+VIDEO_PREFIX = re.compile(r"\[[^\]]+\] [^\s:]+: ")
+HTTP_STATUS = re.compile(r"\b(?:http error|status code|status|response code)[: ]+(\d{3})\b")
+
+
+def classify_error(message: str) -> str:
+    """Kind of a download error: auth, rate_limit, content, network or other.
+
+    Content errors are about the video, not about the account or platform,
+    and don't count against their health.
+    """
+    message = VIDEO_PREFIX.sub("", message.lower())
+    for kind, phrases in ERROR_KINDS:
+        if any(phrase in message for phrase in phrases):
+            return kind
+    match = HTTP_STATUS.search(message)
+    if match:
+        return HTTP_ERROR_KINDS.get(match.group(1), "other")
+    return "other"
+
+
+class CircuitBreaker:
+    """Stops sending requests to something that keeps failing.
+
+    Closed: requests pass, consecutive failures are counted. After
+    `failure_threshold` of them (or one severe failure) the breaker opens and
+    refuses everything for `cooldown` seconds. Then it is half-open: a single
+    probe request goes through; success closes the breaker, failure opens it
+    again with the cooldown doubled up to `max_cooldown`. Thread-safe.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, cooldown: float, max_cooldown: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.cooldown = cooldown
+        self.opened_at = 0.0
+        self.probe_started: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """May a request go through now? In half-open state this hands out the single probe."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now < self.opened_at + self.cooldown:
+                    return False
+                self.state = HALF_OPEN
+                self.probe_started = None
+            # A probe that never reported back (cancelled, crashed) is replaced after a cooldown
+            if self.probe_started is not None and now < self.probe_started + self.cooldown:
+                return False
+            self.probe_started = now
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != CLOSED:
+                logging.info(f"Circuit {self.name} closed")
+            self.state = CLOSED
+            self.failures = 0
+            self.cooldown = self.base_cooldown
+            self.probe_started = None
+
+    def record_failure(self, severe: bool = False) -> None:
+        """Count a failure; `severe` opens the breaker right away."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                self._open()
+            elif self.state == CLOSED:
+                self.failures += 1
+                if severe or self.failures >= self.failure_threshold:
+                    self._open()
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.probe_started = None
+        logging.warning(f"Circuit {self.name} opened for {self.cooldown:.0f}s after {self.failures} failures")
+
+    def retry_after(self) -> float:
+        """Seconds until the next probe may go through (0 when closed)."""
+        if self.state == CLOSED:
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+
+# Create per-platform circuit breakers
+platform_circuits: Dict[str, CircuitBreaker] = {
+    platform: CircuitBreaker(platform, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN, CIRCUIT_MAX_COOLDOWN)
+    for platform in ("tiktok", "instagram")
+}
@@ -10,9 +10,24 @@ ADMIN_ID = os.getenv("ADMIN_ID")
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME")
 BACKUP_CHAT_ID = os.getenv("BACKUP_CHAT_ID")
 
+# Update delivery: "polling" or "webhook" (aiohttp server); either way a single process, its state is local
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # public https base URL, e.g. https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Checked on every update; derived from the token when not set
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
 # File Paths
 DATA_FILE = "data/user_data.json"
 STATS_FILE = "data/stats.json"
+JOURNAL_FILE = "data/journal.log"
+SQLITE_FILE = "data/bot.db"
+# Held by the running bot: its state is in-process, so a second instance on the same data/ refuses to start
+INSTANCE_LOCK_FILE = "data/bot.lock"
+COOKIE_FILE = "cookies.txt"
 TEMP_DIR = "downloads"
 LOG_DIR = "logs"
 
@@ -23,11 +38,149 @@ for directory in [TEMP_DIR, LOG_DIR, "data"]:
 # Rate Limiting
 FREE_USER_DAILY_LIMIT = 5
 PREMIUM_PRICE = 5  # in USD
+RATE_LIMIT_FILE = "data/ratelimit.json"
+RATE_LIMIT_IDLE_TTL = 2 * 86400  # seconds before an idle user's limiter state is dropped
+# daily: downloads per sliding 24h (None = no quota); burst/rate: token bucket size and refill per second
+RATE_LIMIT_TIERS = {
+    "free": {"daily": FREE_USER_DAILY_LIMIT, "burst": 2, "rate": 1 / 30},
+    "premium": {"daily": None, "burst": 5, "rate": 1 / 5},
+    "admin": {"unlimited": True}
+}
+# Global outbound request budget per platform, shared by all users
+PLATFORM_RATE_LIMITS = {
+    "tiktok": {"burst": 20, "rate": 2.0},
+    "instagram": {"burst": 5, "rate": 0.5}
+}
+PLATFORM_MAX_WAIT = 60  # seconds a download may wait for the platform budget
+# Per-platform circuit breakers: fail fast while a platform is down
+CIRCUIT_FAILURE_THRESHOLD = 5  # consecutive failed downloads that open the circuit
+CIRCUIT_COOLDOWN = 60  # seconds before a probe download is let through
+CIRCUIT_MAX_COOLDOWN = 900  # seconds, the cooldown doubles after every failed probe
+
+# Instagram accounts: cookies/<name>.txt files and/or INSTAGRAM_ACCOUNTS="user:password,..."
+INSTAGRAM_COOKIE_DIR = os.getenv("INSTAGRAM_COOKIE_DIR", "cookies")
+INSTAGRAM_ACCOUNT_LIMITS = {"burst": 10, "rate": 0.1}  # requests per account: token bucket size and refill per second
+INSTAGRAM_ACCOUNT_MAX_WAIT = 20  # seconds a download may wait for an account with budget left
+ACCOUNT_FAILURE_THRESHOLD = 3  # consecutive failures that bench an account; checkpoints bench it at once
+ACCOUNT_COOLDOWN = 300  # seconds an account stays benched before a probe
 
 # Download Settings
 MAX_FILE_SIZE_FREE = 15  # MB
 MAX_FILE_SIZE_PREMIUM = 100  # MB
+METADATA_CACHE_TTL = 600  # seconds extracted video metadata is reused
+METADATA_CACHE_SIZE = 1000  # entries
+INMEMORY_MAX_SIZE = int(os.getenv("INMEMORY_MAX_SIZE", "20"))  # MB, smaller videos skip the temp file
+INMEMORY_BUDGET = int(os.getenv("INMEMORY_BUDGET", "200"))  # MB of videos held in memory at once
+
+# Batches: several links in one message and carousel posts
+MAX_LINKS_PER_MESSAGE = 10
+MAX_BATCH_ITEMS = 30  # videos per message, carousels included
+MEDIA_GROUP_SIZE = 10  # Telegram's limit for one album
+
+# Link canonicalization: short links are resolved once and remembered
+URL_PARSE_CACHE_SIZE = 10000  # parsed links
+URL_CACHE_SIZE = 10000  # resolved short links
+URL_CACHE_TTL = 86400  # seconds
+URL_RESOLVE_TIMEOUT = 5  # seconds per short link
+
+# Transcoding (needs ffmpeg): shrink videos over the size cap, remux others to faststart MP4
+TRANSCODE_ENABLED = os.getenv("TRANSCODE_ENABLED", "0") == "1"
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", "1"))  # processes, each runs one ffmpeg
+TRANSCODE_THREADS = 2  # ffmpeg threads per job
+TRANSCODE_NICE = 10  # priority decrement of transcode workers, keeps the bot responsive
+TRANSCODE_TIMEOUT = 180  # seconds per ffmpeg run
+TRANSCODE_MAX_INPUT = 300  # MB, largest download accepted for shrinking
+TRANSCODE_AUDIO_BITRATE = 96  # kbps
+TRANSCODE_MIN_VIDEO_BITRATE = 150  # kbps; longer videos are refused rather than made unwatchable
+TRANSCODE_CACHE_DIR = "cache/transcoded"
+TRANSCODE_CACHE_MAX_SIZE = int(os.getenv("TRANSCODE_CACHE_MAX_SIZE", "500"))  # MB
+
+# Temp storage: downloads in TEMP_DIR reserve space before they start
+TEMP_DIR_QUOTA = int(os.getenv("TEMP_DIR_QUOTA", "2048"))  # MB of temp files at once
+TEMP_MIN_FREE = int(os.getenv("TEMP_MIN_FREE", "500"))  # MB of disk always left free
+TEMP_RESERVE_WAIT = 30  # seconds a download may wait for space before it is refused
+TEMP_ORPHAN_AGE = 900  # seconds after which a leftover or abandoned temp file is removed
+TEMP_SWEEP_INTERVAL = 60  # seconds between checks for abandoned temp files
+
+# Download Executor
+DOWNLOAD_POOL = os.getenv("DOWNLOAD_POOL", "thread")  # "thread", "process" or "queue" (worker.py)
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "4"))
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "4"))
+PREMIUM_SCHEDULING_WEIGHT = 3  # premium jobs scheduled per free job
+USER_MAX_CONCURRENT_DOWNLOADS = int(os.getenv("USER_MAX_CONCURRENT_DOWNLOADS", "2"))  # jobs of one user at once
+DOWNLOAD_TIMEOUT = 300  # seconds, for download plus upload of one video
+
+# Job Queue (DOWNLOAD_POOL=queue)
+JOB_QUEUE_FILE = os.getenv("JOB_QUEUE_FILE", "data/jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # processes started by worker.py
+JOB_LEASE = 60  # seconds a running job stays claimed without a heartbeat
+JOB_HEARTBEAT_INTERVAL = 10  # seconds
+JOB_MAX_ATTEMPTS = 3  # attempts before a job is dead-lettered
+JOB_RETRY_BACKOFF = 5  # seconds before the first retry, doubled for each further one
+JOB_POLL_INTERVAL = 0.2  # seconds between checks for new jobs and finished results
+JOB_RETENTION = 86400  # seconds finished and dead jobs are kept
+
+# Delivery Journal
+DELIVERY_JOURNAL_FILE = "data/deliveries.log"
+DELIVERY_MAX_AGE = 3600  # seconds; older unfinished requests are dropped instead of resumed
+DELIVERY_COMPACT_SIZE = 1024 * 1024  # bytes of journal that trigger a rewrite
+SHUTDOWN_DRAIN_TIMEOUT = int(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "25"))  # seconds to finish requests on shutdown
+
+# Media Cache
+MEDIA_CACHE_FILE = "data/media_cache.json"
+MEDIA_CACHE_MAX_ENTRIES = 100000  # remembered Telegram file_ids
+MEDIA_CACHE_DIR = "cache"
+MEDIA_DISK_CACHE_ENABLED = os.getenv("MEDIA_DISK_CACHE_ENABLED", "0") == "1"
+MEDIA_DISK_CACHE_MAX_SIZE = int(os.getenv("MEDIA_DISK_CACHE_MAX_SIZE", "500"))  # MB
+MEDIA_DISK_CACHE_TTL = 86400  # seconds
+
+# Persistence
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")  # "json" or "sqlite"
+DAILY_STATS_RETENTION = 90  # days of daily stats kept (sqlite: kept in memory, older days stay on disk)
+
+# Stats rollups: download counts and latency in fixed-size ring buffers
+STATS_ROLLUP_FILE = "data/rollups.json"
+STATS_ROLLUPS = {
+    "minute": (60, 24 * 60),  # (seconds per bucket, buckets): the last 24 hours
+    "hour": (3600, 30 * 24),  # the last 30 days
+    "day": (86400, 365)  # the last year
+}
+STATS_FLUSH_INTERVAL = 60  # seconds between saves of the rollups
+JOURNAL_COMMIT_INTERVAL = 1.0  # seconds between journal group commits
+JOURNAL_COMPACT_INTERVAL = 300  # seconds between snapshots
+JOURNAL_COMPACT_SIZE = 4 * 1024 * 1024  # bytes of journal that force a snapshot
+
+# Admin Panel
+USERS_PAGE_SIZE = 10
+
+# Broadcast
+BROADCAST_FILE = "data/broadcast.json"  # the running broadcast, kept until it finishes
+BROADCAST_PROGRESS_FILE = "data/broadcast.log"  # one line per recipient with a result
+BROADCAST_CONCURRENCY = 20  # messages in flight
+BROADCAST_RATE = 25  # messages per second, below Telegram's ~30/s bot limit
+BROADCAST_MIN_RATE = 1  # floor for the rate after repeated RetryAfter
+BROADCAST_MAX_RETRIES = 3  # retries of network and server errors per recipient
+BROADCAST_REPORT_INTERVAL = 5  # seconds between progress updates to the admin
+
+# Metrics
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))  # 0 disables the /metrics endpoint
+LOOP_LAG_INTERVAL = 0.5  # seconds between event loop lag probes
+
+# Logging: written by a background thread, rotated into gzipped backups
+LOG_ROTATE = os.getenv("LOG_ROTATE", "size")  # "size", or a rotation interval: "midnight", "h", "d"
+LOG_MAX_SIZE = int(os.getenv("LOG_MAX_SIZE", "20"))  # MB per log file when LOG_ROTATE=size
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "10"))  # rotated files kept per log
+LOG_INFO_RATE = 20  # info records per second from one line of code; the rest are counted and dropped
+LOG_JOB_RATE = int(os.getenv("LOG_JOB_RATE", "50"))  # successful job records per second before sampling
+LOG_SLOW_JOB = 30  # seconds; slower requests are always logged
 
 # Backup Settings
-BACKUP_INTERVAL = 3600  # seconds
-FILE_CLEANUP_INTERVAL = 3600  # seconds 
\ No newline at end of file
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_INTERVAL = int(os.getenv("BACKUP_INTERVAL", "3600"))  # seconds between backups (incremental ones)
+BACKUP_FULL_INTERVAL = int(os.getenv("BACKUP_FULL_INTERVAL", str(7 * 86400)))  # seconds between full backups
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "4"))  # full backups kept, each with its incremental ones
+BACKUP_UPLOAD_MAX = 50  # MB; larger backups stay on disk only (Telegram's bot upload limit)
+
+# Periodic maintenance: media cache expiry, saving caches
+MAINTENANCE_INTERVAL = 3600  # seconds 
\ No newline at end of file
@@ -1,44 +1,131 @@
-import json
-import os
-import shutil
-from datetime import datetime
-from typing import Dict, Any, Optional
+import atexit
+import bisect
+import logging
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Dict, Any, List, Optional, Tuple
 
-from config import DATA_FILE, STATS_FILE
+from config import STORAGE_BACKEND, DAILY_STATS_RETENTION
+from rollups import stats_rollups
+from storage import SQLiteStorage, create_storage
+from users import User, load_users
 
 class Database:
-    def __init__(self):
-        self.user_data = self._load_data(DATA_FILE, {"users": {}, "banned": [], "premium": []})
-        self.stats = self._load_data(STATS_FILE, {
-            "total_downloads": 0,
-            "daily": {},
-            "users": {},
-            "platforms": {"tiktok": 0, "instagram": 0}
+    def __init__(self, backend: str = STORAGE_BACKEND):
+        self.storage = create_storage(backend)
+        # SQLite answers the admin user lists from its indexes; JSON needs in-memory ones
+        self._sql = isinstance(self.storage, SQLiteStorage)
+        state = self.storage.load()
+        user_data = state["user_data"]
+        self.users, converted = load_users(user_data["users"])
+        # Membership checks run on every message; dicts keep the order for the admin panel
+        self.banned: Dict[str, None] = dict.fromkeys(user_data.get("banned", []))
+        self.premium: Dict[str, None] = dict.fromkeys(user_data.get("premium", []))
+        # Users who blocked the bot or deleted their account, skipped by broadcasts
+        self.unreachable: Dict[str, None] = dict.fromkeys(user_data.get("unreachable", []))
+        self.stats = state["stats"]
+        # SQLite keeps every day on disk and only loads the recent ones
+        expired = self._expire_daily() if backend != "sqlite" else 0
+        self._build_indexes()
+        # The stored user dicts are no longer referenced here and go to the storage
+        self.storage.start(state)
+        if converted:
+            # Persist the epoch timestamps once instead of converting on every start
+            self.save_data()
+        if expired:
+            self.save_stats()
+        atexit.register(self.close)
+
+    def _expire_daily(self) -> int:
+        """Move daily stats older than DAILY_STATS_RETENTION days to the day rollups."""
+        since = (datetime.now() - timedelta(days=DAILY_STATS_RETENTION)).strftime("%Y-%m-%d")
+        expired = {day: counts for day, counts in self.stats["daily"].items() if day < since}
+        if not expired:
+            return 0
+        # Saved to the rollups before the days leave stats.json
+        folded = stats_rollups.fold_days(expired)
+        success = sum(counts.get("success", 0) for counts in expired.values())
+        failed = sum(counts.get("failed", 0) for counts in expired.values())
+        log = logging.info if folded == len(expired) else logging.warning
+        log(f"Removed {len(expired)} days of daily stats ({min(expired)} to {max(expired)}: {success} successful, "
+            f"{failed} failed), {folded} of them kept in the day rollups")
+        for day in expired:
+            del self.stats["daily"][day]
+        return len(expired)
+
+    def _build_indexes(self) -> None:
+        """Build the activity and name indexes (JSON backend only)."""
+        if self._sql:
+            return
+        # user_id -> last_activity, oldest first; activity updates move users to the end
+        self._activity: "OrderedDict[str, int]" = OrderedDict(
+            sorted(((uid, user.last_activity) for uid, user in self.users.items()), key=lambda item: item[1])
+        )
+        # Sorted (lowercase name, user_id) pairs for username and first name prefix lookups
+        self._names: List[Tuple[str, str]] = sorted(
+            (name, uid) for uid, user in self.users.items() for name in self._user_names(user)
+        )
+
+    @staticmethod
+    def _user_names(user: User) -> List[str]:
+        return [name.lower() for name in (user.username, user.first_name) if name]
+
+    def _index_names(self, user_id: str, add: bool) -> None:
+        """Add the user's names to the name index, or remove them."""
+        if self._sql:
+            return
+        for name in self._user_names(self.users[user_id]):
+            if add:
+                bisect.insort(self._names, (name, user_id))
+                continue
+            i = bisect.bisect_left(self._names, (name, user_id))
+            if i < len(self._names) and self._names[i] == (name, user_id):
+                del self._names[i]
+
+    def _journal_user(self, user_id: str) -> None:
+        self.storage.append(("user", user_id), {
+            "op": "user", "id": user_id, "data": self.users[user_id].to_dict()
         })
 
-    def _load_data(self, file_path: str, default: Dict) -> Dict:
-        """Load data from JSON file or return default if file doesn't exist."""
-        if os.path.exists(file_path):
-            with open(file_path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        return default
+    def export_user_data(self) -> Dict[str, Any]:
+        """User data in the stored format (the JSON data file layout)."""
+        return {
+            "users": {uid: user.to_dict() for uid, user in self.users.items()},
+            "banned": list(self.banned),
+            "premium": list(self.premium),
+            "unreachable": list(self.unreachable)
+        }
+
+    def _journal_membership(self, kind: str, user_id: str, value: bool) -> None:
+        self.storage.append((kind, user_id), {"op": kind, "id": user_id, "value": value})
 
     def save_data(self) -> None:
-        """Save user data with backup."""
-        if os.path.exists(DATA_FILE):
-            shutil.copy2(DATA_FILE, f"{DATA_FILE}.bak")
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(self.user_data, f, indent=4, ensure_ascii=False)
+        """Persist the whole user data.
+
+        Only needed after changing users directly; the methods below journal
+        their own changes.
+        """
+        self.storage.append(("user_data",), {"op": "user_data", "data": self.export_user_data()})
 
     def save_stats(self) -> None:
-        """Save stats with backup."""
-        if os.path.exists(STATS_FILE):
-            shutil.copy2(STATS_FILE, f"{STATS_FILE}.bak")
-        with open(STATS_FILE, "w", encoding="utf-8") as f:
-            json.dump(self.stats, f, indent=4, ensure_ascii=False)
-
-    def update_stats(self, user_id: str, success: bool = True, platform: Optional[str] = None) -> None:
-        """Update statistics for a user."""
+        """Persist the whole stats. Only needed after changing stats directly."""
+        self.storage.append(("stats_data",), {"op": "stats_data", "data": self.stats})
+
+    def flush(self) -> None:
+        """Write queued changes to disk now."""
+        self.storage.commit()
+
+    def close(self) -> None:
+        """Flush queued changes and close the storage backend."""
+        self.storage.close()
+
+    def update_stats(self, user_id: str, success: bool = True, platform: Optional[str] = None,
+                     latency: float = 0.0) -> None:
+        """Update statistics for a user. `latency` is how long the request took, for the rollups."""
+        stats_rollups.record(platform, success, latency)
         today = datetime.now().strftime("%Y-%m-%d")
         if today not in self.stats["daily"]:
             self.stats["daily"][today] = {"success": 0, "failed": 0}
@@ -61,75 +148,134 @@ class Database:
         else:
             self.stats["users"][user_id]["failed"] += 1
         
-        self.save_stats()
+        self.storage.append(("stats", user_id), {
+            "op": "stats",
+            "id": user_id,
+            "user": self.stats["users"][user_id],
+            "day": today,
+            "daily": self.stats["daily"][today],
+            "total_downloads": self.stats["total_downloads"],
+            "platforms": self.stats["platforms"]
+        })
 
     def add_user(self, user_id: str, username: str, first_name: str, last_name: str) -> None:
         """Add new user to database."""
-        if user_id not in self.user_data["users"]:
-            self.user_data["users"][user_id] = {
-                "language": None,
-                "username": username,
-                "first_name": first_name,
-                "last_name": last_name,
-                "join_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "last_activity": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
-            self.save_data()
+        if user_id not in self.users:
+            now = int(time.time())
+            self.users[user_id] = User(None, username, first_name, last_name, now, now)
+            self._touch(user_id, now)
+            self._index_names(user_id, add=True)
+            self._journal_user(user_id)
 
-    def update_user_activity(self, user_id: str) -> None:
-        """Update user's last activity timestamp."""
-        if user_id in self.user_data["users"]:
-            self.user_data["users"][user_id]["last_activity"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.save_data()
+    def update_user_activity(self, user_id: str, username: Optional[str] = None, first_name: Optional[str] = None,
+                             last_name: Optional[str] = None) -> None:
+        """Update user's last activity timestamp, and their names when `first_name` is given.
+
+        Telegram users always have a first name, so without one the names are
+        left as they are; a missing username or last name is then stored as such.
+        """
+        if user_id in self.users:
+            now = int(time.time())
+            user = self.users[user_id]
+            if first_name is not None and (username, first_name, last_name) != (
+                    user.username, user.first_name, user.last_name):
+                self._index_names(user_id, add=False)
+                user.username, user.first_name, user.last_name = username, first_name, last_name
+                self._index_names(user_id, add=True)
+            user.last_activity = now
+            self._touch(user_id, now)
+            self._journal_user(user_id)
+            if user_id in self.unreachable:
+                # Writing to the bot again means the user unblocked it
+                self.set_user_unreachable(user_id, False)
+
+    def _touch(self, user_id: str, now: int) -> None:
+        """Move a user to the end of the activity index."""
+        if not self._sql:
+            self._activity[user_id] = now
+            self._activity.move_to_end(user_id)
+
+    async def get_recent_users(self, limit: int = 10, offset: int = 0) -> List[Tuple[str, User]]:
+        """Get users ordered by last activity, newest first. O(offset + limit)."""
+        if self._sql:
+            ids = await self.storage.recent_users(limit, offset)
+            return [(uid, self.users[uid]) for uid in ids if uid in self.users]
+        return [(uid, self.users[uid]) for uid in islice(reversed(self._activity), offset, offset + limit)]
+
+    async def find_users(self, prefix: str, limit: int = 10) -> List[Tuple[str, User]]:
+        """Find users whose username or first name starts with `prefix` (case-insensitive)."""
+        prefix = prefix.lstrip("@").lower()
+        if self._sql:
+            ids = await self.storage.find_users(prefix, limit)
+            return [(uid, self.users[uid]) for uid in ids if uid in self.users]
+        found: "OrderedDict[str, User]" = OrderedDict()
+        for name, uid in islice(self._names, bisect.bisect_left(self._names, (prefix, "")), None):
+            if not name.startswith(prefix) or len(found) >= limit:
+                break
+            found[uid] = self.users[uid]
+        return list(found.items())
 
     def set_user_language(self, user_id: str, language: str) -> None:
         """Set user's preferred language."""
-        if user_id in self.user_data["users"]:
-            self.user_data["users"][user_id]["language"] = language
-            self.save_data()
+        if user_id in self.users:
+            self.users[user_id].language = sys.intern(language)
+            self._journal_user(user_id)
 
-    def get_user_language(self, user_id: str) -> str:
-        """Get user's preferred language."""
-        return self.user_data["users"].get(user_id, {}).get("language", "ru")
+    def get_user_language(self, user_id: str) -> Optional[str]:
+        """Get user's preferred language: "ru" for unknown users, None if they haven't chosen one yet."""
+        user = self.users.get(user_id)
+        return user.language if user else "ru"
 
     def is_user_banned(self, user_id: str) -> bool:
         """Check if user is banned."""
-        return user_id in self.user_data["banned"]
+        return user_id in self.banned
 
     def is_user_premium(self, user_id: str) -> bool:
         """Check if user has premium status."""
-        return user_id in self.user_data.get("premium", [])
+        return user_id in self.premium
 
     def ban_user(self, user_id: str) -> bool:
         """Ban a user."""
-        if user_id in self.user_data["users"] and user_id not in self.user_data["banned"]:
-            self.user_data["banned"].append(user_id)
-            self.save_data()
+        if user_id in self.users and user_id not in self.banned:
+            self.banned[user_id] = None
+            self._journal_membership("banned", user_id, True)
             return True
         return False
 
     def unban_user(self, user_id: str) -> bool:
         """Unban a user."""
-        if user_id in self.user_data["banned"]:
-            self.user_data["banned"].remove(user_id)
-            self.save_data()
+        if user_id in self.banned:
+            del self.banned[user_id]
+            self._journal_membership("banned", user_id, False)
             return True
         return False
 
     def toggle_premium(self, user_id: str) -> bool:
         """Toggle premium status for a user."""
-        if user_id in self.user_data["users"]:
-            if "premium" not in self.user_data:
-                self.user_data["premium"] = []
-            
-            if user_id in self.user_data["premium"]:
-                self.user_data["premium"].remove(user_id)
+        if user_id in self.users:
+            if user_id in self.premium:
+                del self.premium[user_id]
+                self._journal_membership("premium", user_id, False)
             else:
-                self.user_data["premium"].append(user_id)
-            self.save_data()
+                self.premium[user_id] = None
+                self._journal_membership("premium", user_id, True)
             return True
         return False
 
+    def set_user_unreachable(self, user_id: str, value: bool = True) -> None:
+        """Mark a user the bot can't message (blocked bot, deactivated account)."""
+        if value == (user_id in self.unreachable):
+            return
+        if value:
+            self.unreachable[user_id] = None
+        else:
+            del self.unreachable[user_id]
+        self._journal_membership("unreachable", user_id, value)
+
+    def get_broadcast_recipients(self) -> List[str]:
+        """User ids a broadcast should go to: everyone not banned and still reachable."""
+        return [uid for uid in self.users if uid not in self.banned and uid not in self.unreachable]
+
     def get_user_stats(self, user_id: str) -> Dict[str, Any]:
         """Get statistics for a specific user."""
         return self.stats["users"].get(user_id, {"downloads": 0, "failed": 0, "platforms": {}})
@@ -139,9 +285,10 @@ class Database:
         return {
             "total_downloads": self.stats["total_downloads"],
             "platforms": self.stats["platforms"],
-            "total_users": len(self.user_data["users"]),
-            "premium_users": len(self.user_data.get("premium", [])),
-            "banned_users": len(self.user_data["banned"])
+            "total_users": len(self.users),
+            "premium_users": len(self.premium),
+            "banned_users": len(self.banned),
+            "unreachable_users": len(self.unreachable)
         }
 
 # Create global database instance
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Any, Dict, List
+
+from config import DELIVERY_JOURNAL_FILE, DELIVERY_MAX_AGE, DELIVERY_COMPACT_SIZE
+
+# A delivery goes queued -> downloading -> uploading -> done (or failed)
+FINAL_STATES = ("done", "failed")
+
+
+class DeliveryJournal:
+    """Append-only on-disk record of video requests that are not delivered yet.
+
+    Each request is written when it is accepted and every state change after
+    that is one more line, flushed right away, so a killed process loses at
+    most the line being written. On startup load() returns the requests that
+    never reached a final state; the bot delivers them again. A request that
+    was already uploading when the process died may reach the user twice;
+    none is lost. The file is rewritten with only unfinished requests on load
+    and whenever it grows past compact_size.
+    """
+
+    def __init__(self, path: str, max_age: float, compact_size: int):
+        self.path = path
+        self.max_age = max_age
+        self.compact_size = compact_size
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._file = None
+        self._written = 0
+        self.stats: Dict[str, Any] = {"recovered": 0, "dropped": 0, "load_seconds": 0.0, "recovery_seconds": None}
+
+    def load(self) -> List[Dict[str, Any]]:
+        """Read the journal and return the unfinished requests, oldest first."""
+        started = time.perf_counter()
+        jobs: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn last line of a crash
+                        continue
+                    if "chat_id" in record:
+                        jobs[record["id"]] = record
+                    elif record["id"] in jobs:
+                        jobs[record["id"]]["state"] = record["state"]
+
+        now = time.time()
+        for job_id, job in list(jobs.items()):
+            if job["state"] in FINAL_STATES:
+                del jobs[job_id]
+            elif now - job["created"] > self.max_age:
+                # The user has long given up on this one
+                del jobs[job_id]
+                self.stats["dropped"] += 1
+        self._jobs = jobs
+        self.compact()
+        self.stats["recovered"] = len(jobs)
+        self.stats["load_seconds"] = time.perf_counter() - started
+        return sorted(jobs.values(), key=lambda job: job["created"])
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        self._file.write(line)
+        self._file.flush()
+        self._written += len(line)
+        if self._written > self.compact_size:
+            self.compact()
+
+    def compact(self) -> None:
+        """Rewrite the journal with only the unfinished requests."""
+        if self._file is not None:
+            self._file.close()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for job in self._jobs.values():
+                f.write(json.dumps(job, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._written = 0
+
+    def start(self, chat_id: int, user_id: str, url: str, is_premium: bool, lang: str) -> str:
+        """Record a new request. Returns its id."""
+        job = {
+            "id": uuid.uuid4().hex[:12],
+            "chat_id": chat_id,
+            "user_id": user_id,
+            "url": url,
+            "is_premium": is_premium,
+            "lang": lang,
+            "state": "queued",
+            "created": time.time()
+        }
+        self._jobs[job["id"]] = job
+        self._append(job)
+        return job["id"]
+
+    def update(self, job_id: str, state: str) -> None:
+        """Record a state change of a request."""
+        job = self._jobs.get(job_id)
+        if job is None or job["state"] == state:
+            return
+        if state in FINAL_STATES:
+            del self._jobs[job_id]
+        else:
+            job["state"] = state
+        self._append({"id": job_id, "state": state})
+
+    def active(self) -> int:
+        """Requests accepted but not finished."""
+        return len(self._jobs)
+
+    async def drain(self, timeout: float) -> int:
+        """Wait up to `timeout` seconds for active requests to finish. Returns how many are left."""
+        deadline = time.monotonic() + timeout
+        while self._jobs and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        return len(self._jobs)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# Create global delivery journal instance
+delivery_journal = DeliveryJournal(
+    path=DELIVERY_JOURNAL_FILE,
+    max_age=DELIVERY_MAX_AGE,
+    compact_size=DELIVERY_COMPACT_SIZE
+)
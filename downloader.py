@@ -1,153 +1,425 @@
+import copy
+import logging
 import os
-import re
+import threading
 import time
-import yt_dlp
-from typing import Optional, Tuple
-from config import TEMP_DIR, MAX_FILE_SIZE_FREE, MAX_FILE_SIZE_PREMIUM
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple, Union
+from yt_dlp.networking import Request
+from accounts import Account, instagram_accounts
+from circuit import classify_error, platform_circuits
+from config import (TEMP_DIR, MAX_FILE_SIZE_FREE, MAX_FILE_SIZE_PREMIUM, METADATA_CACHE_TTL, METADATA_CACHE_SIZE,
+                    INMEMORY_MAX_SIZE, INMEMORY_BUDGET, DOWNLOAD_POOL, TRANSCODE_MAX_INPUT,
+                    TEMP_RESERVE_WAIT)
+from executor import download_executor
+from jobqueue import JobFailedError
+from logpipe import JobRecord
+from metrics import metrics
+from tempstore import temp_storage
+from transcode import TranscodeError, transcoder
+from urlcanon import parse
+from ydlpool import ydl_pool
+
+# download_video_sync() errors that retrying won't fix
+PERMANENT_ERRORS = ("Unsupported platform", "Video is larger than")
+
+class DownloadError(Exception):
+    """Raised when a video could not be downloaded."""
+
+class PlatformBusyError(DownloadError):
+    """Raised when the platform request budget is exhausted."""
+
+class StorageFullError(DownloadError):
+    """Raised when no temp disk space could be reserved for a download."""
+
+class PlatformDownError(DownloadError):
+    """Raised without downloading while the platform's circuit breaker is open."""
+
+    def __init__(self, platform: str, retry_after: float):
+        super().__init__(f"{platform} is unavailable, retry in {retry_after:.0f}s")
+        self.platform = platform
+        self.retry_after = retry_after
+
+class MetadataCache:
+    """Thread-safe LRU of extracted video metadata with a TTL.
+
+    Format URLs returned by the platforms expire, so entries only live for
+    METADATA_CACHE_TTL seconds.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0}
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            # yt-dlp mutates the info dict while downloading
+            return copy.deepcopy(entry[1])
+
+    def put(self, key: str, info: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, copy.deepcopy(info))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+metadata_cache = MetadataCache(METADATA_CACHE_SIZE, METADATA_CACHE_TTL)
+
+
+class MemoryBudget:
+    """Bytes of video that may be held in memory at once, across all jobs.
+
+    Used from the event loop only. A job reserves the in-memory size limit up
+    front (the real size is only known inside the worker) and releases the
+    unused part when the download returns.
+    """
+
+    def __init__(self, total: int):
+        self.total = total
+        self.used = 0
+
+    def try_reserve(self, size: int) -> bool:
+        if self.used + size > self.total:
+            return False
+        self.used += size
+        return True
+
+    def release(self, size: int) -> None:
+        self.used = max(0, self.used - size)
+
+memory_budget = MemoryBudget(INMEMORY_BUDGET * 1024 * 1024)
+
 
 class VideoDownloader:
     @staticmethod
     def get_platform(url: str) -> Optional[str]:
         """Determine the platform from URL."""
-        if "tiktok.com" in url:
-            return "tiktok"
-        elif "instagram.com" in url:
-            return "instagram"
-        return None
+        canonical = parse(url)
+        return canonical.platform if canonical else None
 
     @staticmethod
-    def is_valid_url(url: str) -> bool:
-        """Check if URL is valid for supported platforms."""
-        return bool(re.search(r'(tiktok\.com|instagram\.com)', url))
+    def may_have_items(url: str) -> bool:
+        """True for links that can hold several videos (Instagram posts and carousels)."""
+        canonical = parse(url)
+        return canonical is not None and canonical.url.startswith("https://www.instagram.com/p/")
 
     @staticmethod
-    def get_download_options(is_premium: bool, platform: str) -> dict:
-        """Get download options based on user status and platform."""
-        max_size = MAX_FILE_SIZE_PREMIUM if is_premium else MAX_FILE_SIZE_FREE
-        
-        base_opts = {
-            'quiet': True,
-            'noplaylist': True,
-            'no_warnings': True,
-            'ignoreerrors': True,
-            'extract_flat': True,
-            'no_color': True
-        }
-        
-        if platform == "instagram":
-            return {
-                **base_opts,
-                'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-                'cookies': 'cookies.txt',
-                'extractor_args': {
-                    'instagram': {
-                        'login': True,
-                        'username': os.getenv('INSTAGRAM_USERNAME', ''),
-                        'password': os.getenv('INSTAGRAM_PASSWORD', '')
-                    }
-                }
-            }
-        else:  # TikTok and others
-            if is_premium:
-                return {
-                    **base_opts,
-                    'format': 'best',
-                    'extractor_args': {
-                        'tiktok': {
-                            'api_hostname': 'api16-normal-c-useast1a.tiktokv.com',
-                            'app_version': '20.2.1',
-                            'device_id': '7168534261740988934',
-                            'channel': 'googleplay',
-                            'mcc_mnc': '310260',
-                            'os_version': '10',
-                            'version_code': '200201',
-                            'device_type': 'Pixel 4',
-                            'language': 'en',
-                            'resolution': '1080*1920',
-                            'openudid': 'a1b2c3d4e5f6g7h8',
-                            'sys_region': 'US',
-                            'os_api': '29',
-                            'timezone_name': 'America/New_York',
-                            'residence': 'US',
-                            'app_language': 'en',
-                            'ac2_wifi': '0',
-                            'dpi': '420',
-                            'carrier_region': 'US',
-                            'ac': 'wifi',
-                            'app_name': 'trill',
-                            'device_platform': 'android',
-                            'build_number': '10.2.1',
-                            'version_name': '10.2.1',
-                            'timezone_offset': '-14400',
-                            'channel': 'googleplay',
-                            'mcc_mnc': '310260',
-                            'is_my_cn': '0',
-                            'aid': '1340',
-                            'ssmix': 'a',
-                            'as': 'a1qwert123',
-                            'cp': 'androide1',
-                            'mas': '0123456789abcdef'
-                        }
-                    }
-                }
-            else:
-                return {
-                    **base_opts,
-                    'format': f'best[filesize<{max_size}M]',
-                    'extractor_args': {
-                        'tiktok': {
-                            'api_hostname': 'api16-normal-c-useast1a.tiktokv.com',
-                            'app_version': '20.2.1',
-                            'device_id': '7168534261740988934',
-                            'channel': 'googleplay',
-                            'mcc_mnc': '310260',
-                            'os_version': '10',
-                            'version_code': '200201',
-                            'device_type': 'Pixel 4',
-                            'language': 'en',
-                            'resolution': '1080*1920',
-                            'openudid': 'a1b2c3d4e5f6g7h8',
-                            'sys_region': 'US',
-                            'os_api': '29',
-                            'timezone_name': 'America/New_York',
-                            'residence': 'US',
-                            'app_language': 'en',
-                            'ac2_wifi': '0',
-                            'dpi': '420',
-                            'carrier_region': 'US',
-                            'ac': 'wifi',
-                            'app_name': 'trill',
-                            'device_platform': 'android',
-                            'build_number': '10.2.1',
-                            'version_name': '10.2.1',
-                            'timezone_offset': '-14400',
-                            'channel': 'googleplay',
-                            'mcc_mnc': '310260',
-                            'is_my_cn': '0',
-                            'aid': '1340',
-                            'ssmix': 'a',
-                            'as': 'a1qwert123',
-                            'cp': 'androide1',
-                            'mas': '0123456789abcdef'
-                        }
-                    }
-                }
+    def get_video_key(url: str, item: Optional[int] = None) -> str:
+        """Build a cache key identifying the video behind a URL, or one item of a carousel."""
+        canonical = parse(url)
+        key = canonical.key if canonical else f"unknown:{url.strip()}"
+        return key if item is None else f"{key}#{item}"
+
+    @staticmethod
+    async def download_video(url: str, user_id: str, is_premium: bool, item: Optional[int] = None,
+                             job: Optional[JobRecord] = None) -> Tuple[bool, Union[str, bytes], Optional[str]]:
+        """Download video from URL (or item `item` of a carousel) in the download worker pool.
+
+        Small videos come back as bytes when the memory budget allows it,
+        everything else as a file path. Pass the result to cleanup() when done.
+        Space for the largest file the job may write (the tier's cap, or
+        TRANSCODE_MAX_INPUT when oversized videos are transcoded) is reserved
+        in TEMP_DIR first; StorageFullError is raised if none frees up in
+        TEMP_RESERVE_WAIT.
+        Stage timings and bytes are added to `job` if given.
+        """
+        circuit = platform_circuits.get(VideoDownloader.get_platform(url))
+        if circuit is not None and not circuit.allow():
+            raise PlatformDownError(circuit.name, circuit.retry_after())
+        max_bytes = (MAX_FILE_SIZE_PREMIUM if is_premium else MAX_FILE_SIZE_FREE) * 1024 * 1024
+        if transcoder.enabled:
+            max_bytes = max(max_bytes, TRANSCODE_MAX_INPUT * 1024 * 1024)
+        output_file = await temp_storage.reserve(user_id, max_bytes, TEMP_RESERVE_WAIT)
+        if output_file is None:
+            raise StorageFullError(url)
+        # Queue workers may run on other machines and hand back files on the shared volume
+        memory_limit = 0 if DOWNLOAD_POOL == "queue" else INMEMORY_MAX_SIZE * 1024 * 1024
+        if not memory_budget.try_reserve(memory_limit):
+            memory_limit = 0
+        # If cancelled or timed out, the worker may still be writing: the file is left to the sweeper
+        try:
+            (success, result, platform), timings = await download_executor.submit(
+                user_id, is_premium, VideoDownloader.download_job, url, user_id, is_premium, memory_limit, item,
+                output_file
+            )
+        except (DownloadError, JobFailedError) as e:
+            temp_storage.release(output_file)
+            if circuit is not None:
+                if classify_error(str(e)) == "content":
+                    # The platform answered, only this video is unavailable
+                    circuit.record_success()
+                else:
+                    circuit.record_failure()
+            if isinstance(e, JobFailedError):
+                # Dead-lettered by the job queue: the last attempt's error, reported like any other
+                raise DownloadError(str(e)) from e
+            raise
+        finally:
+            memory_budget.release(memory_limit)
+        if circuit is not None:
+            circuit.record_success()
+
+        tier = "premium" if is_premium else "free"
+        for stage, seconds in timings.items():
+            metrics.stage_seconds.observe(seconds, stage, platform or "unknown", tier)
+            if job is not None:
+                job.add_stage(stage, seconds)
+        if success and isinstance(result, str):
+            size = os.path.getsize(result)
+            temp_storage.track(result, size)
+        else:
+            # In memory or failed: nothing (or only partial files) on disk
+            temp_storage.release(output_file)
+            size = len(result) if success else 0
+        if success:
+            metrics.download_bytes.inc(size, platform, tier)
+            if job is not None:
+                job.add_bytes(size)
+        if success and isinstance(result, str) and transcoder.enabled:
+            success, result, platform = await VideoDownloader.postprocess(
+                VideoDownloader.get_video_key(url, item), result, platform, is_premium, job
+            )
+        if success and isinstance(result, bytes):
+            # Keep holding what the video actually occupies until it is uploaded
+            memory_budget.used += len(result)
+        return success, result, platform
 
     @staticmethod
-    async def download_video(url: str, user_id: str, is_premium: bool) -> Tuple[bool, str, Optional[str]]:
-        """Download video from URL."""
+    async def postprocess(key: str, path: str, platform: str, is_premium: bool,
+                          job: Optional[JobRecord] = None) -> Tuple[bool, str, Optional[str]]:
+        """Run a downloaded file through the transcoder: fit it to the tier's cap and make it faststart."""
+        tier = "premium" if is_premium else "free"
+        max_bytes = (MAX_FILE_SIZE_PREMIUM if is_premium else MAX_FILE_SIZE_FREE) * 1024 * 1024
+        try:
+            started = time.perf_counter()
+            with metrics.timer("transcode", platform, tier):
+                processed, mode = await transcoder.process(key, path, max_bytes)
+            if job is not None:
+                job.add_stage("transcode", time.perf_counter() - started)
+            metrics.transcodes.inc(1, mode)
+            if processed != path:
+                # The transcoder replaced the download with a new file
+                temp_storage.forget(path)
+                temp_storage.track(processed, os.path.getsize(processed))
+                path = processed
+        except TranscodeError as e:
+            metrics.transcodes.inc(1, "failed")
+            logging.warning(f"Transcoding {key} failed: {e}")
+            if os.path.getsize(path) > max_bytes:
+                VideoDownloader.cleanup_file(path)
+                return False, f"Video is larger than {max_bytes // (1024 * 1024)} MB", None
+        return True, path, platform
+
+    @staticmethod
+    def download_job(url: str, user_id: str, is_premium: bool, memory_limit: int, item: Optional[int] = None,
+                     output_file: Optional[str] = None) -> Tuple[Tuple[bool, Union[str, bytes], Optional[str]], Dict[str, float]]:
+        """Worker entry point: download_video_sync() plus its stage timings.
+
+        Timings travel back with the result, so they are recorded on the event
+        loop whichever pool ran the job. Failures that may go away on another
+        attempt are raised, so the job queue retries them.
+        """
+        timings: Dict[str, float] = {}
+        result = VideoDownloader.download_video_sync(url, user_id, is_premium, memory_limit, timings, item, output_file)
+        if not result[0] and not result[1].startswith(PERMANENT_ERRORS):
+            raise DownloadError(result[1])
+        return result, timings
+
+    @staticmethod
+    def count_items(url: str, is_premium: bool) -> int:
+        """Worker entry point: number of videos behind a link (more than one for carousels).
+
+        Extraction errors count as one item; its download then reports the error.
+        """
+        platform = VideoDownloader.get_platform(url)
+        account = instagram_accounts.acquire() if platform == "instagram" else None
+        if platform == "instagram" and account is None:
+            return 1
+        try:
+            info = VideoDownloader.extract_info(url, platform, is_premium, account)
+        except Exception as e:
+            if account is not None:
+                instagram_accounts.report(account, str(e))
+            return 1
+        if account is not None:
+            instagram_accounts.report(account)
+        entries = info.get("entries") if info else None
+        if entries is None:
+            return 1
+        return max(1, sum(1 for entry in entries if entry))
+
+    @staticmethod
+    def estimate_size(fmt: Dict[str, Any], duration: Optional[float]) -> Optional[float]:
+        """Estimate format size in bytes from exact size, approximation or bitrate."""
+        size = fmt.get("filesize") or fmt.get("filesize_approx")
+        if not size and fmt.get("tbr") and duration:
+            size = fmt["tbr"] * 1000 / 8 * duration
+        return size
+
+    @staticmethod
+    def choose_format(info: Dict[str, Any], max_bytes: int) -> Optional[str]:
+        """Pick the best format (or video+audio pair) that fits in max_bytes.
+
+        Formats of unknown size are accepted; yt-dlp's max_filesize still stops
+        them during the download. Returns None if every format is too large.
+        """
+        formats = info.get("formats") or [info]
+        duration = info.get("duration")
+
+        def quality(fmt):
+            return (fmt.get("height") or 0, fmt.get("tbr") or 0)
+
+        candidates = []
+        for fmt in formats:
+            vcodec, acodec = fmt.get("vcodec"), fmt.get("acodec")
+            if vcodec != "none" and acodec != "none":
+                candidates.append((quality(fmt), fmt.get("format_id"), VideoDownloader.estimate_size(fmt, duration)))
+
+        # Separate video and audio streams (Instagram) need a merge
+        videos = [f for f in formats if f.get("vcodec") not in (None, "none") and f.get("acodec") == "none"]
+        audios = [f for f in formats if f.get("acodec") not in (None, "none") and f.get("vcodec") == "none"]
+        if videos and audios:
+            audio = max(audios, key=lambda f: (f.get("ext") == "m4a", f.get("abr") or f.get("tbr") or 0))
+            audio_size = VideoDownloader.estimate_size(audio, duration)
+            for video in videos:
+                video_size = VideoDownloader.estimate_size(video, duration)
+                size = video_size + audio_size if video_size and audio_size else None
+                candidates.append((quality(video), f"{video.get('format_id')}+{audio.get('format_id')}", size))
+
+        fitting = [c for c in candidates if c[1] and (c[2] is None or c[2] <= max_bytes)]
+        if not fitting:
+            if candidates:
+                return None
+            # No format list at all: let yt-dlp take what the extractor gave
+            return info.get("format_id") or "best"
+        # Prefer known sizes over unknown ones at equal quality
+        return max(fitting, key=lambda c: (c[0], c[2] is not None))[1]
+
+    @staticmethod
+    def extract_info(url: str, platform: str, is_premium: bool, account: Optional[Account] = None) -> Optional[Dict[str, Any]]:
+        """Extract video metadata without downloading, using the metadata cache."""
+        key = VideoDownloader.get_video_key(url)
+        info = metadata_cache.get(key)
+        if info is None:
+            # No format given: yt-dlp's default selector, the real choice is made locally
+            with ydl_pool.acquire(platform, "premium" if is_premium else "free", account=account) as ydl:
+                info = ydl.extract_info(url, download=False)
+                if info:
+                    info = ydl.sanitize_info(info)
+            if info:
+                metadata_cache.put(key, info)
+        return info
+
+    @staticmethod
+    def fetch_to_memory(ydl, info: Dict[str, Any], format_id: str, max_bytes: int) -> Optional[bytes]:
+        """Read a single-file HTTP format straight into memory.
+
+        Returns None when the format needs merging, isn't plain HTTP, has an
+        unknown size or turns out larger than max_bytes; the caller then falls
+        back to a regular download to disk.
+        """
+        formats = info.get("formats") or [info]
+        fmt = next((f for f in formats if f.get("format_id") == format_id), None)
+        if fmt is None or not fmt.get("url") or fmt.get("protocol", "https") not in ("http", "https"):
+            return None
+        size = VideoDownloader.estimate_size(fmt, info.get("duration"))
+        if not size or size > max_bytes:
+            return None
+
+        chunks, total = [], 0
+        with ydl.urlopen(Request(fmt["url"], headers=fmt.get("http_headers") or {})) as response:
+            while True:
+                chunk = response.read(1024 * 1024)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if total > max_bytes:
+                    return None
+                chunks.append(chunk)
+        return b"".join(chunks) or None
+
+    @staticmethod
+    def download_video_sync(url: str, user_id: str, is_premium: bool, memory_limit: int = 0,
+                            timings: Optional[Dict[str, float]] = None, item: Optional[int] = None,
+                            output_file: Optional[str] = None) -> Tuple[bool, Union[str, bytes], Optional[str]]:
+        """Download video from URL. Blocking, runs inside a worker.
+
+        Metadata is extracted once, the format is chosen locally against the
+        tier's size cap, and only the chosen format is downloaded: into memory
+        if it is a single file of at most memory_limit bytes, otherwise to disk.
+        For carousels, `item` selects the video (the first one by default).
+        Seconds spent extracting and downloading are stored in `timings`.
+        Disk downloads go to `output_file`, a path reserved in temp storage.
+        Instagram jobs run under an account from the account pool, which is
+        told how the job went.
+        """
+        if timings is None:
+            timings = {}
+        if output_file is None:
+            # Several jobs of one user can run at once, so the timestamp alone is not unique
+            output_file = f"{TEMP_DIR}/{user_id}_{int(time.time())}_{uuid.uuid4().hex[:8]}.mp4"
         platform = VideoDownloader.get_platform(url)
         if not platform:
             return False, "Unsupported platform", None
+        if platform != "instagram":
+            return VideoDownloader._download(url, platform, output_file, is_premium, memory_limit, timings, item)
 
-        output_file = f"{TEMP_DIR}/{user_id}_{int(time.time())}.mp4"
+        account = instagram_accounts.acquire()
+        if account is None:
+            return False, "No Instagram account available", None
+        result = VideoDownloader._download(url, platform, output_file, is_premium, memory_limit, timings, item,
+                                           account)
+        instagram_accounts.report(account, None if result[0] else result[1])
+        return result
+
+    @staticmethod
+    def _download(url: str, platform: str, output_file: str, is_premium: bool, memory_limit: int,
+                  timings: Dict[str, float], item: Optional[int] = None,
+                  account: Optional[Account] = None) -> Tuple[bool, Union[str, bytes], Optional[str]]:
+        max_bytes = (MAX_FILE_SIZE_PREMIUM if is_premium else MAX_FILE_SIZE_FREE) * 1024 * 1024
         
         try:
-            ydl_opts = VideoDownloader.get_download_options(is_premium, platform)
-            ydl_opts['outtmpl'] = output_file
+            started = time.perf_counter()
+            info = VideoDownloader.extract_info(url, platform, is_premium, account)
+            timings["extract"] = time.perf_counter() - started
+            if not info:
+                return False, "Extraction failed", None
+            if info.get("entries") is not None:
+                entries = [entry for entry in info["entries"] if entry]
+                if (item or 0) >= len(entries):
+                    return False, "Extraction failed - carousel item not found", None
+                info = entries[item or 0]
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
+            format_id = VideoDownloader.choose_format(info, max_bytes)
+            download_limit = max_bytes
+            if format_id is None and transcoder.enabled:
+                # Too large for the tier: download it anyway for the transcoder to shrink
+                download_limit = TRANSCODE_MAX_INPUT * 1024 * 1024
+                format_id = VideoDownloader.choose_format(info, download_limit)
+            if format_id is None:
+                return False, f"Video is larger than {max_bytes // (1024 * 1024)} MB", None
+            
+            tier = "premium" if is_premium else "free"
+            started = time.perf_counter()
+            with ydl_pool.acquire(platform, tier, format_id, output_file, download_limit, account) as ydl:
+                if memory_limit and "+" not in format_id:
+                    data = VideoDownloader.fetch_to_memory(ydl, info, format_id, min(memory_limit, max_bytes))
+                    if data:
+                        timings["download_memory"] = time.perf_counter() - started
+                        return True, data, platform
+                ydl.process_ie_result(info, download=True)
+            timings["download_disk"] = time.perf_counter() - started
             
             if os.path.exists(output_file) and os.path.getsize(output_file) > 0:
                 return True, output_file, platform
@@ -155,40 +427,17 @@ class VideoDownloader:
                 return False, "Download failed - empty file", None
                 
         except Exception as e:
-            error_msg = str(e)
-            
-            # Try alternative download method for Instagram if first fails
-            if platform == "instagram" and "Requested format is not available" in error_msg:
-                try:
-                    alternative_opts = {
-                        'format': 'best',
-                        'outtmpl': output_file,
-                        'quiet': True,
-                        'noplaylist': True,
-                        'cookies': 'cookies.txt',
-                        'extractor_args': {
-                            'instagram': {
-                                'login': True,
-                                'username': os.getenv('INSTAGRAM_USERNAME', ''),
-                                'password': os.getenv('INSTAGRAM_PASSWORD', '')
-                            }
-                        }
-                    }
-                    with yt_dlp.YoutubeDL(alternative_opts) as ydl:
-                        ydl.download([url])
-                    
-                    if os.path.exists(output_file) and os.path.getsize(output_file) > 0:
-                        return True, output_file, platform
-                except Exception as alt_e:
-                    return False, f"Alternative download failed: {alt_e}", None
-            
-            return False, f"Download error: {error_msg}", None
+            return False, f"Download error: {e}", None
+
+    @staticmethod
+    def cleanup(result: Union[str, bytes]) -> None:
+        """Release a download result: free its memory budget or delete its file."""
+        if isinstance(result, bytes):
+            memory_budget.release(len(result))
+        else:
+            VideoDownloader.cleanup_file(result)
 
     @staticmethod
     def cleanup_file(file_path: str) -> None:
         """Clean up downloaded file."""
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except Exception as e:
-                print(f"Error removing file {file_path}: {e}") 
+        temp_storage.release(file_path) 
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional
+
+from metrics import metrics
+from config import (DOWNLOAD_POOL, DOWNLOAD_WORKERS, MAX_CONCURRENT_DOWNLOADS, PREMIUM_SCHEDULING_WEIGHT,
+                    USER_MAX_CONCURRENT_DOWNLOADS, JOB_POLL_INTERVAL, JOB_RETENTION)
+from jobqueue import QueueExecutor, job_queue
+
+PREMIUM = 0
+FREE = 1
+
+
+class _Job:
+    __slots__ = ("user_id", "func", "args", "future", "tier", "enqueued_at")
+
+    def __init__(self, user_id: str, func: Callable, args: tuple, future: asyncio.Future, tier: str):
+        self.user_id = user_id
+        self.func = func
+        self.args = args
+        self.future = future
+        self.tier = tier
+        self.enqueued_at = time.monotonic()
+
+
+class DownloadExecutor:
+    """Runs blocking download jobs in a worker pool with per-user fair scheduling.
+
+    Jobs are queued per user and users are served round-robin, so one user
+    sending many links only ever holds one slot of the rotation. Premium users
+    form a separate class that gets `premium_weight` picks for every free pick.
+    A user never has more than `per_user` jobs running, so a batch of links
+    from one user leaves slots for everyone else.
+    """
+
+    def __init__(self, pool: str = "thread", workers: int = 4, max_concurrent: int = 4,
+                 premium_weight: int = 3, per_user: int = 2):
+        self.pool_type = pool
+        self.workers = workers
+        # Queue workers live in other processes, so the local pool size doesn't bound them
+        self.max_concurrent = max(1, max_concurrent if pool == "queue" else min(max_concurrent, workers))
+        self.premium_weight = max(1, premium_weight)
+        self.per_user = max(1, per_user)
+        self._user_active: Dict[str, int] = {}
+        self._pool: Optional[Executor] = None
+        self._queues: Dict[int, "OrderedDict[str, Deque[_Job]]"] = {PREMIUM: OrderedDict(), FREE: OrderedDict()}
+        self._premium_streak = 0
+        self._active = 0
+        self._completed = 0
+        self._failed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _get_pool(self) -> Executor:
+        if self._pool is None:
+            if self.pool_type == "process":
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            elif self.pool_type == "queue":
+                # Jobs run in worker.py processes; the limits here still apply per bot process
+                self._pool = QueueExecutor(job_queue, JOB_POLL_INTERVAL, JOB_RETENTION)
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="download")
+        return self._pool
+
+    async def submit(self, user_id: str, is_premium: bool, func: Callable, *args) -> Any:
+        """Queue `func(*args)` for `user_id` and wait for its result."""
+        future = asyncio.get_running_loop().create_future()
+        queues = self._queues[PREMIUM if is_premium else FREE]
+        if user_id not in queues:
+            queues[user_id] = deque()
+        queues[user_id].append(_Job(user_id, func, args, future, "premium" if is_premium else "free"))
+        self._dispatch()
+        return await future
+
+    def _pick(self, queues: "OrderedDict[str, Deque[_Job]]") -> Optional[_Job]:
+        """Next job of the first user in the rotation who is below the per-user limit."""
+        for user_id, jobs in queues.items():
+            if self._user_active.get(user_id, 0) < self.per_user:
+                break
+        else:
+            return None
+        del queues[user_id]
+        job = jobs.popleft()
+        if jobs:
+            # Re-append at the tail so the user's next job waits for everyone else
+            queues[user_id] = jobs
+        return job
+
+    def _next_job(self) -> Optional[_Job]:
+        """Pick the next job: weighted between classes, round-robin within a class."""
+        premium, free = self._queues[PREMIUM], self._queues[FREE]
+        first_premium = not free or self._premium_streak < self.premium_weight
+        for queues in ((premium, free) if first_premium else (free, premium)):
+            job = self._pick(queues)
+            if job is not None:
+                self._premium_streak = self._premium_streak + 1 if queues is premium else 0
+                return job
+        return None
+
+    def _dispatch(self) -> None:
+        while self._active < self.max_concurrent:
+            job = self._next_job()
+            if job is None:
+                return
+            if job.future.done():
+                # Waiter was cancelled while queued
+                continue
+            self._active += 1
+            self._user_active[job.user_id] = self._user_active.get(job.user_id, 0) + 1
+            asyncio.ensure_future(self._run(job))
+
+    async def _run(self, job: _Job) -> None:
+        wait = time.monotonic() - job.enqueued_at
+        self._wait_total += wait
+        self._wait_max = max(self._wait_max, wait)
+        metrics.queue_wait_seconds.observe(wait, job.tier)
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._get_pool(), job.func, *job.args)
+            self._completed += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        except Exception as e:
+            self._failed += 1
+            logging.error(f"Download job failed: {e}")
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self._active -= 1
+            if self._user_active[job.user_id] > 1:
+                self._user_active[job.user_id] -= 1
+            else:
+                del self._user_active[job.user_id]
+            self._dispatch()
+
+    def queue_depth(self) -> int:
+        """Number of jobs waiting for a worker slot."""
+        return sum(len(jobs) for queues in self._queues.values() for jobs in queues.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue and wait time statistics."""
+        started = self._completed + self._failed + self._active
+        return {
+            "queued": self.queue_depth(),
+            "queued_users": sum(len(queues) for queues in self._queues.values()),
+            "active": self._active,
+            "max_concurrent": self.max_concurrent,
+            "completed": self._completed,
+            "failed": self._failed,
+            "avg_wait": self._wait_total / started if started else 0.0,
+            "max_wait": self._wait_max
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the worker pool."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
+
+
+# Create global executor instance
+download_executor = DownloadExecutor(
+    pool=DOWNLOAD_POOL,
+    workers=DOWNLOAD_WORKERS,
+    max_concurrent=MAX_CONCURRENT_DOWNLOADS,
+    premium_weight=PREMIUM_SCHEDULING_WEIGHT,
+    per_user=USER_MAX_CONCURRENT_DOWNLOADS
+)
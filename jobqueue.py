@@ -0,0 +1,320 @@
+import importlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import Executor, Future, InvalidStateError, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from config import JOB_QUEUE_FILE, JOB_LEASE, JOB_MAX_ATTEMPTS, JOB_RETRY_BACKOFF, JOB_HEARTBEAT_INTERVAL
+
+# Functions workers agree to run, by "module:qualname"
+ALLOWED_JOBS = {"downloader:VideoDownloader.download_job", "downloader:VideoDownloader.count_items"}
+
+JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    func TEXT NOT NULL,
+    args TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_until REAL,
+    worker TEXT,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, available_at);
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    started REAL NOT NULL,
+    heartbeat REAL NOT NULL,
+    current_job INTEGER,
+    completed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class JobFailedError(Exception):
+    """Raised to the submitter when a job ended in the dead-letter state."""
+
+
+def job_name(func: Callable) -> str:
+    return f"{func.__module__}:{func.__qualname__}"
+
+
+def resolve_job(name: str) -> Callable:
+    """Look up an allowed job function by name."""
+    if name not in ALLOWED_JOBS:
+        raise JobFailedError(f"Job function {name} is not allowed")
+    module_name, qualname = name.split(":")
+    target: Any = importlib.import_module(module_name)
+    for attr in qualname.split("."):
+        target = getattr(target, attr)
+    return target
+
+
+class JobQueue:
+    """Durable job queue in a SQLite database shared by the bot and its workers.
+
+    Jobs move queued -> running -> done. A running job holds a lease that its
+    worker renews with every heartbeat; a job whose lease ran out (worker
+    crashed or hung) goes back to the queue. A job that raised is retried with
+    exponential backoff, and after max_attempts it is parked as 'dead' for
+    inspection instead of being retried forever.
+
+    Every process opens its own connections. Workers on other machines need
+    the database file (and TEMP_DIR, where downloads are written) on a shared
+    volume that supports SQLite locking.
+    """
+
+    def __init__(self, db_file: str, lease: float, max_attempts: int, retry_backoff: float):
+        self.db_file = db_file
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(JOBS_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, func: Callable, args: tuple) -> int:
+        now = time.time()
+        cursor = self._conn().execute(
+            "INSERT INTO jobs (func, args, available_at, created, updated) VALUES (?, ?, ?, ?, ?)",
+            (job_name(func), json.dumps(args), now, now, now)
+        )
+        return cursor.lastrowid
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """Take the oldest runnable job, or None if there is none."""
+        conn, now = self._conn(), time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, func, args, attempts FROM jobs WHERE status = 'queued' AND available_at <= ? "
+                "ORDER BY id LIMIT 1", (now,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, lease_until = ?, "
+                    "updated = ? WHERE id = ?", (worker_id, now + self.lease, now, row[0])
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return {"id": row[0], "func": row[1], "args": json.loads(row[2]), "attempts": row[3] + 1}
+
+    def complete(self, job_id: int, worker_id: str, result: Any) -> None:
+        self._conn().execute(
+            "UPDATE jobs SET status = 'done', result = ?, lease_until = NULL, updated = ? "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (json.dumps(result), time.time(), job_id, worker_id)
+        )
+
+    def fail(self, job_id: int, worker_id: str, attempts: int, error: str) -> None:
+        """Record a failed attempt: retry later, or dead-letter the job after max_attempts."""
+        now = time.time()
+        if attempts >= self.max_attempts:
+            self._conn().execute(
+                "UPDATE jobs SET status = 'dead', error = ?, lease_until = NULL, updated = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'", (error, now, job_id, worker_id)
+            )
+        else:
+            self._conn().execute(
+                "UPDATE jobs SET status = 'queued', error = ?, available_at = ?, lease_until = NULL, updated = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (error, now + self.retry_backoff * 2 ** (attempts - 1), now, job_id, worker_id)
+            )
+
+    def heartbeat(self, worker_id: str, job_id: Optional[int], completed: int, failed: int,
+                  started: float) -> None:
+        """Report a live worker and renew the lease of its current job."""
+        conn, now = self._conn(), time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO workers (worker_id, started, heartbeat, current_job, completed, failed) "
+            "VALUES (?, ?, ?, ?, ?, ?)", (worker_id, started, now, job_id, completed, failed)
+        )
+        if job_id is not None:
+            conn.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                         (now + self.lease, job_id, worker_id))
+
+    def remove_worker(self, worker_id: str) -> None:
+        self._conn().execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+
+    def recover(self, retention: float) -> int:
+        """Requeue or dead-letter jobs with an expired lease and purge old finished jobs.
+
+        Safe to run from several processes. Returns the number of recovered jobs.
+        """
+        conn, now = self._conn(), time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            dead = conn.execute(
+                "UPDATE jobs SET status = 'dead', error = 'lease expired', lease_until = NULL, updated = ? "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= ?", (now, now, self.max_attempts)
+            ).rowcount
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'queued', error = 'lease expired', lease_until = NULL, updated = ? "
+                "WHERE status = 'running' AND lease_until < ?", (now, now)
+            ).rowcount
+            conn.execute("DELETE FROM jobs WHERE status IN ('done', 'dead') AND updated < ?", (now - retention,))
+            conn.execute("DELETE FROM workers WHERE heartbeat < ?", (now - retention,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if dead or requeued:
+            logging.warning(f"Recovered jobs with expired leases: {requeued} requeued, {dead} dead-lettered")
+        return dead + requeued
+
+    def finished(self, job_ids: List[int]) -> List[tuple]:
+        """(id, status, result, error) of the given jobs that are done or dead."""
+        rows = []
+        # Stay below SQLite's bound parameter limit
+        for i in range(0, len(job_ids), 500):
+            chunk = job_ids[i:i + 500]
+            rows += self._conn().execute(
+                f"SELECT id, status, result, error FROM jobs WHERE status IN ('done', 'dead') "
+                f"AND id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+        return rows
+
+    def forget(self, job_ids: List[int]) -> None:
+        """Delete delivered results."""
+        self._conn().executemany("DELETE FROM jobs WHERE id = ? AND status = 'done'", [(i,) for i in job_ids])
+
+    def dead_letters(self, limit: int = 50) -> List[tuple]:
+        return self._conn().execute(
+            "SELECT id, func, args, attempts, error, updated FROM jobs WHERE status = 'dead' "
+            "ORDER BY updated DESC LIMIT ?", (limit,)
+        ).fetchall()
+
+    def retry_dead(self) -> int:
+        """Put every dead-lettered job back into the queue with fresh attempts."""
+        return self._conn().execute(
+            "UPDATE jobs SET status = 'queued', attempts = 0, available_at = ?, updated = ? WHERE status = 'dead'",
+            (time.time(), time.time())
+        ).rowcount
+
+    def get_stats(self, heartbeat_interval: float) -> Dict[str, Any]:
+        """Job counts by status and worker liveness."""
+        conn, now = self._conn(), time.time()
+        stats = {"queued": 0, "running": 0, "done": 0, "dead": 0}
+        stats.update(dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()))
+        alive, stale = conn.execute(
+            "SELECT COALESCE(SUM(heartbeat >= ?), 0), COALESCE(SUM(heartbeat < ?), 0) FROM workers",
+            (now - 3 * heartbeat_interval, now - 3 * heartbeat_interval)
+        ).fetchone()
+        stats.update({"workers_alive": alive, "workers_stale": stale})
+        return stats
+
+
+class QueueExecutor(Executor):
+    """concurrent.futures Executor that runs jobs on the worker processes.
+
+    Lets DownloadExecutor keep its per-user scheduling and concurrency limit
+    while the work itself happens in worker.py, possibly on other machines.
+    submit() only hands the job to a thread that inserts it, so callers on the
+    event loop never wait for SQLite. A poller thread collects finished jobs
+    and resolves their futures; it also recovers jobs whose worker died.
+    """
+
+    def __init__(self, queue: "JobQueue", poll_interval: float, retention: float):
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._futures: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._enqueuer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobqueue-enqueue")
+        self._thread = threading.Thread(target=self._poll, name="jobqueue-poller", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn: Callable, *args: Any, **kwargs: Any) -> Future:
+        if kwargs:
+            raise TypeError("QueueExecutor jobs take positional arguments only")
+        future: Future = Future()
+        self._enqueuer.submit(self._enqueue, future, fn, args)
+        return future
+
+    def _enqueue(self, future: Future, fn: Callable, args: tuple) -> None:
+        if future.cancelled():
+            return
+        try:
+            job_id = self.queue.enqueue(fn, args)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        with self._lock:
+            self._futures[job_id] = future
+
+    def _poll(self) -> None:
+        last_recovery = 0.0
+        while not self._stopped.wait(self.poll_interval):
+            try:
+                with self._lock:
+                    job_ids = list(self._futures)
+                if job_ids:
+                    delivered = []
+                    for job_id, status, result, error in self.queue.finished(job_ids):
+                        with self._lock:
+                            future = self._futures.pop(job_id)
+                        if status == "done":
+                            delivered.append(job_id)
+                        # The waiter may have given up (cancelled, timed out) meanwhile
+                        if future.done():
+                            continue
+                        try:
+                            if status == "done":
+                                future.set_result(json.loads(result))
+                            else:
+                                future.set_exception(JobFailedError(error or "job failed"))
+                        except InvalidStateError:
+                            # Cancelled between the check and here
+                            pass
+                    if delivered:
+                        self.queue.forget(delivered)
+                if time.monotonic() - last_recovery > JOB_HEARTBEAT_INTERVAL:
+                    self.queue.recover(self.retention)
+                    last_recovery = time.monotonic()
+            except Exception as e:
+                logging.error(f"Job queue poller error: {e}")
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        # Queued jobs stay in the database; workers still run them and the
+        # results expire after JOB_RETENTION
+        self._stopped.set()
+        self._enqueuer.shutdown(wait=wait)
+        if wait:
+            self._thread.join()
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+# Create global job queue instance
+job_queue = JobQueue(
+    db_file=JOB_QUEUE_FILE,
+    lease=JOB_LEASE,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    retry_backoff=JOB_RETRY_BACKOFF
+)
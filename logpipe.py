@@ -0,0 +1,225 @@
+import atexit
+import gzip
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import random
+import shutil
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from config import LOG_DIR, LOG_ROTATE, LOG_MAX_SIZE, LOG_BACKUP_COUNT, LOG_INFO_RATE, LOG_JOB_RATE, LOG_SLOW_JOB
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Outcomes of requests that went as expected; everything else is always logged
+SUCCESS_OUTCOMES = ("downloaded", "cached", "coalesced", "batch")
+
+_listeners: List[logging.handlers.QueueListener] = []
+_queue_handler: Optional[logging.handlers.QueueHandler] = None
+_child_queue: Optional["multiprocessing.Queue"] = None
+
+
+def _compress(source: str, dest: str) -> None:
+    """Rotator: gzip the rotated log file."""
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def rotating_handler(path: str) -> logging.Handler:
+    """File handler rotating by size or time (LOG_ROTATE) into gzipped backups."""
+    if LOG_ROTATE == "size":
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_SIZE * 1024 * 1024,
+                                                       backupCount=LOG_BACKUP_COUNT, encoding="utf-8", delay=True)
+    else:
+        handler = logging.handlers.TimedRotatingFileHandler(path, when=LOG_ROTATE, backupCount=LOG_BACKUP_COUNT,
+                                                            encoding="utf-8", delay=True)
+    handler.namer = lambda name: name + ".gz"
+    handler.rotator = _compress
+    return handler
+
+
+def _is_job(record: logging.LogRecord) -> bool:
+    return hasattr(record, "job")
+
+
+def _is_not_job(record: logging.LogRecord) -> bool:
+    return not hasattr(record, "job")
+
+
+class JobFormatter(logging.Formatter):
+    """One JSON object per line, from the fields of a job record."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps({"time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+                           **record.job}, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Passes at most `rate` INFO (and DEBUG) records per second from each line of code.
+
+    The rest are only counted, and the count is added to the next record
+    that passes. Warnings, errors and job records always pass.
+    """
+
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate = rate
+        # (file, line) -> [window start, passed, dropped]
+        self._sites: Dict[Any, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or _is_job(record):
+            return True
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        site = self._sites.get(key)
+        if site is None or now - site[0] >= 1:
+            self._sites[key] = [now, 1, 0]
+            if site is not None and site[2]:
+                record.msg = f"{record.msg} ({site[2]} similar messages dropped)"
+            return True
+        if site[1] < self.rate:
+            site[1] += 1
+            return True
+        site[2] += 1
+        return False
+
+
+def _after_fork() -> None:
+    # Forked download and worker processes have no writer thread; they log through the parent's
+    if _queue_handler is not None and _child_queue is not None:
+        _queue_handler.queue = _child_queue
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def setup_logging(name: str, fmt: str = LOG_FORMAT) -> None:
+    """Send log records through a queue to a background thread writing LOG_DIR/<name>.log and stderr.
+
+    A log call only formats the message and puts it on the queue; the writer
+    thread does the disk I/O and the rotation. Processes forked later (the
+    process download pool, queue workers) switch to a multiprocessing queue
+    read by a second writer thread with the same files. Job records go to
+    LOG_DIR/jobs.jsonl.
+    """
+    global _queue_handler, _child_queue
+    local_queue = queue.SimpleQueue()
+    _child_queue = multiprocessing.Queue(-1)
+    formatter = logging.Formatter(fmt)
+    handlers = [rotating_handler(os.path.join(LOG_DIR, f"{name}.log")), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        handler.addFilter(_is_not_job)
+    jobs = rotating_handler(os.path.join(LOG_DIR, "jobs.jsonl"))
+    jobs.setFormatter(JobFormatter())
+    jobs.addFilter(_is_job)
+    # Handlers lock around each record, so the two writers can share them
+    for records in (local_queue, _child_queue):
+        listener = logging.handlers.QueueListener(records, *handlers, jobs, respect_handler_level=True)
+        listener.start()
+        _listeners.append(listener)
+
+    _queue_handler = logging.handlers.QueueHandler(local_queue)
+    _queue_handler.addFilter(SamplingFilter(LOG_INFO_RATE))
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(logging.INFO)
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Write out the queued records and close the log files."""
+    if not _listeners:
+        return
+    for listener in _listeners:
+        listener.stop()
+    for handler in _listeners[0].handlers:
+        handler.close()
+    _listeners.clear()
+
+
+class JobRecord:
+    """What one request did: who asked, for which video, time per stage, bytes."""
+
+    __slots__ = ("fields", "stages")
+
+    def __init__(self, job_id: str, user_id: str, platform: Optional[str], video: Any):
+        self.fields: Dict[str, Any] = {"job": job_id, "user": user_id, "platform": platform, "video": video,
+                                       "bytes": 0}
+        self.stages: Dict[str, float] = {}
+
+    def add_stage(self, stage: str, seconds: float) -> None:
+        """Add time spent in a stage; parallel items of a batch add up."""
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(stage, time.perf_counter() - started)
+
+    def add_bytes(self, size: int) -> None:
+        self.fields["bytes"] += size
+
+
+class JobLog:
+    """Writes a structured record per finished request to the jobs log.
+
+    Failures and requests slower than `slow` seconds are always written.
+    Successful ones are too while there are at most `rate` of them a second;
+    beyond that they are sampled down to about `rate` a second, and each
+    record carries the sample rate it was kept with.
+    """
+
+    def __init__(self, rate: int, slow: float):
+        self.rate = rate
+        self.slow = slow
+        self.logger = logging.getLogger("jobs")
+        # A separate stream: not silenced when the root level is raised
+        self.logger.setLevel(logging.INFO)
+        self._window = 0
+        self._count = 0
+        self._keep = 1.0
+        self.counters = {"written": 0, "sampled_out": 0}
+
+    def _sample_rate(self) -> float:
+        window = int(time.monotonic())
+        if window != self._window:
+            # Rate of the last second decides the sampling for this one
+            last = self._count if window == self._window + 1 else 0
+            self._keep = min(1.0, self.rate / last) if last else 1.0
+            self._window, self._count = window, 0
+        self._count += 1
+        # A burst within this second is sampled right away
+        return min(self._keep, self.rate / self._count)
+
+    def finish(self, job: JobRecord, outcome: str, seconds: float) -> None:
+        keep = 1.0
+        if outcome in SUCCESS_OUTCOMES and seconds < self.slow:
+            keep = self._sample_rate()
+            if keep < 1.0 and random.random() >= keep:
+                self.counters["sampled_out"] += 1
+                return
+        self.counters["written"] += 1
+        self.logger.info("job", extra={"job": {
+            **job.fields,
+            "outcome": outcome,
+            "seconds": round(seconds, 3),
+            "stages": {stage: round(value, 3) for stage, value in job.stages.items()},
+            "sample_rate": round(keep, 4)
+        }})
+
+
+# Create global job log instance
+job_log = JobLog(rate=LOG_JOB_RATE, slow=LOG_SLOW_JOB)
@@ -0,0 +1,226 @@
+import asyncio
+import bisect
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+from config import METRICS_HOST, METRICS_PORT, LOOP_LAG_INTERVAL
+
+# Seconds; covers cached replies (milliseconds) up to slow Instagram downloads
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter per label combination."""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, *labels: str) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback when the metrics are scraped."""
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], float]):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge",
+                f"{self.name} {self.read()}"]
+
+
+class Histogram:
+    """Bucketed distribution per label combination.
+
+    observe() is a dict lookup, a bisect and two additions, so it is cheap
+    enough for the hot path. Buckets are stored per bucket and only made
+    cumulative when rendered.
+    """
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (+Inf last), sum]
+        self.series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def _merged(self, match: Optional[Callable[[Tuple[str, ...]], bool]]) -> List[int]:
+        counts = [0] * (len(self.buckets) + 1)
+        for labels, (bucket_counts, _) in self.series.items():
+            if match is None or match(labels):
+                counts = [a + b for a, b in zip(counts, bucket_counts)]
+        return counts
+
+    def count(self, match: Optional[Callable[[Tuple[str, ...]], bool]] = None) -> int:
+        return sum(self._merged(match))
+
+    def quantile(self, q: float, match: Optional[Callable[[Tuple[str, ...]], bool]] = None) -> float:
+        """Estimate a quantile over the series selected by `match`, like Prometheus' histogram_quantile."""
+        counts = self._merged(match)
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank, seen = q * total, 0
+        for i, count in enumerate(counts):
+            if seen + count >= rank and count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                bucket_labels = _format_labels(self.labels, labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class StageTimer:
+    """Context manager that observes the time spent in a stage."""
+    __slots__ = ("stage", "platform", "tier", "started")
+
+    def __init__(self, stage: str, platform: str, tier: str):
+        self.stage = stage
+        self.platform = platform
+        self.tier = tier
+
+    def __enter__(self) -> "StageTimer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        metrics.stage_seconds.observe(time.perf_counter() - self.started, self.stage, self.platform, self.tier)
+
+
+class Metrics:
+    """Registry of the bot's metrics and the HTTP endpoint that exposes them.
+
+    Metrics are only updated from the event loop (worker threads report their
+    timings back with the job result), so no locking is needed.
+    """
+
+    def __init__(self, host: str, port: int, lag_interval: float):
+        self.host = host
+        self.port = port
+        self.lag_interval = lag_interval
+        self.stage_seconds = Histogram(
+            "bot_stage_seconds", "Time spent per request stage.", ("stage", "platform", "tier"))
+        self.queue_wait_seconds = Histogram(
+            "bot_queue_wait_seconds", "Time download jobs waited for a worker.", ("tier",))
+        self.loop_lag_seconds = Histogram(
+            "bot_event_loop_lag_seconds", "Event loop scheduling delay.", buckets=LAG_BUCKETS)
+        self.download_bytes = Counter(
+            "bot_download_bytes_total", "Bytes of video downloaded.", ("platform", "tier"))
+        self.requests = Counter(
+            "bot_requests_total", "Video links handled, by outcome.", ("outcome",))
+        self.transcodes = Counter(
+            "bot_transcodes_total", "Downloaded videos post-processed, by result.", ("result",))
+        self.gauges: List[Gauge] = []
+        self.max_loop_lag = 0.0
+        self._runner: Optional[web.AppRunner] = None
+        self._lag_task: Optional[asyncio.Task] = None
+
+    def timer(self, stage: str, platform: str = "", tier: str = "") -> StageTimer:
+        return StageTimer(stage, platform or "unknown", tier)
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], float]) -> None:
+        self.gauges.append(Gauge(name, help_text, read))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in (self.stage_seconds, self.queue_wait_seconds, self.loop_lag_seconds,
+                       self.download_bytes, self.requests, self.transcodes, *self.gauges):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> Dict[str, Tuple[int, float, float]]:
+        """(count, p50, p95) per stage across platforms and tiers, plus queue wait and loop lag."""
+        stages = sorted({labels[0] for labels in self.stage_seconds.series})
+        result = {}
+        for stage in stages:
+            match = lambda labels, stage=stage: labels[0] == stage
+            result[stage] = (self.stage_seconds.count(match), self.stage_seconds.quantile(0.5, match),
+                             self.stage_seconds.quantile(0.95, match))
+        for name, histogram in (("queue_wait", self.queue_wait_seconds), ("loop_lag", self.loop_lag_seconds)):
+            result[name] = (histogram.count(), histogram.quantile(0.5), histogram.quantile(0.95))
+        return result
+
+    async def _monitor_loop_lag(self) -> None:
+        while True:
+            expected = time.perf_counter() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, time.perf_counter() - expected)
+            self.loop_lag_seconds.observe(lag)
+            self.max_loop_lag = max(self.max_loop_lag, lag)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def start(self) -> None:
+        """Start the event loop lag monitor and, if a port is configured, the /metrics endpoint."""
+        self._lag_task = asyncio.create_task(self._monitor_loop_lag())
+        if not self.port:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, self.host, self.port).start()
+            logging.info(f"Metrics endpoint on http://{self.host}:{self.port}/metrics")
+        except OSError as e:
+            logging.error(f"Error starting metrics endpoint: {e}")
+
+    async def stop(self) -> None:
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# Create global metrics instance
+metrics = Metrics(host=METRICS_HOST, port=METRICS_PORT, lag_interval=LOOP_LAG_INTERVAL)
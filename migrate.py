@@ -0,0 +1,48 @@
+"""One-shot migration of the JSON data files into the SQLite database.
+
+Usage: python migrate.py [--force]
+
+Reads data/user_data.json and data/stats.json (replaying data/journal.log on
+top, if present) and writes everything into SQLITE_FILE in one transaction.
+Set STORAGE_BACKEND=sqlite afterwards.
+"""
+import logging
+import os
+import sys
+
+from config import DATA_FILE, STATS_FILE, JOURNAL_FILE, SQLITE_FILE, JOURNAL_COMMIT_INTERVAL, DAILY_STATS_RETENTION
+from storage import JournalStorage, SQLiteStorage
+
+
+def migrate(force: bool = False) -> int:
+    if os.path.exists(SQLITE_FILE) and not force:
+        print(f"{SQLITE_FILE} already exists, use --force to overwrite it")
+        return 1
+
+    source = JournalStorage(DATA_FILE, STATS_FILE, JOURNAL_FILE, JOURNAL_COMMIT_INTERVAL, 0, 0)
+    state = source.load()
+
+    target = SQLiteStorage(SQLITE_FILE, JOURNAL_COMMIT_INTERVAL, DAILY_STATS_RETENTION)
+    target.import_state(state)
+
+    # Read everything back to make sure nothing was lost on the way
+    migrated = target.load()
+    target.close()
+    checks = {
+        "users": (len(state["user_data"]["users"]), len(migrated["user_data"]["users"])),
+        "banned": (len(set(state["user_data"]["banned"])), len(migrated["user_data"]["banned"])),
+        "premium": (len(set(state["user_data"].get("premium", []))), len(migrated["user_data"]["premium"])),
+        "user stats": (len(state["stats"]["users"]), len(migrated["stats"]["users"])),
+        "total downloads": (state["stats"]["total_downloads"], migrated["stats"]["total_downloads"])
+    }
+    failed = False
+    for name, (expected, actual) in checks.items():
+        status = "ok" if expected == actual else "MISMATCH"
+        failed = failed or expected != actual
+        print(f"{name}: {expected} -> {actual} {status}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(migrate(force="--force" in sys.argv))
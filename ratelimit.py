@@ -0,0 +1,232 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from config import RATE_LIMIT_TIERS, PLATFORM_RATE_LIMITS, RATE_LIMIT_FILE, RATE_LIMIT_IDLE_TTL
+
+DAY = 86400
+
+
+class TokenBucket:
+    """Classic token bucket: `capacity` tokens, refilled at `rate` tokens per second."""
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity: float, rate: float, tokens: Optional[float] = None, updated: Optional[float] = None):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity if tokens is None else tokens
+        self.updated = time.time() if updated is None else updated
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """Take one token. Returns 0 on success, otherwise seconds until one is available."""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def give_back(self) -> None:
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _UserState:
+    """Per-user limiter state: a sliding-window daily counter plus a burst bucket.
+
+    The daily window is approximated from the current and previous fixed
+    windows (weighted by overlap), which keeps the state O(1) per user.
+    """
+    __slots__ = ("window_start", "current", "previous", "bucket", "last_seen")
+
+    def __init__(self, window_start: float, bucket: TokenBucket):
+        self.window_start = window_start
+        self.current = 0
+        self.previous = 0
+        self.bucket = bucket
+        self.last_seen = window_start
+
+    def _roll(self, now: float) -> None:
+        elapsed_windows = int((now - self.window_start) // DAY)
+        if elapsed_windows >= 1:
+            self.previous = self.current if elapsed_windows == 1 else 0
+            self.current = 0
+            self.window_start += elapsed_windows * DAY
+
+    def used(self, now: float) -> float:
+        """Estimated downloads in the last 24 hours."""
+        self._roll(now)
+        overlap = 1 - (now - self.window_start) / DAY
+        return self.previous * overlap + self.current
+
+    def retry_after(self, now: float, limit: int) -> float:
+        """Seconds until the estimate drops below `limit`."""
+        if self.previous == 0:
+            return self.window_start + DAY - now
+        # previous * (1 - t / DAY) + current < limit  =>  solve for t
+        needed = (self.previous + self.current - limit) / self.previous * DAY
+        return max(1.0, self.window_start + needed - now)
+
+
+class RateLimiter:
+    """Per-user quotas by tier plus a global request budget per platform.
+
+    Each tier has an optional daily quota (sliding 24h window) and a token
+    bucket against bursts. Platform budgets throttle outbound fetches so we
+    back off before TikTok or Instagram start blocking our IP.
+    """
+
+    def __init__(self, tiers: Dict[str, Dict[str, Any]], platforms: Dict[str, Dict[str, float]],
+                 state_file: str, idle_ttl: int):
+        self.tiers = tiers
+        self.state_file = state_file
+        self.idle_ttl = idle_ttl
+        self._users: Dict[str, _UserState] = {}
+        self._platforms = {
+            name: TokenBucket(limits["burst"], limits["rate"]) for name, limits in platforms.items()
+        }
+        self.counters = {"allowed": 0, "daily_limited": 0, "burst_limited": 0, "platform_waits": 0}
+        self.load()
+
+    def _get_state(self, user_id: str, tier: Dict[str, Any], now: float) -> _UserState:
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserState(now, TokenBucket(tier["burst"], tier["rate"]))
+        else:
+            # Tier may have changed since the state was created (e.g. premium granted)
+            state.bucket.capacity, state.bucket.rate = tier["burst"], tier["rate"]
+        state.last_seen = now
+        return state
+
+    def acquire(self, user_id: str, tier_name: str) -> Tuple[bool, str, float]:
+        """Count one download for a user.
+
+        Returns (allowed, reason, retry_after) where reason is "daily" or "burst".
+        """
+        tier = self.tiers[tier_name]
+        if tier.get("unlimited"):
+            self.counters["allowed"] += 1
+            return True, "", 0.0
+
+        now = time.time()
+        state = self._get_state(user_id, tier, now)
+        daily_limit = tier.get("daily")
+        if daily_limit and state.used(now) >= daily_limit:
+            self.counters["daily_limited"] += 1
+            return False, "daily", state.retry_after(now, daily_limit)
+
+        wait = state.bucket.take(now)
+        if wait:
+            self.counters["burst_limited"] += 1
+            return False, "burst", wait
+
+        state.current += 1
+        self.counters["allowed"] += 1
+        return True, "", 0.0
+
+    def acquire_extra(self, user_id: str, tier_name: str, count: int) -> int:
+        """Count up to `count` more downloads of an accepted request (a batch) against the daily quota.
+
+        The burst bucket was charged once for the whole request. Returns how many fit.
+        """
+        tier = self.tiers[tier_name]
+        if tier.get("unlimited") or count <= 0:
+            return max(0, count)
+        now = time.time()
+        state = self._get_state(user_id, tier, now)
+        granted = count
+        if tier.get("daily"):
+            granted = max(0, min(count, int(tier["daily"] - state.used(now))))
+        state.current += granted
+        return granted
+
+    def refund_extra(self, user_id: str, count: int) -> None:
+        """Give back downloads counted by acquire_extra() that failed."""
+        state = self._users.get(user_id)
+        if state is not None:
+            state.current = max(0, state.current - count)
+
+    def refund(self, user_id: str) -> None:
+        """Give back a download that failed, so it doesn't count against the quota."""
+        state = self._users.get(user_id)
+        if state is not None:
+            if state.current > 0:
+                state.current -= 1
+            state.bucket.give_back()
+
+    async def wait_platform(self, platform: Optional[str], max_wait: float) -> bool:
+        """Wait for the platform request budget. Returns False if it would take longer than max_wait."""
+        bucket = self._platforms.get(platform)
+        if bucket is None:
+            return True
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = bucket.take(time.time())
+            if not wait:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            self.counters["platform_waits"] += 1
+            await asyncio.sleep(wait)
+
+    def evict_idle(self) -> int:
+        """Drop users whose state carries no information or who have been idle too long."""
+        now = time.time()
+        idle = [
+            user_id for user_id, state in self._users.items()
+            if now - state.last_seen > self.idle_ttl or (state.used(now) == 0 and state.bucket.is_full(now))
+        ]
+        for user_id in idle:
+            del self._users[user_id]
+        return len(idle)
+
+    def load(self) -> None:
+        """Load limiter state saved by a previous run."""
+        if not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Error loading rate limiter state: {e}")
+            return
+        for user_id, (window_start, current, previous, capacity, rate, tokens, updated,
+                      last_seen) in saved.get("users", {}).items():
+            state = _UserState(window_start, TokenBucket(capacity, rate, tokens, updated))
+            state.current, state.previous, state.last_seen = current, previous, last_seen
+            self._users[user_id] = state
+
+    def save(self) -> None:
+        """Save limiter state so quotas survive restarts."""
+        self.evict_idle()
+        users = {
+            user_id: [s.window_start, s.current, s.previous, s.bucket.capacity, s.bucket.rate,
+                      s.bucket.tokens, s.bucket.updated, s.last_seen]
+            for user_id, s in self._users.items()
+        }
+        tmp_path = f"{self.state_file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"users": users}, f)
+        os.replace(tmp_path, self.state_file)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get limiter counters."""
+        return {**self.counters, "tracked_users": len(self._users)}
+
+
+# Create global rate limiter instance
+rate_limiter = RateLimiter(
+    tiers=RATE_LIMIT_TIERS,
+    platforms=PLATFORM_RATE_LIMITS,
+    state_file=RATE_LIMIT_FILE,
+    idle_ttl=RATE_LIMIT_IDLE_TTL
+)
@@ -0,0 +1,217 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import STATS_ROLLUP_FILE, STATS_ROLLUPS, STATS_FLUSH_INTERVAL
+
+# Columns kept per platform and bucket
+FIELDS = ("success", "failed", "latency_sum", "latency_max")
+SUCCESS, FAILED, LATENCY_SUM, LATENCY_MAX = range(len(FIELDS))
+
+
+class RingSeries:
+    """Counters in `size` buckets of `resolution` seconds each; the oldest bucket is reused.
+
+    Bucket i holds time slot `slots[i]` (epoch // resolution); a bucket whose
+    slot is not the one being asked for is stale and reads as empty.
+    """
+
+    __slots__ = ("resolution", "size", "slots", "columns")
+
+    def __init__(self, resolution: int, size: int):
+        self.resolution = resolution
+        self.size = size
+        self.slots: List[int] = [-1] * size
+        # platform -> one list of `size` values per field
+        self.columns: Dict[str, List[List[float]]] = {}
+
+    def _platform(self, platform: str) -> List[List[float]]:
+        columns = self.columns.get(platform)
+        if columns is None:
+            columns = self.columns[platform] = [[0] * self.size for _ in FIELDS]
+        return columns
+
+    def record(self, now: float, platform: str, success: bool, latency: float, count: int) -> None:
+        slot = int(now // self.resolution)
+        index = slot % self.size
+        if self.slots[index] > slot:
+            # Older than what the bucket holds now, already out of the window
+            return
+        if self.slots[index] != slot:
+            self.slots[index] = slot
+            for columns in self.columns.values():
+                for column in columns:
+                    column[index] = 0
+        columns = self._platform(platform)
+        columns[SUCCESS if success else FAILED][index] += count
+        columns[LATENCY_SUM][index] += latency * count
+        if latency > columns[LATENCY_MAX][index]:
+            columns[LATENCY_MAX][index] = latency
+
+    def total(self, now: float, buckets: int) -> Dict[str, List[float]]:
+        """Per-platform sums over the last `buckets` buckets, the current one included."""
+        last = int(now // self.resolution)
+        indexes = [slot % self.size for slot in range(last - min(buckets, self.size) + 1, last + 1)
+                   if self.slots[slot % self.size] == slot]
+        totals = {}
+        for platform, columns in self.columns.items():
+            values = [sum(columns[field][i] for i in indexes) for field in (SUCCESS, FAILED, LATENCY_SUM)]
+            values.append(max((columns[LATENCY_MAX][i] for i in indexes), default=0))
+            if values[SUCCESS] or values[FAILED]:
+                totals[platform] = values
+        return totals
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"resolution": self.resolution, "size": self.size, "slots": list(self.slots),
+                "columns": {platform: [list(column) for column in columns]
+                            for platform, columns in self.columns.items()}}
+
+    def load(self, data: Dict[str, Any]) -> None:
+        """Take over saved buckets, unless the series was resized since."""
+        if data.get("resolution") != self.resolution or data.get("size") != self.size:
+            return
+        self.slots = data["slots"]
+        self.columns = data["columns"]
+
+
+class StatsRollups:
+    """Download counts and latency rolled up per minute, hour and day.
+
+    Each resolution is a RingSeries with a fixed number of buckets, so memory
+    stays the same however long the bot runs, and a question like "the last
+    7 days by platform" reads the buckets of the finest series that still
+    covers the window (168 hourly ones), never the history. Saved to `file`
+    every `flush_interval` seconds from a worker thread, and on shutdown.
+    """
+
+    def __init__(self, file: str, retention: Dict[str, Tuple[int, int]], flush_interval: float):
+        self.file = file
+        self.flush_interval = flush_interval
+        # Finest first: (resolution in seconds, number of buckets) per series
+        self.series = {name: RingSeries(resolution, size)
+                       for name, (resolution, size) in sorted(retention.items(), key=lambda item: item[1][0])}
+        self._dirty = False
+        self._loaded = False
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, platform: Optional[str], success: bool, latency: float, count: int = 1,
+               now: Optional[float] = None) -> None:
+        """Count `count` finished downloads that took `latency` seconds."""
+        now = time.time() if now is None else now
+        for series in self.series.values():
+            series.record(now, platform or "unknown", success, latency, count)
+        self._dirty = True
+
+    def summary(self, window: float, now: Optional[float] = None) -> Dict[str, Dict[str, float]]:
+        """Totals of the last `window` seconds per platform and for "all".
+
+        Each entry has success, failed, avg_latency and max_latency. Windows
+        longer than the coarsest series are cut to its retention.
+        """
+        now = time.time() if now is None else now
+        series = next((series for series in self.series.values() if series.resolution * series.size >= window),
+                      list(self.series.values())[-1])
+        buckets = max(1, int(-(-window // series.resolution)))
+        totals = series.total(now, buckets)
+        overall = [sum(values[field] for values in totals.values()) for field in (SUCCESS, FAILED, LATENCY_SUM)]
+        overall.append(max((values[LATENCY_MAX] for values in totals.values()), default=0))
+        result = {}
+        for platform, values in (*totals.items(), ("all", overall)):
+            count = values[SUCCESS] + values[FAILED]
+            result[platform] = {
+                "success": values[SUCCESS],
+                "failed": values[FAILED],
+                "avg_latency": values[LATENCY_SUM] / count if count else 0.0,
+                "max_latency": values[LATENCY_MAX]
+            }
+        return result
+
+    def fold_days(self, daily: Dict[str, Dict[str, int]]) -> int:
+        """Add daily stats ("%Y-%m-%d" -> success/failed counts) and save at once.
+
+        Latency was not kept for them and counts as 0; days older than the
+        coarsest series are skipped. Returns the number of days added.
+        """
+        if not self._loaded:
+            self.load()
+        horizon = time.time() - max(series.resolution * series.size for series in self.series.values())
+        folded = 0
+        for day, counts in daily.items():
+            # Noon, so the day lands in its own day bucket
+            moment = datetime.strptime(day, "%Y-%m-%d").replace(hour=12).timestamp()
+            if moment < horizon:
+                continue
+            for success in (True, False):
+                count = counts.get("success" if success else "failed", 0)
+                if count:
+                    self.record(None, success, 0.0, count, moment)
+            folded += 1
+        if folded:
+            self.save()
+        return folded
+
+    def load(self) -> None:
+        self._loaded = True
+        if not os.path.exists(self.file):
+            return
+        try:
+            with open(self.file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Error loading {self.file}: {e}")
+            return
+        for name, series in self.series.items():
+            if name in data:
+                series.load(data[name])
+
+    @staticmethod
+    def _write(file: str, data: Dict[str, Any]) -> None:
+        tmp_path = f"{file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, file)
+
+    def save(self) -> None:
+        """Save the buckets from the calling thread."""
+        self._dirty = False
+        self._write(self.file, {name: series.to_dict() for name, series in self.series.items()})
+
+    async def flush(self) -> None:
+        """Save the buckets if anything was recorded since the last save."""
+        if not self._dirty:
+            return
+        self._dirty = False
+        # Copied on the loop, written in a worker thread
+        data = {name: series.to_dict() for name, series in self.series.items()}
+        await asyncio.get_running_loop().run_in_executor(None, self._write, self.file, data)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Error saving stats rollups: {e}")
+
+    async def start(self) -> None:
+        if not self._loaded:
+            await asyncio.get_running_loop().run_in_executor(None, self.load)
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+# Create global stats rollups instance
+stats_rollups = StatsRollups(
+    file=STATS_ROLLUP_FILE,
+    retention=STATS_ROLLUPS,
+    flush_interval=STATS_FLUSH_INTERVAL
+)
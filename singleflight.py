@@ -0,0 +1,67 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one execution.
+
+    The first caller for a key starts the call; callers arriving while it is
+    still running wait for the same result. A failure or timeout is delivered
+    to every waiter and the key is released, so the next request starts fresh,
+    except failures that only concern the caller that started the call: a
+    waiter then runs the call itself.
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.timeout = timeout
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.counters = {"started": 0, "coalesced": 0, "failed": 0, "timeouts": 0, "rerun": 0}
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]],
+                 own_failure: Optional[Callable[[BaseException], bool]] = None) -> Tuple[Any, bool]:
+        """Run `func` once per key. Returns (result, shared) where shared is
+        True if this caller joined a call started by someone else.
+
+        If the joined call failed and `own_failure(error)` says the error is
+        specific to the caller that started it, `func` is run again for this
+        caller (coalesced with other waiters doing the same).
+        """
+        task = self._calls.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(self._run(key, func))
+            task.add_done_callback(_consume_exception)
+            self._calls[key] = task
+            self.counters["started"] += 1
+        else:
+            self.counters["coalesced"] += 1
+        try:
+            # Shield so a cancelled waiter doesn't cancel the call for the others
+            return await asyncio.shield(task), shared
+        except Exception as e:
+            if not shared or own_failure is None or not own_failure(e):
+                raise
+        self.counters["rerun"] += 1
+        return await self.do(key, func, own_failure)
+
+    async def _run(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            return await asyncio.wait_for(func(), self.timeout)
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            raise
+        except Exception:
+            self.counters["failed"] += 1
+            raise
+        finally:
+            self._calls.pop(key, None)
+
+    def in_flight(self) -> int:
+        """Number of calls currently running."""
+        return len(self._calls)
+
+
+def _consume_exception(task: asyncio.Task) -> None:
+    # Mark the exception as retrieved when every waiter went away
+    if not task.cancelled():
+        task.exception()
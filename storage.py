@@ -0,0 +1,575 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from config import (DATA_FILE, STATS_FILE, JOURNAL_FILE, JOURNAL_COMMIT_INTERVAL, JOURNAL_COMPACT_INTERVAL,
+                    JOURNAL_COMPACT_SIZE, SQLITE_FILE, DAILY_STATS_RETENTION)
+from users import USER_COLUMNS
+
+
+# User id lists in user_data; changes are {"op": kind, "id": ..., "value": bool}
+MEMBERSHIP_OPS = ("banned", "premium", "unreachable")
+
+
+def default_state() -> Dict[str, Any]:
+    """Empty database state."""
+    return {
+        "user_data": {"users": {}, "banned": [], "premium": [], "unreachable": []},
+        "stats": {
+            "total_downloads": 0,
+            "daily": {},
+            "users": {},
+            "platforms": {"tiktok": 0, "instagram": 0}
+        }
+    }
+
+
+def apply_change(state: Dict[str, Any], change: Dict[str, Any]) -> None:
+    """Apply a change to {"user_data": ..., "stats": ...}.
+
+    Changes hold absolute values, so applying one more than once is harmless.
+    The stats_user, stats_day and stats_totals changes only appear in backups.
+    """
+    op = change["op"]
+    user_data, stats = state["user_data"], state["stats"]
+    if op == "user":
+        user_data["users"][change["id"]] = change["data"]
+    elif op in MEMBERSHIP_OPS:
+        members = user_data.setdefault(op, [])
+        if change["value"] and change["id"] not in members:
+            members.append(change["id"])
+        elif not change["value"] and change["id"] in members:
+            members.remove(change["id"])
+    elif op == "stats":
+        stats["total_downloads"] = change["total_downloads"]
+        stats["platforms"] = change["platforms"]
+        stats["daily"][change["day"]] = change["daily"]
+        stats["users"][change["id"]] = change["user"]
+    elif op == "stats_user":
+        stats["users"][change["id"]] = change["user"]
+    elif op == "stats_day":
+        stats["daily"][change["day"]] = change["daily"]
+    elif op == "stats_totals":
+        stats["total_downloads"] = change["total_downloads"]
+        stats["platforms"] = change["platforms"]
+    elif op == "user_data":
+        state["user_data"] = change["data"]
+    elif op == "stats_data":
+        state["stats"] = change["data"]
+
+
+def state_changes(state: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Changes that rebuild `state` when applied to default_state(), one record each."""
+    user_data, stats = state["user_data"], state["stats"]
+    for user_id, data in user_data["users"].items():
+        yield {"op": "user", "id": user_id, "data": data}
+    for kind in MEMBERSHIP_OPS:
+        for user_id in user_data.get(kind, []):
+            yield {"op": kind, "id": user_id, "value": True}
+    for user_id, user_stats in stats["users"].items():
+        yield {"op": "stats_user", "id": user_id, "user": user_stats}
+    for day, daily in stats["daily"].items():
+        yield {"op": "stats_day", "day": day, "daily": daily}
+    yield {"op": "stats_totals", "total_downloads": stats["total_downloads"], "platforms": stats["platforms"]}
+
+
+class Storage:
+    """Base class for Database storage backends.
+
+    Changes are queued by the event loop and written by a background thread
+    once per commit interval. Every change carries absolute values, so only the
+    latest queued change per key has to be written, and the changes since the
+    last backup reduce to the latest one per key as well.
+    """
+
+    def __init__(self, commit_interval: float):
+        self.commit_interval = commit_interval
+        self._pending: "OrderedDict[Any, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Held while a batch is written or a backup is taken, so a backup sees whole commits
+        self._write_lock = threading.Lock()
+        # Changes committed since the last backup; None until a full backup was taken by this process
+        self._delta: "Optional[OrderedDict[Any, str]]" = None
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.counters = {"appended": 0, "written": 0, "commits": 0}
+
+    def load(self) -> Dict[str, Any]:
+        """Load the full state. Called once, before start()."""
+        raise NotImplementedError
+
+    def _write(self, lines: List[str]) -> None:
+        """Durably write a batch of serialized changes."""
+        raise NotImplementedError
+
+    def _maintain(self) -> None:
+        """Housekeeping run by the writer thread after each commit."""
+
+    def _snapshot(self) -> Iterator[Dict[str, Any]]:
+        """The committed state as changes (see state_changes()). Called with the write lock held."""
+        raise NotImplementedError
+
+    def start(self, state: Dict[str, Any]) -> None:
+        """Start the writer thread. `state` is the loaded one; the caller keeps only its stats."""
+        self._thread = threading.Thread(target=self._run, name=f"{type(self).__name__}-writer", daemon=True)
+        self._thread.start()
+
+    def append(self, key: Any, change: Dict[str, Any]) -> None:
+        """Queue a change. A newer change with the same key replaces the queued one."""
+        # Serialize now: the dicts in the change keep changing on the event loop
+        line = json.dumps(change, ensure_ascii=False)
+        with self._lock:
+            self._pending.pop(key, None)
+            self._pending[key] = line
+        self.counters["appended"] += 1
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.commit_interval)
+            self._wakeup.clear()
+            try:
+                self.commit()
+                self._maintain()
+            except Exception as e:
+                logging.error(f"{type(self).__name__} writer error: {e}")
+
+    def commit(self) -> None:
+        """Write queued changes as one batch."""
+        with self._write_lock:
+            self._commit()
+
+    def _commit(self) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            batch = self._pending
+            self._pending = OrderedDict()
+        lines = list(batch.values())
+        self._write(lines)
+        self.counters["written"] += len(lines)
+        self.counters["commits"] += 1
+        if self._delta is not None:
+            for key, line in batch.items():
+                if key in (("user_data",), ("stats_data",)):
+                    # Whole-state rewrites are only made at startup; the next backup is a full one
+                    self._delta = None
+                    return
+                self._delta.pop(key, None)
+                self._delta[key] = line
+
+    def export(self, full: bool, begin: Callable[[bool], None], write: Callable[[str], None]) -> bool:
+        """Pass a backup, one serialized change per call, to `write`. Blocking, run it in a thread.
+
+        A full backup is the whole committed state, an incremental one the
+        changes committed since the previous backup. Queued changes are
+        committed first; commits wait while the backup is written. A full
+        backup is taken even if `full` is False when no backup was taken since
+        this process started; `begin` is called with the kind before the first
+        change is written, and it is also returned.
+        """
+        with self._write_lock:
+            self._commit()
+            full = full or self._delta is None
+            begin(full)
+            if full:
+                for change in self._snapshot():
+                    write(json.dumps(change, ensure_ascii=False))
+            else:
+                for line in self._delta.values():
+                    write(line)
+            self._delta = OrderedDict()
+        return full
+
+    def close(self) -> None:
+        """Stop the writer and flush queued changes."""
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+        self.commit()
+
+
+class JournalStorage(Storage):
+    """JSON data files plus an append-only change journal.
+
+    Each commit appends the batch to the journal with a single fsync. The
+    writer keeps its own copy of the state, built by applying the same changes,
+    and periodically compacts it into the JSON files and truncates the journal.
+    On startup the journal is replayed over the JSON files.
+    """
+
+    def __init__(self, data_file: str, stats_file: str, journal_file: str, commit_interval: float,
+                 compact_interval: float, compact_size: int):
+        super().__init__(commit_interval)
+        self.data_file = data_file
+        self.stats_file = stats_file
+        self.journal_file = journal_file
+        self.compact_interval = compact_interval
+        self.compact_size = compact_size
+        self._shadow: Optional[Dict[str, Any]] = None
+        self._last_compaction = time.monotonic()
+        self._uncompacted = 0
+        self.counters["compactions"] = 0
+
+    @staticmethod
+    def _load_json(file_path: str, default: Dict) -> Dict:
+        """Load data from JSON file or return default if file doesn't exist."""
+        if os.path.exists(file_path):
+            with open(file_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return default
+
+    @staticmethod
+    def _write_json(file_path: str, data: Dict) -> None:
+        """Atomically replace a JSON file, keeping the previous version as .bak."""
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(file_path):
+            shutil.copy2(file_path, f"{file_path}.bak")
+        os.replace(tmp_path, file_path)
+
+    def replay(self) -> Iterator[Dict[str, Any]]:
+        """Yield changes written by a previous run, oldest first."""
+        if not os.path.exists(self.journal_file):
+            return
+        with open(self.journal_file, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Torn write from a crash: everything after it is lost anyway
+                    logging.warning(f"Journal {self.journal_file}: skipping corrupt line {line_no}")
+                    return
+
+    def load(self) -> Dict[str, Any]:
+        defaults = default_state()
+        state = {
+            "user_data": self._load_json(self.data_file, defaults["user_data"]),
+            "stats": self._load_json(self.stats_file, defaults["stats"])
+        }
+
+        # Crash recovery: replay changes that didn't make it into a snapshot
+        replayed = 0
+        for change in self.replay():
+            apply_change(state, change)
+            replayed += 1
+        if replayed:
+            logging.info(f"Recovered {replayed} changes from {self.journal_file}")
+        return state
+
+    def start(self, state: Dict[str, Any]) -> None:
+        # The Database keeps its own user records, only the stats dicts are still shared
+        self._shadow = {"user_data": state["user_data"], "stats": json.loads(json.dumps(state["stats"]))}
+        self._uncompacted = os.path.getsize(self.journal_file) if os.path.exists(self.journal_file) else 0
+        super().start(state)
+
+    def _write(self, lines: List[str]) -> None:
+        data = "\n".join(lines) + "\n"
+        with open(self.journal_file, "a", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        for line in lines:
+            apply_change(self._shadow, json.loads(line))
+        self._uncompacted += len(data)
+
+    def _snapshot(self) -> Iterator[Dict[str, Any]]:
+        return state_changes(self._shadow)
+
+    def import_state(self, state: Dict[str, Any]) -> None:
+        """Replace the data files with `state` and empty the journal. The bot must not be running."""
+        self._write_json(self.data_file, state["user_data"])
+        self._write_json(self.stats_file, state["stats"])
+        with open(self.journal_file, "w", encoding="utf-8") as f:
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _maintain(self) -> None:
+        if self._uncompacted and (self._uncompacted >= self.compact_size or
+                                  time.monotonic() - self._last_compaction >= self.compact_interval):
+            self.compact()
+
+    def compact(self) -> None:
+        """Write the state to the JSON files and truncate the journal."""
+        self._write_json(self.data_file, self._shadow["user_data"])
+        self._write_json(self.stats_file, self._shadow["stats"])
+        with open(self.journal_file, "w", encoding="utf-8") as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self._uncompacted = 0
+        self._last_compaction = time.monotonic()
+        self.counters["compactions"] += 1
+
+    def close(self) -> None:
+        if self._thread is None:
+            return
+        super().close()
+        self.compact()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    language TEXT,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    join_date INTEGER,
+    last_activity INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_users_last_activity ON users (last_activity);
+CREATE INDEX IF NOT EXISTS idx_users_username ON users (username COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_users_first_name ON users (first_name COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS banned (user_id TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS premium (user_id TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS unreachable (user_id TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id TEXT PRIMARY KEY,
+    downloads INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS user_platform_stats (
+    user_id TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    downloads INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, platform)
+);
+CREATE TABLE IF NOT EXISTS daily_stats (
+    day TEXT PRIMARY KEY,
+    success INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+SQL_UPSERT_USER = (
+    "INSERT OR REPLACE INTO users (user_id, language, username, first_name, last_name, join_date, last_activity) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+SQL_UPSERT_USER_STATS = "INSERT OR REPLACE INTO user_stats (user_id, downloads, failed) VALUES (?, ?, ?)"
+SQL_UPSERT_USER_PLATFORM = "INSERT OR REPLACE INTO user_platform_stats (user_id, platform, downloads) VALUES (?, ?, ?)"
+SQL_UPSERT_DAILY = "INSERT OR REPLACE INTO daily_stats (day, success, failed) VALUES (?, ?, ?)"
+SQL_UPSERT_COUNTER = "INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)"
+
+
+class SQLiteStorage(Storage):
+    """SQLite database in WAL mode.
+
+    The writer thread owns the only write connection and applies each batch in
+    one transaction with parameterized statements, which sqlite3 compiles once
+    and caches. Queries commit what is queued, then read on a separate
+    connection in a worker thread.
+    """
+
+    def __init__(self, db_file: str, commit_interval: float, daily_retention: int):
+        super().__init__(commit_interval)
+        self.db_file = db_file
+        self.daily_retention = daily_retention
+        self._conn: Optional[sqlite3.Connection] = None
+        self._read_conn: Optional[sqlite3.Connection] = None
+        self._read_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file, check_same_thread=False, cached_statements=64)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def open(self) -> sqlite3.Connection:
+        """Open the write connection and create the schema."""
+        if self._conn is None:
+            self._conn = self._connect()
+            self._conn.executescript(SQLITE_SCHEMA)
+        return self._conn
+
+    def load(self) -> Dict[str, Any]:
+        conn = self.open()
+        state = default_state()
+        user_data, stats = state["user_data"], state["stats"]
+
+        for row in conn.execute("SELECT user_id, " + ", ".join(USER_COLUMNS) + " FROM users"):
+            user_data["users"][row[0]] = dict(zip(USER_COLUMNS, row[1:]))
+        for kind in MEMBERSHIP_OPS:
+            user_data[kind] = [row[0] for row in conn.execute(f"SELECT user_id FROM {kind}")]
+
+        for user_id, downloads, failed in conn.execute("SELECT user_id, downloads, failed FROM user_stats"):
+            stats["users"][user_id] = {"downloads": downloads, "failed": failed, "platforms": {}}
+        for user_id, platform, downloads in conn.execute(
+                "SELECT user_id, platform, downloads FROM user_platform_stats"):
+            stats["users"].setdefault(user_id, {"downloads": 0, "failed": 0, "platforms": {}})
+            stats["users"][user_id]["platforms"][platform] = downloads
+
+        # Older days stay on disk but are not kept in memory
+        since = (datetime.now() - timedelta(days=self.daily_retention)).strftime("%Y-%m-%d")
+        for day, success, failed in conn.execute(
+                "SELECT day, success, failed FROM daily_stats WHERE day >= ?", (since,)):
+            stats["daily"][day] = {"success": success, "failed": failed}
+
+        for name, value in conn.execute("SELECT name, value FROM counters"):
+            if name == "total_downloads":
+                stats["total_downloads"] = value
+            elif name.startswith("platform:"):
+                stats["platforms"][name[len("platform:"):]] = value
+        return state
+
+    def _write(self, lines: List[str]) -> None:
+        conn = self.open()
+        with conn:
+            for line in lines:
+                self._apply(conn, json.loads(line))
+
+    def _snapshot(self) -> Iterator[Dict[str, Any]]:
+        # Only the writer changes the database and it waits for the write lock, so this reads one state
+        conn = self.open()
+        for row in conn.execute("SELECT user_id, " + ", ".join(USER_COLUMNS) + " FROM users"):
+            yield {"op": "user", "id": row[0], "data": dict(zip(USER_COLUMNS, row[1:]))}
+        for kind in MEMBERSHIP_OPS:
+            for (user_id,) in conn.execute(f"SELECT user_id FROM {kind}"):
+                yield {"op": kind, "id": user_id, "value": True}
+        platforms: Dict[str, Dict[str, int]] = {}
+        for user_id, platform, downloads in conn.execute(
+                "SELECT user_id, platform, downloads FROM user_platform_stats"):
+            platforms.setdefault(user_id, {})[platform] = downloads
+        for user_id, downloads, failed in conn.execute("SELECT user_id, downloads, failed FROM user_stats"):
+            yield {"op": "stats_user", "id": user_id,
+                   "user": {"downloads": downloads, "failed": failed, "platforms": platforms.get(user_id, {})}}
+        # Every day, including the ones older than the in-memory retention
+        for day, success, failed in conn.execute("SELECT day, success, failed FROM daily_stats"):
+            yield {"op": "stats_day", "day": day, "daily": {"success": success, "failed": failed}}
+        totals = {"total_downloads": 0, "platforms": default_state()["stats"]["platforms"]}
+        for name, value in conn.execute("SELECT name, value FROM counters"):
+            if name == "total_downloads":
+                totals["total_downloads"] = value
+            elif name.startswith("platform:"):
+                totals["platforms"][name[len("platform:"):]] = value
+        yield {"op": "stats_totals", **totals}
+
+    @staticmethod
+    def _upsert_user_stats(conn: sqlite3.Connection, user_id: str, user_stats: Dict[str, Any]) -> None:
+        conn.execute(SQL_UPSERT_USER_STATS, (user_id, user_stats["downloads"], user_stats["failed"]))
+        conn.executemany(SQL_UPSERT_USER_PLATFORM,
+                         [(user_id, platform, count) for platform, count in user_stats["platforms"].items()])
+
+    @staticmethod
+    def _upsert_totals(conn: sqlite3.Connection, total_downloads: int, platforms: Dict[str, int]) -> None:
+        conn.executemany(SQL_UPSERT_COUNTER, [("total_downloads", total_downloads)] +
+                         [(f"platform:{platform}", count) for platform, count in platforms.items()])
+
+    def _apply(self, conn: sqlite3.Connection, change: Dict[str, Any]) -> None:
+        op = change["op"]
+        if op == "user":
+            data = change["data"]
+            conn.execute(SQL_UPSERT_USER, (change["id"],) + tuple(data.get(col) for col in USER_COLUMNS))
+        elif op in MEMBERSHIP_OPS:
+            if change["value"]:
+                conn.execute(f"INSERT OR IGNORE INTO {op} (user_id) VALUES (?)", (change["id"],))
+            else:
+                conn.execute(f"DELETE FROM {op} WHERE user_id = ?", (change["id"],))
+        elif op == "stats":
+            self._upsert_user_stats(conn, change["id"], change["user"])
+            conn.execute(SQL_UPSERT_DAILY, (change["day"], change["daily"]["success"], change["daily"]["failed"]))
+            self._upsert_totals(conn, change["total_downloads"], change["platforms"])
+        elif op == "user_data":
+            self._replace_user_data(conn, change["data"])
+        elif op == "stats_data":
+            self._replace_stats(conn, change["data"])
+
+    def _replace_user_data(self, conn: sqlite3.Connection, user_data: Dict[str, Any]) -> None:
+        conn.execute("DELETE FROM users")
+        conn.executemany(SQL_UPSERT_USER, [
+            (user_id,) + tuple(data.get(col) for col in USER_COLUMNS)
+            for user_id, data in user_data["users"].items()
+        ])
+        for kind in MEMBERSHIP_OPS:
+            conn.execute(f"DELETE FROM {kind}")
+            conn.executemany(f"INSERT OR IGNORE INTO {kind} (user_id) VALUES (?)",
+                             [(user_id,) for user_id in user_data.get(kind, [])])
+
+    def _replace_stats(self, conn: sqlite3.Connection, stats: Dict[str, Any]) -> None:
+        conn.execute("DELETE FROM user_stats")
+        conn.execute("DELETE FROM user_platform_stats")
+        conn.execute("DELETE FROM counters")
+        for user_id, user_stats in stats["users"].items():
+            self._upsert_user_stats(conn, user_id, user_stats)
+        conn.executemany(SQL_UPSERT_DAILY, [
+            (day, counts.get("success", 0), counts.get("failed", 0)) for day, counts in stats["daily"].items()
+        ])
+        self._upsert_totals(conn, stats["total_downloads"], stats["platforms"])
+
+    def import_state(self, state: Dict[str, Any]) -> None:
+        """Replace the database contents with `state` in one transaction."""
+        conn = self.open()
+        with conn:
+            self._replace_user_data(conn, state["user_data"])
+            self._replace_stats(conn, state["stats"])
+
+    def _query(self, sql: str, params: tuple) -> List[tuple]:
+        # Changes of the last commit interval would be missing otherwise
+        self.commit()
+        with self._read_lock:
+            if self._read_conn is None:
+                self._read_conn = self._connect()
+            return self._read_conn.execute(sql, params).fetchall()
+
+    async def query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        """Run a read query off the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(None, self._query, sql, params)
+
+    async def recent_users(self, limit: int = 10, offset: int = 0) -> List[str]:
+        """Ids of users ordered by last activity, newest first (uses idx_users_last_activity)."""
+        rows = await self.query("SELECT user_id FROM users ORDER BY last_activity DESC LIMIT ? OFFSET ?",
+                                (limit, offset))
+        return [row[0] for row in rows]
+
+    async def find_users(self, prefix: str, limit: int = 10) -> List[str]:
+        """Ids of users whose username or first name starts with `prefix`, case-insensitive, by name.
+
+        Each half of the query uses its own index (idx_users_username, idx_users_first_name).
+        """
+        pattern = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        rows = await self.query(
+            "SELECT user_id FROM ("
+            "SELECT user_id, username AS name FROM users WHERE username LIKE ? ESCAPE '\\' "
+            "UNION ALL SELECT user_id, first_name FROM users WHERE first_name LIKE ? ESCAPE '\\'"
+            ") ORDER BY name COLLATE NOCASE LIMIT ?",
+            (pattern, pattern, limit * 2)
+        )
+        # A user matching by both names comes back twice
+        return list(dict.fromkeys(row[0] for row in rows))[:limit]
+
+    def close(self) -> None:
+        super().close()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        with self._read_lock:
+            if self._read_conn is not None:
+                self._read_conn.close()
+                self._read_conn = None
+
+
+def create_storage(backend: str) -> Storage:
+    """Create the storage backend selected in config."""
+    if backend == "sqlite":
+        return SQLiteStorage(SQLITE_FILE, JOURNAL_COMMIT_INTERVAL, DAILY_STATS_RETENTION)
+    return JournalStorage(DATA_FILE, STATS_FILE, JOURNAL_FILE, JOURNAL_COMMIT_INTERVAL,
+                          JOURNAL_COMPACT_INTERVAL, JOURNAL_COMPACT_SIZE)
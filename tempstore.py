@@ -0,0 +1,261 @@
+import asyncio
+import glob
+import logging
+import os
+import shutil
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from config import TEMP_DIR, TEMP_DIR_QUOTA, TEMP_MIN_FREE, TEMP_ORPHAN_AGE, TEMP_SWEEP_INTERVAL
+
+
+class _Entry:
+    __slots__ = ("reserved", "size", "created", "active", "owner")
+
+    def __init__(self, reserved: int, size: int, created: float, active: bool):
+        self.reserved = reserved
+        self.size = size
+        self.created = created
+        self.active = active
+        # Task that reserved or produced the file; it releases it when done
+        self.owner: Optional[asyncio.Task] = _current_task() if active else None
+
+    @property
+    def usage(self) -> int:
+        return max(self.reserved, self.size) if self.active else self.size
+
+
+def _current_task() -> Optional[asyncio.Task]:
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        return None
+
+
+def _missing(paths: List[str]) -> List[str]:
+    return [path for path in paths if not os.path.exists(path)]
+
+
+def _remove(paths: List[str]) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Error removing {path}: {e}")
+
+
+def _remove_with_parts(path: str) -> None:
+    """Remove a download and the .part, .ytdl and per-format files yt-dlp writes next to it."""
+    _remove(glob.glob(glob.escape(os.path.splitext(path)[0]) + "*"))
+
+
+class TempStorage:
+    """Hands out the temp file paths for downloads and keeps TEMP_DIR within a quota.
+
+    Each path comes with space reserved for the largest file its job may
+    write. A reservation is refused while the quota or the free disk space
+    (minus `min_free`) can't cover it; leftover files are evicted oldest
+    first to make room, and the caller may wait for running jobs to release
+    theirs. Released paths are deleted together with the partial files
+    yt-dlp leaves next to them. Files found at startup and files whose
+    owning task ended without releasing them (cancelled, timed out) are
+    leftovers, removed once `orphan_age` old; files deleted behind our back
+    stop being counted. Files of running tasks are never swept.
+    Disk access runs in the default executor, never on the event loop.
+    """
+
+    def __init__(self, directory: str, quota: int, min_free: int, orphan_age: float, sweep_interval: float):
+        self.directory = directory
+        self.quota = quota
+        self.min_free = min_free
+        self.orphan_age = orphan_age
+        self.sweep_interval = sweep_interval
+        # path -> entry, oldest first
+        self._files: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._usage = 0
+        # Created on first use, inside the running event loop
+        self._released: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.counters = {"reserved": 0, "waits": 0, "refused": 0, "evicted": 0, "evicted_bytes": 0}
+
+    def _add(self, path: str, entry: _Entry) -> None:
+        self._files[path] = entry
+        self._usage += entry.usage
+
+    def _drop(self, path: str) -> Optional[_Entry]:
+        entry = self._files.pop(path, None)
+        if entry is not None:
+            self._usage -= entry.usage
+        return entry
+
+    def _scan(self) -> List[Any]:
+        """Remove old leftovers and return (path, size, mtime) of the rest, in one scandir pass."""
+        os.makedirs(self.directory, exist_ok=True)
+        cutoff = time.time() - self.orphan_age
+        found, removed = [], 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+                if st.st_mtime < cutoff:
+                    _remove([entry.path])
+                    removed += st.st_size
+                else:
+                    found.append((entry.path, st.st_size, st.st_mtime))
+        if removed:
+            logging.info(f"Removed {removed / 1024 / 1024:.1f} MB of leftover files from {self.directory}")
+        return sorted(found, key=lambda item: item[2])
+
+    async def start(self) -> None:
+        """Clean up after the last run and start the sweeper."""
+        loop = asyncio.get_running_loop()
+        # Recent files may still belong to queue workers; they count as leftovers until they age out
+        for path, size, mtime in await loop.run_in_executor(None, self._scan):
+            self._add(path, _Entry(0, size, mtime, active=False))
+        self._task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _disk_free(self) -> int:
+        try:
+            return shutil.disk_usage(self.directory).free
+        except OSError:
+            return self.min_free + self.quota
+
+    def _fits(self, nbytes: int, disk_free: int) -> bool:
+        # Space already reserved but not yet written is still free on the disk
+        unwritten = sum(entry.reserved - entry.size for entry in self._files.values()
+                        if entry.active and entry.reserved > entry.size)
+        return self._usage + nbytes <= self.quota and disk_free - unwritten - nbytes >= self.min_free
+
+    def _event(self) -> asyncio.Event:
+        if self._released is None:
+            self._released = asyncio.Event()
+        return self._released
+
+    async def _evict(self, nbytes: int, disk_free: int) -> None:
+        """Delete leftover files, oldest first, until `nbytes` more would fit."""
+        victims = []
+        for path, entry in list(self._files.items()):
+            if self._fits(nbytes, disk_free):
+                break
+            if not entry.active:
+                self._drop(path)
+                victims.append(path)
+                disk_free += entry.size
+                self.counters["evicted"] += 1
+                self.counters["evicted_bytes"] += entry.size
+        if victims:
+            await asyncio.get_running_loop().run_in_executor(None, _remove, victims)
+
+    async def reserve(self, prefix: str, nbytes: int, timeout: float) -> Optional[str]:
+        """A new temp file path with `nbytes` reserved for it, or None if no space freed up within `timeout`.
+
+        Release the path with release() once the file is not needed, or with
+        forget() when it was moved elsewhere.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        waited = False
+        while True:
+            disk_free = await loop.run_in_executor(None, self._disk_free)
+            if not self._fits(nbytes, disk_free):
+                await self._evict(nbytes, disk_free)
+                disk_free = await loop.run_in_executor(None, self._disk_free)
+            if self._fits(nbytes, disk_free):
+                break
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                self.counters["refused"] += 1
+                logging.warning(f"Temp storage full: {self._usage / 1024 / 1024:.0f} MB used, "
+                                f"{disk_free / 1024 / 1024:.0f} MB free on disk, "
+                                f"{nbytes / 1024 / 1024:.0f} MB requested")
+                return None
+            if not waited:
+                waited = True
+                self.counters["waits"] += 1
+            self._event().clear()
+            try:
+                await asyncio.wait_for(self._event().wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+
+        # Several jobs of one user can run at once, so the timestamp alone is not unique
+        path = os.path.join(self.directory, f"{prefix}_{int(time.time())}_{uuid.uuid4().hex[:8]}.mp4")
+        self._add(path, _Entry(nbytes, 0, time.time(), active=True))
+        self.counters["reserved"] += 1
+        return path
+
+    def track(self, path: str, size: int) -> None:
+        """Account for a file written to a reserved path, or for a new file produced from one."""
+        entry = self._drop(path) or _Entry(0, 0, time.time(), active=True)
+        entry.size = size
+        self._add(path, entry)
+
+    def forget(self, path: str) -> None:
+        """Stop tracking a file that was moved out of TEMP_DIR or deleted by its user."""
+        if self._drop(path) is not None:
+            self._event().set()
+
+    def release(self, path: str) -> None:
+        """Delete a file (and its partial download files) and free its space."""
+        self._drop(path)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop: shutdown or a script
+            _remove_with_parts(path)
+            return
+        self._event().set()
+        loop.run_in_executor(None, _remove_with_parts, path)
+
+    async def sweep(self) -> None:
+        """Release leftovers past `orphan_age` and forget files that are gone."""
+        cutoff = time.time() - self.orphan_age
+        expired, written = [], []
+        for path, entry in self._files.items():
+            if entry.created >= cutoff:
+                continue
+            if entry.owner is None or entry.owner.done():
+                expired.append(path)
+            elif entry.size:
+                # Still owned: only dropped if the file was removed by someone else
+                written.append(path)
+        for path in expired:
+            logging.warning(f"Removing abandoned temp file {path}")
+            self.release(path)
+        if written:
+            for path in await asyncio.get_running_loop().run_in_executor(None, _missing, written):
+                self.forget(path)
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            await self.sweep()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "files": len(self._files),
+            "active": sum(1 for entry in self._files.values() if entry.active),
+            "used_bytes": self._usage,
+            "quota_bytes": self.quota
+        }
+
+
+# Create global temp storage instance
+temp_storage = TempStorage(
+    directory=TEMP_DIR,
+    quota=TEMP_DIR_QUOTA * 1024 * 1024,
+    min_free=TEMP_MIN_FREE * 1024 * 1024,
+    orphan_age=TEMP_ORPHAN_AGE,
+    sweep_interval=TEMP_SWEEP_INTERVAL
+)
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from circuit import classify_error
+
+
+@pytest.mark.parametrize("message, kind", [
+    # As VideoDownloader._download wraps the yt-dlp exception
+    ("Download error: ERROR: [Instagram] Cprivate1: HTTP Error 500: Internal Server Error", "network"),
+    ("Download error: ERROR: [Instagram] CxSSLab12: Unable to download webpage: HTTP Error 404: Not Found",
+     "content"),
+    ("Download error: ERROR: [Instagram] C4295xYz: Requested content is not available", "content"),
+    ("Download error: ERROR: [Instagram] C4295xYz: Requested content is not available, rate-limit reached "
+     "or login required", "rate_limit"),
+    ("Download error: ERROR: [TikTok] 7301401234567890123: Video not available", "content"),
+    ("Download error: ERROR: [TikTok] 7301401234567890123: Unable to download webpage: HTTP Error 429: "
+     "Too Many Requests", "rate_limit"),
+    ("Download error: ERROR: [TikTok] 7350099999999999999: Unable to download webpage: HTTP Error 401", "auth"),
+    ("Download error: ERROR: [TikTok] 7301500123456789012: Something odd", "other"),
+    ("Download error: <urlopen error [Errno -3] Temporary failure in name resolution>", "network"),
+    ("ERROR: [TikTok] 7301401234567890123: Video not available", "content"),
+    ("checkpoint_required", "auth"),
+])
+def test_classify_error(message, kind):
+    assert classify_error(message) == kind
@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import struct
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from config import (TEMP_DIR, TRANSCODE_ENABLED, TRANSCODE_WORKERS, TRANSCODE_THREADS, TRANSCODE_NICE,
+                    TRANSCODE_TIMEOUT, TRANSCODE_CACHE_DIR, TRANSCODE_CACHE_MAX_SIZE, TRANSCODE_AUDIO_BITRATE,
+                    TRANSCODE_MIN_VIDEO_BITRATE)
+
+# Share of the size cap given to audio and video; the rest is container overhead and rate control slack
+SIZE_CAP_USAGE = 0.92
+
+
+class TranscodeError(Exception):
+    """Raised when a video could not be brought under its size cap."""
+
+
+def _limit_worker(nice: int) -> None:
+    """Process pool initializer: lower the priority of the worker and of the ffmpeg it starts."""
+    try:
+        os.nice(nice)
+    except OSError:
+        pass
+
+
+def is_faststart(path: str) -> bool:
+    """True if the MP4 index (moov) comes before the media data, so playback can start while streaming."""
+    with open(path, "rb") as f:
+        for _ in range(64):
+            header = f.read(8)
+            if len(header) < 8:
+                return False
+            size, box = struct.unpack(">I4s", header)
+            if box == b"moov":
+                return True
+            if box == b"mdat":
+                return False
+            if size == 1:
+                size = struct.unpack(">Q", f.read(8))[0] - 8
+            elif size == 0:
+                return False
+            f.seek(size - 8, os.SEEK_CUR)
+    return False
+
+
+def probe(path: str, timeout: float) -> Dict[str, Any]:
+    """Duration and stream codecs of a media file, from ffprobe."""
+    output = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration:stream=codec_type,codec_name",
+         "-of", "json", path],
+        capture_output=True, check=True, timeout=timeout
+    ).stdout
+    data = json.loads(output)
+    codecs = {stream.get("codec_type"): stream.get("codec_name") for stream in data.get("streams", [])}
+    return {"duration": float(data.get("format", {}).get("duration") or 0), "codecs": codecs}
+
+
+def transcode_file(src: str, dst: str, max_bytes: int, threads: int, timeout: float,
+                   audio_kbps: int, min_video_kbps: int) -> str:
+    """Make `src` fit in max_bytes and start playing before it is fully loaded. Runs in the process pool.
+
+    Writes `dst` and returns "remux" (streams copied into a faststart MP4) or
+    "encode" (H.264 at a bitrate computed from the duration and the cap), or
+    returns "skipped" without writing anything when `src` is fine as it is.
+    """
+    info = probe(src, timeout)
+    size = os.path.getsize(src)
+    compatible = info["codecs"].get("video") == "h264" and info["codecs"].get("audio") in (None, "aac")
+    if size <= max_bytes and compatible:
+        if is_faststart(src):
+            return "skipped"
+        command = ["-c", "copy"]
+        mode = "remux"
+    else:
+        duration = info["duration"]
+        if duration <= 0:
+            raise TranscodeError("Unknown duration")
+        total_kbps = max_bytes * 8 * SIZE_CAP_USAGE / duration / 1000
+        # Never encode above the source bitrate, it only makes the file bigger
+        total_kbps = min(total_kbps, size * 8 / duration / 1000)
+        video_kbps = int(total_kbps - (audio_kbps if "audio" in info["codecs"] else 0))
+        if video_kbps < min_video_kbps:
+            raise TranscodeError(f"{duration:.0f}s of video does not fit in {max_bytes // (1024 * 1024)} MB")
+        command = [
+            "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+            "-b:v", f"{video_kbps}k", "-maxrate", f"{video_kbps}k", "-bufsize", f"{video_kbps * 2}k",
+            "-vf", "scale='trunc(min(1280,iw)/2)*2':-2",
+            "-c:a", "aac", "-b:a", f"{audio_kbps}k"
+        ]
+        mode = "encode"
+
+    try:
+        subprocess.run(
+            ["ffmpeg", "-y", "-v", "error", "-nostdin", "-threads", str(threads), "-i", src, *command,
+             "-movflags", "+faststart", "-f", "mp4", dst],
+            capture_output=True, check=True, timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        raise TranscodeError(f"ffmpeg timed out after {timeout}s")
+    except subprocess.CalledProcessError as e:
+        raise TranscodeError(f"ffmpeg failed: {e.stderr.decode(errors='replace')[-300:]}")
+    if os.path.getsize(dst) > max_bytes:
+        raise TranscodeError(f"Output is still larger than {max_bytes // (1024 * 1024)} MB")
+    return mode
+
+
+class Transcoder:
+    """Optional post-processing of downloaded videos in a process pool.
+
+    Videos over the tier's size cap are re-encoded to fit it, and compatible
+    videos with the index at the end are remuxed so Telegram can stream them.
+    Each worker runs at a lower priority with a bounded ffmpeg thread count,
+    and every job has a timeout. Results are kept in a disk cache keyed by
+    video and size cap, so the same video is only processed once. File
+    operations run in the default thread pool, off the event loop.
+    """
+
+    def __init__(self, enabled: bool, workers: int, threads: int, nice: int, timeout: float,
+                 cache_dir: str, cache_max_size: int, audio_kbps: int, min_video_kbps: int):
+        self.enabled = enabled and bool(shutil.which("ffmpeg")) and bool(shutil.which("ffprobe"))
+        if enabled and not self.enabled:
+            logging.warning("TRANSCODE_ENABLED is set but ffmpeg/ffprobe are not installed, transcoding is off")
+        self.workers = workers
+        self.threads = threads
+        self.nice = nice
+        self.timeout = timeout
+        self.cache_dir = cache_dir
+        self.cache_max_size = cache_max_size
+        self.audio_kbps = audio_kbps
+        self.min_video_kbps = min_video_kbps
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._cache_size: Optional[int] = None
+        self._cache_lock = threading.Lock()
+        self.counters = {"skipped": 0, "remux": 0, "encode": 0, "cached": 0, "failed": 0, "saved_bytes": 0}
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_limit_worker,
+                                             initargs=(self.nice,))
+        return self._pool
+
+    def _cache_path(self, key: str, max_bytes: int) -> str:
+        digest = hashlib.sha1(f"{key}:{max_bytes}".encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.mp4")
+
+    def _temp_path(self) -> str:
+        return f"{TEMP_DIR}/transcode_{int(time.time())}_{uuid.uuid4().hex[:8]}.mp4"
+
+    @staticmethod
+    def _link(src: str, dst: str) -> None:
+        try:
+            os.link(src, dst)
+        except OSError:
+            # Different filesystems
+            shutil.copyfile(src, dst)
+
+    @staticmethod
+    def _discard(path: str) -> None:
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _take_cached(self, cache_path: str, src: str) -> Optional[str]:
+        """Copy of the cached result in place of `src`, or None if it is not cached."""
+        if not os.path.exists(cache_path):
+            return None
+        dst = self._temp_path()
+        self._link(cache_path, dst)
+        os.utime(cache_path)
+        os.remove(src)
+        return dst
+
+    def _replace(self, src: str, dst: str, cache_path: str) -> int:
+        """Cache the result `dst` and delete `src`. Returns the bytes saved."""
+        saved = max(0, os.path.getsize(src) - os.path.getsize(dst))
+        with self._cache_lock:
+            self._cache_put(dst, cache_path)
+        os.remove(src)
+        return saved
+
+    def _cache_put(self, path: str, cache_path: str) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if self._cache_size is None:
+            self._cache_size = sum(entry.stat().st_size for entry in os.scandir(self.cache_dir))
+        try:
+            self._link(path, cache_path)
+        except OSError as e:
+            logging.warning(f"Could not cache transcoded video: {e}")
+            return
+        self._cache_size += os.path.getsize(cache_path)
+        if self._cache_size > self.cache_max_size:
+            # Least recently used first; hits refresh the modification time
+            entries = sorted(os.scandir(self.cache_dir), key=lambda entry: entry.stat().st_mtime)
+            for entry in entries:
+                if self._cache_size <= self.cache_max_size or entry.path == cache_path:
+                    break
+                self._cache_size -= entry.stat().st_size
+                os.remove(entry.path)
+
+    async def process(self, key: str, src: str, max_bytes: int) -> Tuple[str, str]:
+        """Post-process a downloaded file. Returns (path, mode); `src` is deleted if replaced.
+
+        Raises TranscodeError if the video could not be processed; `src` is then left as it is.
+        """
+        cache_path = self._cache_path(key, max_bytes)
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(None, self._take_cached, cache_path, src)
+        if cached is not None:
+            self.counters["cached"] += 1
+            return cached, "cached"
+
+        dst = self._temp_path()
+        try:
+            mode = await asyncio.wait_for(
+                loop.run_in_executor(self._get_pool(), transcode_file, src, dst, max_bytes, self.threads,
+                                     self.timeout, self.audio_kbps, self.min_video_kbps),
+                # ffmpeg is killed at the timeout, this only covers a stuck probe or pool
+                timeout=self.timeout * 2 + 10
+            )
+        except Exception as e:
+            self.counters["failed"] += 1
+            await loop.run_in_executor(None, self._discard, dst)
+            if isinstance(e, TranscodeError):
+                raise
+            raise TranscodeError(f"{type(e).__name__}: {e}")
+
+        self.counters[mode] += 1
+        if mode == "skipped":
+            return src, mode
+        self.counters["saved_bytes"] += await loop.run_in_executor(None, self._replace, src, dst, cache_path)
+        return dst, mode
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.counters, "enabled": self.enabled, "cache_size": self._cache_size or 0}
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# Create global transcoder instance
+transcoder = Transcoder(
+    enabled=TRANSCODE_ENABLED,
+    workers=TRANSCODE_WORKERS,
+    threads=TRANSCODE_THREADS,
+    nice=TRANSCODE_NICE,
+    timeout=TRANSCODE_TIMEOUT,
+    cache_dir=TRANSCODE_CACHE_DIR,
+    cache_max_size=TRANSCODE_CACHE_MAX_SIZE * 1024 * 1024,
+    audio_kbps=TRANSCODE_AUDIO_BITRATE,
+    min_video_kbps=TRANSCODE_MIN_VIDEO_BITRATE
+)
@@ -29,9 +29,14 @@ TRANSLATIONS = {
         "help": "🔹 Ուղարկեք տեսանյութի հղումը TikTok կամ Instagram-ից։\n🔹 Սպասեք մի քանի վայրկյան\n🔹 Ստացեք տեսանյութը առանց ջրանշան",
         "change_language": "Կրկին ընտրեք լեզուն:",
         "unsupported_link": "⚠️ Չաջակցվող հղում: Խնդրում ենք օգտագործել միայն TikTok կամ Instagram-ի հղումներ:",
+        "link_unresolved": "⚠️ Չհաջողվեց բացել կարճ հղումը: Ուղարկեք տեսանյութի ամբողջական հղումը:",
         "premium_info": "⭐️ Premium հաշիվը տալիս է հետևյալ առավելությունները.\n✅ Ավելի արագ ներբեռնում\n✅ Բարձր որակ\n✅ Գովազդ չկա\n✅ Առաջնահերթ աջակցություն\n\nԳինը: $5/ամիս",
         "contact_admin": "💬 Կապվեք ադմինի հետ",
-        "rate_limit": "⚠️ Դուք հասել եք օրական սահմանին: Սպասեք 24 ժամ կամ բարելավեք Premium-ի համար"
+        "rate_limit": "⚠️ Դուք հասել եք օրական սահմանին: Սպասեք 24 ժամ կամ բարելավեք Premium-ի համար",
+        "slow_down": "⏳ Չափազանց շատ հարցումներ: Փորձեք կրկին {seconds} վայրկյանից:",
+        "service_busy": "⏳ Ծառայությունը ծանրաբեռնված է: Փորձեք մի փոքր ուշ:",
+        "batch_failed": "⚠️ Չհաջողվեց ներբեռնել {total}-ից հետևյալ տեսանյութերը: {items}",
+        "platform_down": "⚠️ {platform}-ը այժմ հասանելի չէ: Փորձեք կրկին մոտ {minutes} րոպեից:"
     },
     "en": {
         "choose_language": "Choose language:",
@@ -43,9 +48,14 @@ TRANSLATIONS = {
         "help": "🔹 Send a TikTok or Instagram video link\n🔹 Wait a few seconds\n🔹 Get your video without watermarks",
         "change_language": "Choose your language again:",
         "unsupported_link": "⚠️ Unsupported link. Please use only TikTok or Instagram links.",
+        "link_unresolved": "⚠️ Couldn't resolve the short link. Please send the full video link.",
         "premium_info": "⭐️ Premium account gives you these benefits:\n✅ Faster downloads\n✅ Higher quality\n✅ No ads\n✅ Priority support\n\nPrice: $5/month",
         "contact_admin": "💬 Contact Admin",
-        "rate_limit": "⚠️ You've reached your daily limit. Wait 24 hours or upgrade to Premium"
+        "rate_limit": "⚠️ You've reached your daily limit. Wait 24 hours or upgrade to Premium",
+        "slow_down": "⏳ Too many requests. Try again in {seconds} seconds.",
+        "service_busy": "⏳ The service is busy right now. Please try again a bit later.",
+        "batch_failed": "⚠️ Could not download these videos of {total}: {items}",
+        "platform_down": "⚠️ {platform} is not available right now. Please try again in about {minutes} min."
     },
     "ru": {
         "choose_language": "Выберите язык:",
@@ -57,9 +67,14 @@ TRANSLATIONS = {
         "help": "🔹 Отправьте ссылку на видео из TikTok или Instagram\n🔹 Подождите несколько секунд\n🔹 Получите видео без водяных знаков",
         "change_language": "Выберите язык снова:",
         "unsupported_link": "⚠️ Неподдерживаемая ссылка. Пожалуйста, используйте только ссылки TikTok или Instagram.",
+        "link_unresolved": "⚠️ Не удалось открыть короткую ссылку. Отправьте полную ссылку на видео.",
         "premium_info": "⭐️ Премиум аккаунт даёт следующие преимущества:\n✅ Быстрая загрузка\n✅ Высокое качество\n✅ Без рекламы\n✅ Приоритетная поддержка\n\nЦена: $5/месяц",
         "contact_admin": "💬 Связаться с администратором",
-        "rate_limit": "⚠️ Вы достигли дневного лимита. Подождите 24 часа или обновитесь до Premium"
+        "rate_limit": "⚠️ Вы достигли дневного лимита. Подождите 24 часа или обновитесь до Premium",
+        "slow_down": "⏳ Слишком много запросов. Попробуйте снова через {seconds} сек.",
+        "service_busy": "⏳ Сервис сейчас перегружен. Попробуйте чуть позже.",
+        "batch_failed": "⚠️ Не удалось скачать видео {items} из {total}",
+        "platform_down": "⚠️ {platform} сейчас недоступен. Попробуйте снова примерно через {minutes} мин."
     }
 }
 
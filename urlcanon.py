@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Pattern, Tuple
+
+import aiohttp
+from yarl import URL
+
+from config import URL_PARSE_CACHE_SIZE, URL_CACHE_SIZE, URL_CACHE_TTL, URL_RESOLVE_TIMEOUT
+from singleflight import SingleFlight
+
+# One entry per platform. hosts: regex of the domains; short: regex of the
+# paths (matched on the full host + path) that only redirect to a video;
+# videos: (path regex with an `id` group, canonical URL template).
+# Adding a platform is adding an entry here.
+PLATFORMS: Dict[str, Dict] = {
+    "tiktok": {
+        "hosts": r"tiktok\.com",
+        "short": r"^(?:vm|vt)\.tiktok\.com/|^(?:www\.|m\.)?tiktok\.com/t/",
+        "videos": (
+            (r"^/@(?P<user>[\w.-]*)/(?P<kind>video|photo)/(?P<id>\d+)", "https://www.tiktok.com/@{user}/{kind}/{id}"),
+            (r"^/(?:embed(?:/v2)?|v|video)/(?P<id>\d+)", "https://www.tiktok.com/@/video/{id}"),
+            (r"^/share/video/(?P<id>\d+)", "https://www.tiktok.com/@/video/{id}"),
+        ),
+    },
+    "instagram": {
+        "hosts": r"instagram\.com|instagr\.am",
+        "short": r"^(?:www\.|m\.)?instagram\.com/share/",
+        "videos": (
+            (r"^(?:/[\w.]+)?/(?:p|tv)/(?P<id>[\w-]+)", "https://www.instagram.com/p/{id}/"),
+            (r"^(?:/[\w.]+)?/reels?/(?P<id>[\w-]+)", "https://www.instagram.com/reel/{id}/"),
+        ),
+    },
+}
+
+
+def _compile_url_pattern() -> Pattern:
+    hosts = "|".join(f"(?P<{name}>{platform['hosts']})" for name, platform in PLATFORMS.items())
+    return re.compile(
+        # Not preceded by a host character, so "nottiktok.com" doesn't count
+        r"(?<![\w.-])(?:https?://)?(?P<host>(?:[\w-]+\.)*(?:" + hosts + r"))"
+        # ...and not followed by one, so "tiktok.com.example.org" doesn't either
+        r"(?![\w-]|\.\w)(?P<path>/[^\s<>\"']*)?",
+        re.IGNORECASE
+    )
+
+
+URL_PATTERN = _compile_url_pattern()
+PLATFORM_NAMES = tuple(PLATFORMS)
+SHORT_PATTERNS = {name: re.compile(platform["short"], re.IGNORECASE) for name, platform in PLATFORMS.items()}
+VIDEO_PATTERNS: Dict[str, Tuple[Tuple[Pattern, str], ...]] = {
+    name: tuple((re.compile(regex), template) for regex, template in platform["videos"])
+    for name, platform in PLATFORMS.items()
+}
+TRAILING_PUNCTUATION = ".,;:!?)»"
+
+
+class CanonicalUrl(NamedTuple):
+    """A supported link reduced to what identifies its video."""
+    platform: str
+    video_id: Optional[str]
+    url: str
+    short: bool = False
+
+    @property
+    def key(self) -> str:
+        """Stable cache key: platform and video ID, or the cleaned URL when the ID is unknown."""
+        return f"{self.platform}:{self.video_id}" if self.video_id else f"{self.platform}:{self.url}"
+
+
+def _from_match(match: "re.Match") -> CanonicalUrl:
+    platform = next(name for name in PLATFORM_NAMES if match.group(name))
+    host, path = match.group("host", "path")
+    host = host.lower()
+    # Tracking parameters and fragments never change the video
+    path = (path or "/").partition("?")[0].partition("#")[0].rstrip(TRAILING_PUNCTUATION) or "/"
+    if SHORT_PATTERNS[platform].search(host + path):
+        return CanonicalUrl(platform, None, f"https://{host}{path}", short=True)
+    for regex, template in VIDEO_PATTERNS[platform]:
+        video = regex.search(path)
+        if video:
+            return CanonicalUrl(platform, video.group("id"), template.format(**video.groupdict()))
+    # Unknown layout: keep it, minus the noise
+    return CanonicalUrl(platform, None, f"https://{host}{path.rstrip('/')}")
+
+
+@lru_cache(maxsize=URL_PARSE_CACHE_SIZE)
+def parse(url: str) -> Optional[CanonicalUrl]:
+    """Canonical form of a single link, or None if it is not a supported one. No network access.
+
+    Memoized: the same links come in over and over and the results are immutable.
+    """
+    match = URL_PATTERN.match(url.strip())
+    return _from_match(match) if match else None
+
+
+def find_urls(text: str) -> List[CanonicalUrl]:
+    """Every supported link in a text, in order."""
+    return [_from_match(match) for match in URL_PATTERN.finditer(text or "")]
+
+
+class UrlResolver:
+    """Turns short links into canonical video URLs, remembering the answers.
+
+    Short links (vm.tiktok.com/..., instagram.com/share/...) only redirect to
+    the real post, so the redirect chain is followed once without fetching
+    the page, and the result is kept in an LRU for `ttl` seconds. Concurrent
+    requests for the same short link share one lookup. A link that can't be
+    resolved is returned as it is; yt-dlp may still handle it.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, timeout: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.timeout = timeout
+        self._entries: "OrderedDict[str, Tuple[float, CanonicalUrl]]" = OrderedDict()
+        self._flights = SingleFlight(timeout=timeout * 2)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.counters = {"hits": 0, "resolved": 0, "failed": 0}
+
+    def _get(self, url: str) -> Optional[CanonicalUrl]:
+        entry = self._entries.get(url)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(url, None)
+            return None
+        self._entries.move_to_end(url)
+        return entry[1]
+
+    def _put(self, url: str, canonical: CanonicalUrl) -> None:
+        self._entries[url] = (time.monotonic() + self.ttl, canonical)
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _follow(self, url: str) -> Optional[CanonicalUrl]:
+        """Follow redirects by hand and stop at the first URL that names a video."""
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"User-Agent": "Mozilla/5.0 (Linux; Android 10) AppleWebKit/537.36 Mobile Safari/537.36"}
+            )
+        for _ in range(5):
+            async with self._session.get(url, allow_redirects=False) as response:
+                location = response.headers.get("Location")
+            if response.status not in (301, 302, 303, 307, 308) or not location:
+                return None
+            url = str(response.url.join(URL(location)))
+            canonical = parse(url)
+            if canonical is not None and not canonical.short:
+                return canonical
+        return None
+
+    async def resolve(self, canonical: CanonicalUrl) -> Optional[CanonicalUrl]:
+        """Resolve a short link; any other link is returned unchanged, a short link that fails yields None."""
+        if not canonical.short:
+            return canonical
+        cached = self._get(canonical.url)
+        if cached is not None:
+            self.counters["hits"] += 1
+            return cached
+        try:
+            resolved, _ = await self._flights.do(canonical.url, lambda: self._follow(canonical.url))
+        except Exception as e:
+            # Network errors, timeouts, but also malformed redirects (InvalidURL, ValueError)
+            logging.warning(f"Could not resolve {canonical.url}: {e!r}")
+            resolved = None
+        if resolved is None:
+            self.counters["failed"] += 1
+            return None
+        self.counters["resolved"] += 1
+        self._put(canonical.url, resolved)
+        return resolved
+
+    async def canonicalize(self, urls: List[CanonicalUrl]) -> Tuple[List[CanonicalUrl], List[CanonicalUrl]]:
+        """Resolve a message's links concurrently and drop the ones naming the same video.
+
+        Returns the links to download and the short links that could not be resolved.
+        """
+        resolved = await asyncio.gather(*[self.resolve(canonical) for canonical in urls])
+        unique: Dict[str, CanonicalUrl] = {}
+        unresolved = []
+        for original, canonical in zip(urls, resolved):
+            if canonical is None:
+                unresolved.append(original)
+            else:
+                unique.setdefault(canonical.key, canonical)
+        return list(unique.values()), unresolved
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**self.counters, "entries": len(self._entries)}
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+# Create global URL resolver instance
+url_resolver = UrlResolver(
+    max_entries=URL_CACHE_SIZE,
+    ttl=URL_CACHE_TTL,
+    timeout=URL_RESOLVE_TIMEOUT
+)
@@ -0,0 +1,62 @@
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Fields of a stored user, in the order of the SQLite columns
+USER_COLUMNS = ("language", "username", "first_name", "last_name", "join_date", "last_activity")
+
+
+def to_epoch(value: Any) -> int:
+    """Convert a stored timestamp (epoch or legacy formatted string) to epoch seconds."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        if value.isdigit():
+            return int(value)
+        try:
+            return int(time.mktime(time.strptime(value, TIME_FORMAT)))
+        except ValueError:
+            pass
+    return 0
+
+
+def format_time(timestamp: int) -> str:
+    """Format epoch seconds for display."""
+    return datetime.fromtimestamp(timestamp).strftime(TIME_FORMAT) if timestamp else "-"
+
+
+class User:
+    """One user record.
+
+    Slots instead of a per-user dict: with hundreds of thousands of users the
+    dicts were most of the process memory. Stored as a dict of USER_COLUMNS.
+    """
+    __slots__ = USER_COLUMNS
+
+    def __init__(self, language: Optional[str] = None, username: Optional[str] = None,
+                 first_name: Optional[str] = None, last_name: Optional[str] = None,
+                 join_date: int = 0, last_activity: int = 0):
+        # A handful of distinct codes shared by every user
+        self.language = sys.intern(language) if language else None
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+        self.join_date = join_date
+        self.last_activity = last_activity
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "User":
+        return cls(data.get("language"), data.get("username"), data.get("first_name"), data.get("last_name"),
+                   to_epoch(data.get("join_date")), to_epoch(data.get("last_activity")))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {column: getattr(self, column) for column in USER_COLUMNS}
+
+
+def load_users(users: Dict[str, Dict[str, Any]]) -> Tuple[Dict[str, User], int]:
+    """Stored user dicts to User records. Returns the users and the number of legacy timestamps converted."""
+    converted = sum(1 for data in users.values() for field in ("join_date", "last_activity")
+                    if not isinstance(data.get(field), int))
+    return {uid: User.from_dict(data) for uid, data in users.items()}, converted
@@ -0,0 +1,141 @@
+"""Download workers for DOWNLOAD_POOL=queue.
+
+Usage: python worker.py [--processes N]    run N worker processes (default JOB_WORKERS)
+       python worker.py --dead-letters     list jobs that failed every attempt
+       python worker.py --retry-dead       put dead-lettered jobs back into the queue
+
+Workers take jobs from the SQLite queue in JOB_QUEUE_FILE, run them and store
+the results for the bot to pick up. Run them from the bot's directory, or on
+another machine with data/ and downloads/ on a shared volume. The supervisor
+restarts crashed workers; SIGTERM lets every worker finish its current job.
+"""
+import logging
+import multiprocessing
+import signal
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+from typing import Any, Dict, List
+
+from config import (DOWNLOAD_TIMEOUT, JOB_WORKERS, JOB_HEARTBEAT_INTERVAL, JOB_POLL_INTERVAL,
+                    JOB_RETENTION)
+from jobqueue import job_queue, resolve_job, worker_id
+from logpipe import setup_logging
+
+
+def run_worker() -> None:
+    """Worker process: claim, run and report jobs until SIGTERM."""
+    stop = threading.Event()
+    finished = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+
+    wid = worker_id()
+    state: Dict[str, Any] = {"job": None, "job_started": 0.0, "completed": 0, "failed": 0}
+    started = time.time()
+
+    def heartbeat() -> None:
+        while True:
+            job = state["job"]
+            # A job stuck past the download timeout loses its lease and is retried elsewhere
+            if job is not None and time.time() - state["job_started"] > DOWNLOAD_TIMEOUT:
+                job = None
+            try:
+                job_queue.heartbeat(wid, job, state["completed"], state["failed"], started)
+            except Exception as e:
+                logging.error(f"Heartbeat failed: {e}")
+            if finished.wait(JOB_HEARTBEAT_INTERVAL):
+                return
+
+    heartbeat_thread = threading.Thread(target=heartbeat, name="heartbeat", daemon=True)
+    heartbeat_thread.start()
+    logging.info(f"Worker {wid} started")
+
+    while not stop.is_set():
+        try:
+            job = job_queue.claim(wid)
+        except Exception as e:
+            logging.error(f"Error claiming a job: {e}")
+            job = None
+        if job is None:
+            stop.wait(JOB_POLL_INTERVAL)
+            continue
+
+        state["job"], state["job_started"] = job["id"], time.time()
+        try:
+            result = resolve_job(job["func"])(*job["args"])
+            job_queue.complete(job["id"], wid, result)
+            state["completed"] += 1
+        except Exception as e:
+            logging.warning(f"Job {job['id']} attempt {job['attempts']} failed: {e}")
+            job_queue.fail(job["id"], wid, job["attempts"], f"{type(e).__name__}: {e}\n{traceback.format_exc(limit=3)}")
+            state["failed"] += 1
+        finally:
+            state["job"] = None
+
+    finished.set()
+    heartbeat_thread.join()
+    job_queue.remove_worker(wid)
+    logging.info(f"Worker {wid} stopped")
+
+
+def supervise(processes: int) -> None:
+    """Keep `processes` workers running until SIGTERM, then let them drain."""
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+
+    workers: List[multiprocessing.Process] = []
+    last_recovery = 0.0
+    while not stopping.is_set():
+        if time.monotonic() - last_recovery > JOB_HEARTBEAT_INTERVAL:
+            # Jobs of workers that died on any machine go back to the queue
+            try:
+                job_queue.recover(JOB_RETENTION)
+            except Exception as e:
+                logging.error(f"Error recovering jobs: {e}")
+            last_recovery = time.monotonic()
+        for i, process in enumerate(workers):
+            if not process.is_alive():
+                logging.warning(f"Worker pid {process.pid} exited with {process.exitcode}, restarting")
+                workers[i] = multiprocessing.Process(target=run_worker, daemon=False)
+                workers[i].start()
+        while len(workers) < processes:
+            workers.append(multiprocessing.Process(target=run_worker, daemon=False))
+            workers[-1].start()
+        stopping.wait(1)
+
+    logging.info("Stopping workers")
+    for process in workers:
+        if process.is_alive():
+            process.terminate()
+    deadline = time.monotonic() + DOWNLOAD_TIMEOUT
+    for process in workers:
+        process.join(max(0.0, deadline - time.monotonic()))
+        if process.is_alive():
+            logging.warning(f"Worker pid {process.pid} did not stop in time, killing it")
+            process.kill()
+
+
+def main() -> int:
+    # Worker processes are forked after this and log through the supervisor's writer thread
+    setup_logging("worker", '%(asctime)s - %(processName)s - %(levelname)s - %(message)s')
+    if "--dead-letters" in sys.argv:
+        for job_id, func, args, attempts, error, updated in job_queue.dead_letters():
+            print(f"#{job_id} {func}{args} attempts={attempts} at {datetime.fromtimestamp(updated)}\n  {error}")
+        return 0
+    if "--retry-dead" in sys.argv:
+        print(f"Requeued {job_queue.retry_dead()} jobs")
+        return 0
+
+    processes = JOB_WORKERS
+    if "--processes" in sys.argv:
+        processes = int(sys.argv[sys.argv.index("--processes") + 1])
+    supervise(processes)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
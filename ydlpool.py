@@ -0,0 +1,209 @@
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Dict, Iterator, Optional, Tuple
+
+import yt_dlp
+from yt_dlp.cookies import YoutubeDLCookieJar
+
+from config import COOKIE_FILE, DOWNLOAD_WORKERS
+
+if TYPE_CHECKING:
+    from accounts import Account
+
+BASE_OPTIONS = {
+    'quiet': True,
+    'noplaylist': True,
+    'no_warnings': True,
+    'noprogress': True,
+    # Extraction errors raise, their messages tell an expired login from a removed video
+    'ignoreerrors': 'only_download',
+    'extract_flat': True,
+    'no_color': True
+}
+
+TIKTOK_EXTRACTOR_ARGS = {
+    'api_hostname': 'api16-normal-c-useast1a.tiktokv.com',
+    'app_version': '20.2.1',
+    'device_id': '7168534261740988934',
+    'channel': 'googleplay',
+    'mcc_mnc': '310260',
+    'os_version': '10',
+    'version_code': '200201',
+    'device_type': 'Pixel 4',
+    'language': 'en',
+    'resolution': '1080*1920',
+    'openudid': 'a1b2c3d4e5f6g7h8',
+    'sys_region': 'US',
+    'os_api': '29',
+    'timezone_name': 'America/New_York',
+    'residence': 'US',
+    'app_language': 'en',
+    'ac2_wifi': '0',
+    'dpi': '420',
+    'carrier_region': 'US',
+    'ac': 'wifi',
+    'app_name': 'trill',
+    'device_platform': 'android',
+    'build_number': '10.2.1',
+    'version_name': '10.2.1',
+    'timezone_offset': '-14400',
+    'is_my_cn': '0',
+    'aid': '1340',
+    'ssmix': 'a',
+    'as': 'a1qwert123',
+    'cp': 'androide1',
+    'mas': '0123456789abcdef'
+}
+
+
+def build_options(platform: str, account: Optional["Account"] = None) -> Dict[str, Any]:
+    """yt-dlp options shared by every job of a platform (and Instagram account)."""
+    if platform == "instagram":
+        return {
+            **BASE_OPTIONS,
+            # Carousel posts come back as a playlist of their videos
+            'noplaylist': False,
+            'extractor_args': {
+                'instagram': {
+                    'login': True,
+                    'username': account.username if account else os.getenv('INSTAGRAM_USERNAME', ''),
+                    'password': account.password if account else os.getenv('INSTAGRAM_PASSWORD', '')
+                }
+            }
+        }
+    return {**BASE_OPTIONS, 'extractor_args': {'tiktok': dict(TIKTOK_EXTRACTOR_ARGS)}}
+
+
+class SharedCookieJar:
+    """A cookie file parsed once and shared by all pooled downloaders.
+
+    http.cookiejar guards its cookies with a lock, so one jar can be used by
+    several downloader threads. Saving writes a temp file and renames it, so a
+    crash never leaves a truncated cookies.txt behind.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._jar: Optional[YoutubeDLCookieJar] = None
+        self._lock = threading.Lock()
+
+    @property
+    def jar(self) -> YoutubeDLCookieJar:
+        with self._lock:
+            if self._jar is None:
+                self._jar = YoutubeDLCookieJar(self.path)
+                if os.path.exists(self.path):
+                    self._jar.load()
+            return self._jar
+
+    def save(self) -> None:
+        """Atomically write the cookies back to the cookie file."""
+        with self._lock:
+            if self._jar is None:
+                return
+            tmp_path = f"{self.path}.tmp"
+            self._jar.save(tmp_path)
+            os.replace(tmp_path, self.path)
+
+
+class YDLPool:
+    """Long-lived YoutubeDL instances keyed by (platform, tier, Instagram account).
+
+    Reusing an instance keeps its extractor objects (and their login state)
+    and its request director, so HTTP connections are kept alive across jobs
+    instead of a new TLS handshake per download. An instance serves one job
+    at a time; per-job settings are applied in acquire().
+    """
+
+    def __init__(self, cookie_jar: SharedCookieJar, max_idle: int):
+        self.cookie_jar = cookie_jar
+        # One jar per account cookie file, the default one included
+        self._jars: Dict[str, SharedCookieJar] = {cookie_jar.path: cookie_jar}
+        self.max_idle = max_idle
+        self._idle: Dict[Tuple[str, str, str], "queue.LifoQueue[yt_dlp.YoutubeDL]"] = {}
+        self._lock = threading.Lock()
+        self.counters = {"created": 0, "reused": 0}
+
+    def _queue(self, key: Tuple[str, str, str]) -> "queue.LifoQueue[yt_dlp.YoutubeDL]":
+        with self._lock:
+            if key not in self._idle:
+                self._idle[key] = queue.LifoQueue(maxsize=self.max_idle)
+            return self._idle[key]
+
+    def _jar(self, path: str) -> SharedCookieJar:
+        with self._lock:
+            if path not in self._jars:
+                self._jars[path] = SharedCookieJar(path)
+            return self._jars[path]
+
+    def _create(self, platform: str, account: Optional["Account"] = None) -> yt_dlp.YoutubeDL:
+        ydl = yt_dlp.YoutubeDL(build_options(platform, account))
+        if platform == "instagram":
+            # Replaces the cached_property, so the cookie file is never parsed per instance
+            jar = self._jar(account.cookie_file) if account else self.cookie_jar
+            ydl.__dict__['cookiejar'] = jar.jar
+        self.counters["created"] += 1
+        return ydl
+
+    @contextmanager
+    def acquire(self, platform: str, tier: str, format_spec: Optional[str] = None,
+                outtmpl: Optional[str] = None, max_filesize: Optional[int] = None,
+                account: Optional["Account"] = None) -> Iterator[yt_dlp.YoutubeDL]:
+        """Borrow a downloader configured for one job, logged in as `account` for Instagram."""
+        idle = self._queue((platform, tier, account.name if account else ""))
+        try:
+            ydl = idle.get_nowait()
+            self.counters["reused"] += 1
+        except queue.Empty:
+            ydl = self._create(platform, account)
+
+        # None means yt-dlp's default selector
+        ydl.format_selector = ydl.build_format_selector(format_spec) if format_spec else None
+        ydl.params['outtmpl']['default'] = outtmpl or yt_dlp.utils.DEFAULT_OUTTMPL['default']
+        ydl.params['max_filesize'] = max_filesize
+        ydl.params['merge_output_format'] = 'mp4'
+        healthy = False
+        try:
+            yield ydl
+            healthy = True
+        finally:
+            try:
+                if not healthy:
+                    raise queue.Full
+                idle.put_nowait(ydl)
+            except queue.Full:
+                ydl.close()
+
+    def prewarm(self) -> None:
+        """Create one downloader per platform and tier ahead of the first job."""
+        for platform in ("tiktok", "instagram"):
+            for tier in ("free", "premium"):
+                try:
+                    with self.acquire(platform, tier):
+                        pass
+                except Exception as e:
+                    logging.error(f"Error prewarming {platform} downloader: {e}")
+
+    def close(self) -> None:
+        """Close idle downloaders and save cookies."""
+        with self._lock:
+            queues = list(self._idle.values())
+            self._idle = {}
+        for idle in queues:
+            while True:
+                try:
+                    idle.get_nowait().close()
+                except queue.Empty:
+                    break
+        for jar in list(self._jars.values()):
+            try:
+                jar.save()
+            except OSError as e:
+                logging.error(f"Error saving cookies to {jar.path}: {e}")
+
+
+# Create global downloader pool instance
+ydl_pool = YDLPool(SharedCookieJar(COOKIE_FILE), max_idle=DOWNLOAD_WORKERS)